@@ -25,10 +25,14 @@ GROUP BY exon_set_id, tx_ac;
 -- between e-70 and e-79. We will arbitrarily use the most recent to
 -- prevent cardinality issues elsewhere.  This is why we should use
 -- sequence hashes only.
+--
+-- The most recent annotation of each accession is maintained in the
+-- seq_anno_most_recent table by triggers on seq_anno; this view returns the
+-- corresponding seq_anno rows.
 CREATE OR REPLACE VIEW _seq_anno_most_recent AS
-SELECT DISTINCT ON (ac) *
-FROM seq_anno
-ORDER BY ac,added DESC;
+SELECT SA.*
+FROM seq_anno_most_recent M
+JOIN seq_anno SA ON M.seq_anno_id=SA.seq_anno_id;
 
 
 -- TODO: "distinct" below because the same accession might occur in
@@ -41,6 +45,6 @@ CREATE OR REPLACE VIEW _cds_exons_fp_v AS
 SELECT SA.seq_id, md5(format('%s;%s',LOWER(SA.seq_id),CTEF.cds_se_i)) AS cds_es_fp,
        md5(cds_exon_lengths) AS cds_exon_lengths_fp, CTEF.*
   FROM _cds_exons_flat_v CTEF
-  JOIN _seq_anno_most_recent SA ON CTEF.tx_ac=SA.ac;
+  JOIN seq_anno_most_recent SA ON CTEF.tx_ac=SA.ac;
 
 
@@ -30,29 +30,37 @@ JOIN exon TE ON TES.exon_set_id=TE.exon_set_id
 JOIN exon AE ON AES.exon_set_id=AE.exon_set_id AND TE.ord=AE.ord
 LEFT JOIN exon_aln EA ON TE.exon_id=EA.tx_exon_id AND AE.exon_id=EA.alt_exon_id;
 
+-- The exon_set_exons_fp_mv, tx_exon_set_summary_mv, tx_def_summary_mv,
+-- and tx_exon_aln_mv "matviews" are tables that refresh-matviews
+-- rewrites from their defining views, in full or, with --incremental,
+-- for the transcripts recorded in stale_tx by loaders. The defining
+-- views are set-based joins for full refreshes; exon_set_exons_v groups
+-- by the exon_set primary key so that filters on tx_ac are applied
+-- before aggregation, and tx_def_summary_mv is rewritten incrementally
+-- from _tx_def_summary_by_tx_v, whose lateral lookup (fenced with OFFSET
+-- 0 so that it isn't pulled up) does the same for the CDS exons.
+-- Each table has a unique index on its row key, which refresh-matviews
+-- relies on to reject duplicate rows.
+
 create or replace view exon_set_exons_v as
-select ES.*,EL.n_exons,EL.se_i,EL.starts_i,EL.ends_i,EL.lengths
+select ES.*,count(*) as n_exons,
+     array_to_string(array_agg(format('%s,%s',E.start_i,E.end_i) order by E.ord),';') as se_i,
+     array_agg(E.start_i            order by E.ord) as starts_i,
+     array_agg(E.end_i              order by E.ord) as ends_i,
+     array_agg((E.end_i-E.start_i) order by E.ord) as lengths
 from exon_set ES
-join (select 
-     iES.exon_set_id,
-     count(*) as n_exons,
-     array_to_string(array_agg(format('%s,%s',iE.start_i,iE.end_i) order by iE.ord),';') as se_i,
-     array_agg(iE.start_i            order by iE.ord) as starts_i,
-     array_agg(iE.end_i              order by iE.ord) as ends_i,
-     array_agg((iE.end_i-iE.start_i) order by iE.ord) as lengths
-     from exon_set iES
-     join exon iE on iES.exon_set_id=iE.exon_set_id
-     group by iES.exon_set_id) EL
-     on ES.exon_set_id = EL.exon_set_id;
+join exon E on ES.exon_set_id=E.exon_set_id
+group by ES.exon_set_id;
 comment on view exon_set_exons_v is 'defining view of "flat" (aggregated) exons on a sequence; use _mv; for faster materialized version';
 
 create or replace view  exon_set_exons_fp_v as
 select ESE.*,md5(format('%s;%s',lower(ASA.seq_id),ESE.se_i)) as es_fingerprint
 from exon_set_exons_v ESE
-join _seq_anno_most_recent ASA on ESE.alt_ac=ASA.ac;
+join seq_anno_most_recent ASA on ESE.alt_ac=ASA.ac;
 comment on view exon_set_exons_fp_v is 'flattened (aggregated) exons with exon set fingerprint';
 
-create materialized view exon_set_exons_fp_mv as select * from exon_set_exons_fp_v WITH NO DATA;
+create table exon_set_exons_fp_mv as select * from exon_set_exons_fp_v WITH NO DATA;
+create unique index exon_set_exons_fp_mv_exon_set_id_ix on exon_set_exons_fp_mv(exon_set_id);
 create index exon_set_exons_fp_mv_tx_ac_ix on exon_set_exons_fp_mv(tx_ac);
 create index exon_set_exons_fp_mv_alt_ac_ix on exon_set_exons_fp_mv(alt_ac);
 create index exon_set_exons_fp_mv_alt_aln_method_ix on exon_set_exons_fp_mv(alt_aln_method);
@@ -63,13 +71,13 @@ select hgnc,cds_md5,es_fingerprint,tx_ac,alt_ac,alt_aln_method,alt_strand,exon_s
 from transcript T
 join exon_set_exons_fp_mv ESE on T.ac=ESE.tx_ac;
 
-create materialized view tx_exon_set_summary_mv as select * from tx_exon_set_summary_dv WITH NO DATA;
+create table tx_exon_set_summary_mv as select * from tx_exon_set_summary_dv WITH NO DATA;
+create unique index tx_exon_set_summary_mv_exon_set_id_ix on tx_exon_set_summary_mv(exon_set_id);
 create index tx_exon_set_summary_mv_cds_md5_ix on tx_exon_set_summary_mv(cds_md5);
 create index tx_exon_set_summary_mv_es_fingerprint_ix on tx_exon_set_summary_mv(es_fingerprint);
 create index tx_exon_set_summary_mv_tx_ac_ix on tx_exon_set_summary_mv(tx_ac);
 create index tx_exon_set_summary_mv_alt_ac_ix on tx_exon_set_summary_mv(alt_ac);
 create index tx_exon_set_summary_mv_alt_aln_method_ix on tx_exon_set_summary_mv(alt_aln_method);
-analyze tx_exon_set_summary_mv;
 grant select on tx_exon_set_summary_mv to public;
 
 create or replace view tx_def_summary_dv as
@@ -79,17 +87,42 @@ select TESS.exon_set_id, TESS.tx_ac, TESS.alt_ac, TESS.alt_aln_method, TESS.alt_
        T.cds_start_i, T.cds_end_i, CEF.cds_start_exon, CEF.cds_end_exon
 from tx_exon_set_summary_mv TESS
 join transcript T on TESS.tx_ac=T.ac
-LEFT JOIN _cds_exons_fp_v CEF ON TESS.exon_set_id=CEF.exon_set_id
+left join _cds_exons_fp_v CEF on TESS.exon_set_id=CEF.exon_set_id
 WHERE TESS.alt_aln_method = 'transcript';
 comment on view tx_def_summary_dv is 'transcript definitions, with exon structures';
 
-create materialized view tx_def_summary_mv as select * from tx_def_summary_dv WITH NO DATA;
-comment on materialized view tx_def_summary_mv is 'transcript definitions, with exon structures and fingerprints';
+-- tx_def_summary_dv for incremental refreshes: a filter on tx_ac can't
+-- reach into the CDS exon aggregate of a join, but can into a lateral one
+create or replace view _tx_def_summary_by_tx_v as
+select TESS.exon_set_id, TESS.tx_ac, TESS.alt_ac, TESS.alt_aln_method, TESS.alt_strand,
+       TESS.hgnc, TESS.cds_md5, TESS.es_fingerprint, CEF.cds_es_fp, CEF.cds_exon_lengths_fp, 
+       TESS.n_exons, TESS.se_i, CEF.cds_se_i, TESS.starts_i, TESS.ends_i, TESS.lengths, 
+       T.cds_start_i, T.cds_end_i, CEF.cds_start_exon, CEF.cds_end_exon
+from tx_exon_set_summary_mv TESS
+join transcript T on TESS.tx_ac=T.ac
+left join lateral (select * from _cds_exons_fp_v iCEF where iCEF.exon_set_id=TESS.exon_set_id offset 0) CEF on true
+WHERE TESS.alt_aln_method = 'transcript';
+
+create table tx_def_summary_mv as select * from tx_def_summary_dv WITH NO DATA;
+comment on table tx_def_summary_mv is 'transcript definitions, with exon structures and fingerprints';
 
+create unique index tx_def_summary_mv_exon_set_id on tx_def_summary_mv (exon_set_id);
 create index tx_def_summary_mv_tx_ac on tx_def_summary_mv (tx_ac);
 create index tx_def_summary_mv_alt_ac on tx_def_summary_mv (alt_ac);
 create index tx_def_summary_mv_alt_aln_method on tx_def_summary_mv (alt_aln_method);
 create index tx_def_summary_mv_hgnc on tx_def_summary_mv (hgnc);
+create index tx_def_summary_mv_cds_md5 on tx_def_summary_mv (cds_md5);
+create index tx_def_summary_mv_es_fingerprint on tx_def_summary_mv (es_fingerprint);
+create index tx_def_summary_mv_cds_es_fp on tx_def_summary_mv (cds_es_fp);
+create index tx_def_summary_mv_cds_exon_lengths_fp on tx_def_summary_mv (cds_exon_lengths_fp);
+
+create table tx_exon_aln_mv as select * from tx_exon_aln_v WITH NO DATA;
+-- exon_aln doesn't constrain exon pairs to one alignment, hence exon_aln_id;
+-- exon pairs without an alignment have a null exon_aln_id, which would
+-- otherwise never conflict (ids start at 1)
+create unique index tx_exon_aln_mv_exon_aln_ix on tx_exon_aln_mv(tx_exon_id, alt_exon_id, coalesce(exon_aln_id, 0));
+create index tx_exon_aln_mv_tx_alt_ac_ix on tx_exon_aln_mv(tx_ac, alt_ac, alt_aln_method);
+grant select on tx_exon_aln_mv to public;
 
 
 -- backward compatbility for older view
@@ -97,20 +130,40 @@ create or replace view tx_def_summary_v as
 select * from tx_def_summary_mv;
 
 
-CREATE OR REPLACE VIEW tx_similarity_v AS
-SELECT DISTINCT
-       D1.tx_ac as tx_ac1, D2.tx_ac as tx_ac2,
+-- transcript pairs that share a bucket: an hgnc, cds_md5, or one of
+-- the fingerprints; each bucket is an equijoin, so pairs are found with
+-- hash or index joins rather than by comparing all pairs
+create or replace view tx_similarity_dv as
+select distinct
+       P.tx_ac1, P.tx_ac2,
        D1.hgnc = D2.hgnc as hgnc_eq,
        D1.cds_md5=D2.cds_md5 as cds_eq,
        D1.es_fingerprint=D2.es_fingerprint as es_fp_eq,
        D1.cds_es_fp=D2.cds_es_fp as cds_es_fp_eq,
        D1.cds_exon_lengths_fp=D2.cds_exon_lengths_fp as cds_exon_lengths_fp_eq
-FROM tx_def_summary_mv D1
-JOIN tx_def_summary_mv D2 on (D1.tx_ac != D2.tx_ac
-                              and (D1.hgnc=D2.hgnc
-                                   or D1.cds_md5=D2.cds_md5
-                                   or D1.es_fingerprint=D2.es_fingerprint
-                                   or D1.cds_es_fp=D2.cds_es_fp
-                                   or D1.cds_exon_lengths_fp=D2.cds_exon_lengths_fp
-                                   ));
+from (select iD1.tx_ac as tx_ac1, iD2.tx_ac as tx_ac2
+      from tx_def_summary_mv iD1 join tx_def_summary_mv iD2 on iD1.hgnc=iD2.hgnc
+      union
+      select iD1.tx_ac, iD2.tx_ac
+      from tx_def_summary_mv iD1 join tx_def_summary_mv iD2 on iD1.cds_md5=iD2.cds_md5
+      union
+      select iD1.tx_ac, iD2.tx_ac
+      from tx_def_summary_mv iD1 join tx_def_summary_mv iD2 on iD1.es_fingerprint=iD2.es_fingerprint
+      union
+      select iD1.tx_ac, iD2.tx_ac
+      from tx_def_summary_mv iD1 join tx_def_summary_mv iD2 on iD1.cds_es_fp=iD2.cds_es_fp
+      union
+      select iD1.tx_ac, iD2.tx_ac
+      from tx_def_summary_mv iD1 join tx_def_summary_mv iD2 on iD1.cds_exon_lengths_fp=iD2.cds_exon_lengths_fp
+     ) P
+join tx_def_summary_mv D1 on P.tx_ac1=D1.tx_ac
+join tx_def_summary_mv D2 on P.tx_ac2=D2.tx_ac
+where P.tx_ac1 != P.tx_ac2;
+
+create table tx_similarity_mv as select * from tx_similarity_dv WITH NO DATA;
+create unique index tx_similarity_mv_tx_ac1_tx_ac2 on tx_similarity_mv (tx_ac1, tx_ac2);
+create index tx_similarity_mv_tx_ac2 on tx_similarity_mv (tx_ac2);
+grant select on tx_similarity_mv to public;
 
+CREATE OR REPLACE VIEW tx_similarity_v AS
+SELECT * FROM tx_similarity_mv;
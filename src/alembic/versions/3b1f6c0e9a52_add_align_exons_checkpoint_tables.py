@@ -0,0 +1,52 @@
+"""add align-exons queue and checkpoint tables
+
+Revision ID: 3b1f6c0e9a52
+Revises: 77076df4224c
+Create Date: 2026-10-18 20:02:11.418305
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3b1f6c0e9a52'
+down_revision: Union[str, None] = '77076df4224c'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('align_exons_queue',
+        sa.Column('tx_exon_id', sa.Integer(), nullable=False),
+        sa.Column('alt_exon_id', sa.Integer(), nullable=False),
+        sa.Column('tx_ac', sa.Text(), nullable=False),
+        sa.Column('alt_ac', sa.Text(), nullable=False),
+        sa.Column('alt_strand', sa.SmallInteger(), nullable=False),
+        sa.Column('tx_start_i', sa.Integer(), nullable=False),
+        sa.Column('tx_end_i', sa.Integer(), nullable=False),
+        sa.Column('alt_start_i', sa.Integer(), nullable=False),
+        sa.Column('alt_end_i', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('tx_exon_id', 'alt_exon_id'),
+        schema='uta'
+    )
+    op.create_index('align_exons_queue_tx_ac_alt_ac', 'align_exons_queue', ['tx_ac', 'alt_ac'], unique=False, schema='uta')
+    op.create_table('align_exons_checkpoint',
+        sa.Column('tx_ac', sa.Text(), nullable=False),
+        sa.Column('alt_ac', sa.Text(), nullable=False),
+        sa.Column('status', sa.Text(), nullable=False),
+        sa.Column('reason', sa.Text(), nullable=True),
+        sa.Column('n_pairs', sa.Integer(), nullable=False),
+        sa.Column('updated', sa.DateTime(), nullable=False),
+        sa.CheckConstraint("status in ('done', 'failed')", name='align_exons_checkpoint_status'),
+        sa.PrimaryKeyConstraint('tx_ac', 'alt_ac'),
+        schema='uta'
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('align_exons_checkpoint', schema='uta')
+    op.drop_index('align_exons_queue_tx_ac_alt_ac', table_name='align_exons_queue', schema='uta')
+    op.drop_table('align_exons_queue', schema='uta')
@@ -0,0 +1,95 @@
+"""maintain seq_anno_most_recent with triggers on seq_anno
+
+Revision ID: 3d9a7e5c2b18
+Revises: e7c1a4f9d250
+Create Date: 2026-10-19 03:12:44.208531
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3d9a7e5c2b18'
+down_revision: Union[str, None] = 'e7c1a4f9d250'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.execute("""
+        CREATE OR REPLACE FUNCTION seq_anno_most_recent_sync() RETURNS trigger
+        LANGUAGE plpgsql SET search_path = uta AS $$
+        DECLARE
+            acs text[];
+            prev_acs text[];
+            prev_seq_ids text[];
+        BEGIN
+            IF TG_OP = 'INSERT' THEN
+                SELECT array_agg(DISTINCT N.ac) INTO acs FROM new_rows N;
+            ELSIF TG_OP = 'UPDATE' THEN
+                SELECT array_agg(DISTINCT X.ac) INTO acs FROM (
+                    SELECT N.ac, O.ac AS old_ac FROM new_rows N FULL JOIN old_rows O ON O.seq_anno_id = N.seq_anno_id
+                    WHERE (N.ac, N.seq_id, N.added) IS DISTINCT FROM (O.ac, O.seq_id, O.added)) U,
+                    LATERAL (VALUES (U.ac), (U.old_ac)) X (ac)
+                WHERE X.ac IS NOT NULL;
+            ELSE
+                SELECT array_agg(DISTINCT O.ac) INTO acs FROM old_rows O;
+            END IF;
+            IF acs IS NULL THEN
+                RETURN NULL;
+            END IF;
+
+            SELECT array_agg(M.ac), array_agg(M.seq_id) INTO prev_acs, prev_seq_ids
+            FROM seq_anno_most_recent M WHERE M.ac = ANY(acs);
+            DELETE FROM seq_anno_most_recent M WHERE M.ac = ANY(acs);
+            INSERT INTO seq_anno_most_recent (ac, seq_anno_id, seq_id, added)
+            SELECT DISTINCT ON (A.ac) A.ac, A.seq_anno_id, A.seq_id, A.added
+            FROM seq_anno A WHERE A.ac = ANY(acs)
+            ORDER BY A.ac, A.added DESC, A.seq_anno_id DESC;
+
+            WITH changed AS (
+                SELECT A.ac FROM unnest(acs) A (ac)
+                LEFT JOIN unnest(prev_acs, prev_seq_ids) P (ac, seq_id) ON P.ac = A.ac
+                LEFT JOIN seq_anno_most_recent M ON M.ac = A.ac
+                WHERE TG_OP = 'DELETE' OR M.seq_id IS DISTINCT FROM P.seq_id
+            )
+            INSERT INTO stale_tx (tx_ac, added)
+            SELECT tx_ac, clock_timestamp() FROM (
+                SELECT ES.tx_ac FROM exon_set ES WHERE ES.tx_ac IN (SELECT ac FROM changed)
+                UNION
+                SELECT ES.tx_ac FROM exon_set ES WHERE ES.alt_ac IN (SELECT ac FROM changed)) C
+            ON CONFLICT (tx_ac) DO UPDATE SET added = clock_timestamp();
+            RETURN NULL;
+        END
+        $$;
+
+        CREATE TRIGGER seq_anno_most_recent_ins AFTER INSERT ON seq_anno
+            REFERENCING NEW TABLE AS new_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION seq_anno_most_recent_sync();
+        CREATE TRIGGER seq_anno_most_recent_upd AFTER UPDATE ON seq_anno
+            REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION seq_anno_most_recent_sync();
+        CREATE TRIGGER seq_anno_most_recent_del AFTER DELETE ON seq_anno
+            REFERENCING OLD TABLE AS old_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION seq_anno_most_recent_sync();
+    """)
+    # rebuild from seq_anno, for rows written other than by load-seqinfo
+    op.execute("""
+        DELETE FROM seq_anno_most_recent;
+        INSERT INTO seq_anno_most_recent (ac, seq_anno_id, seq_id, added)
+            SELECT DISTINCT ON (ac) ac, seq_anno_id, seq_id, added
+            FROM seq_anno
+            ORDER BY ac, added DESC, seq_anno_id DESC;
+    """)
+
+
+def downgrade() -> None:
+    op.execute("""
+        DROP TRIGGER IF EXISTS seq_anno_most_recent_del ON seq_anno;
+        DROP TRIGGER IF EXISTS seq_anno_most_recent_upd ON seq_anno;
+        DROP TRIGGER IF EXISTS seq_anno_most_recent_ins ON seq_anno;
+        DROP FUNCTION IF EXISTS seq_anno_most_recent_sync();
+    """)
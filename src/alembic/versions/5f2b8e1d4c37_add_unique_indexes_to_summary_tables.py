@@ -0,0 +1,36 @@
+"""add unique indexes to exon set summary tables
+
+Revision ID: 5f2b8e1d4c37
+Revises: c4e9b2d7a6f1
+Create Date: 2026-10-18 23:12:48.206731
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5f2b8e1d4c37'
+down_revision: Union[str, None] = 'c4e9b2d7a6f1'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.execute("""
+        CREATE UNIQUE INDEX exon_set_exons_fp_mv_exon_set_id_ix ON exon_set_exons_fp_mv(exon_set_id);
+        CREATE UNIQUE INDEX tx_exon_set_summary_mv_exon_set_id_ix ON tx_exon_set_summary_mv(exon_set_id);
+        CREATE UNIQUE INDEX tx_def_summary_mv_exon_set_id ON tx_def_summary_mv (exon_set_id);
+        CREATE UNIQUE INDEX tx_exon_aln_mv_exon_aln_ix ON tx_exon_aln_mv(tx_exon_id, alt_exon_id, exon_aln_id);
+    """)
+
+
+def downgrade() -> None:
+    op.execute("""
+        DROP INDEX IF EXISTS tx_exon_aln_mv_exon_aln_ix;
+        DROP INDEX IF EXISTS tx_def_summary_mv_exon_set_id;
+        DROP INDEX IF EXISTS tx_exon_set_summary_mv_exon_set_id_ix;
+        DROP INDEX IF EXISTS exon_set_exons_fp_mv_exon_set_id_ix;
+    """)
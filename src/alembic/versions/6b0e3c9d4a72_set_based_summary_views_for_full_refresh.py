@@ -0,0 +1,87 @@
+"""use set-based defining views for full summary table refreshes
+
+Revision ID: 6b0e3c9d4a72
+Revises: 3d9a7e5c2b18
+Create Date: 2026-10-19 04:02:17.615093
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '6b0e3c9d4a72'
+down_revision: Union[str, None] = '3d9a7e5c2b18'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # lateral lookups make full refreshes nested loops over exon sets; keep
+    # the defining views set-based and give incremental refreshes of
+    # tx_def_summary_mv a lateral variant instead.  Grouping by the exon_set
+    # key still lets a filter on tx_ac reach exon_set_exons_v's index.
+    op.execute("""
+        CREATE OR REPLACE VIEW exon_set_exons_v AS
+            SELECT ES.*,count(*) AS n_exons,
+                 array_to_string(array_agg(format('%s,%s',E.start_i,E.end_i) ORDER BY E.ord),';') AS se_i,
+                 array_agg(E.start_i            ORDER BY E.ord) AS starts_i,
+                 array_agg(E.end_i              ORDER BY E.ord) AS ends_i,
+                 array_agg((E.end_i-E.start_i) ORDER BY E.ord) AS lengths
+            FROM exon_set ES
+            JOIN exon E ON ES.exon_set_id=E.exon_set_id
+            GROUP BY ES.exon_set_id;
+    """)
+    op.execute("""
+        CREATE OR REPLACE VIEW tx_def_summary_dv AS
+            SELECT TESS.exon_set_id, TESS.tx_ac, TESS.alt_ac, TESS.alt_aln_method, TESS.alt_strand,
+                   TESS.symbol, TESS.hgnc, TESS.gene_id, TESS.cds_md5, TESS.es_fingerprint, CEF.cds_es_fp,
+                   CEF.cds_exon_lengths_fp, TESS.n_exons, TESS.se_i, CEF.cds_se_i, TESS.starts_i,
+                   TESS.ends_i, TESS.lengths, T.cds_start_i, T.cds_end_i, CEF.cds_start_exon, CEF.cds_end_exon
+            FROM tx_exon_set_summary_mv TESS
+            JOIN transcript T ON TESS.tx_ac=T.ac
+            LEFT JOIN _cds_exons_fp_v CEF ON TESS.exon_set_id=CEF.exon_set_id
+            WHERE TESS.alt_aln_method = 'transcript';
+    """)
+    op.execute("""
+        CREATE OR REPLACE VIEW _tx_def_summary_by_tx_v AS
+            SELECT TESS.exon_set_id, TESS.tx_ac, TESS.alt_ac, TESS.alt_aln_method, TESS.alt_strand,
+                   TESS.symbol, TESS.hgnc, TESS.gene_id, TESS.cds_md5, TESS.es_fingerprint, CEF.cds_es_fp,
+                   CEF.cds_exon_lengths_fp, TESS.n_exons, TESS.se_i, CEF.cds_se_i, TESS.starts_i,
+                   TESS.ends_i, TESS.lengths, T.cds_start_i, T.cds_end_i, CEF.cds_start_exon, CEF.cds_end_exon
+            FROM tx_exon_set_summary_mv TESS
+            JOIN transcript T ON TESS.tx_ac=T.ac
+            LEFT JOIN LATERAL (SELECT * FROM _cds_exons_fp_v iCEF WHERE iCEF.exon_set_id=TESS.exon_set_id OFFSET 0) CEF ON true
+            WHERE TESS.alt_aln_method = 'transcript';
+    """)
+
+
+def downgrade() -> None:
+    op.execute("DROP VIEW IF EXISTS _tx_def_summary_by_tx_v;")
+    op.execute("""
+        CREATE OR REPLACE VIEW tx_def_summary_dv AS
+            SELECT TESS.exon_set_id, TESS.tx_ac, TESS.alt_ac, TESS.alt_aln_method, TESS.alt_strand,
+                   TESS.symbol, TESS.hgnc, TESS.gene_id, TESS.cds_md5, TESS.es_fingerprint, CEF.cds_es_fp,
+                   CEF.cds_exon_lengths_fp, TESS.n_exons, TESS.se_i, CEF.cds_se_i, TESS.starts_i,
+                   TESS.ends_i, TESS.lengths, T.cds_start_i, T.cds_end_i, CEF.cds_start_exon, CEF.cds_end_exon
+            FROM tx_exon_set_summary_mv TESS
+            JOIN transcript T ON TESS.tx_ac=T.ac
+            LEFT JOIN LATERAL (SELECT * FROM _cds_exons_fp_v iCEF WHERE iCEF.exon_set_id=TESS.exon_set_id OFFSET 0) CEF ON true
+            WHERE TESS.alt_aln_method = 'transcript';
+    """)
+    op.execute("""
+        CREATE OR REPLACE VIEW exon_set_exons_v AS
+            SELECT ES.*,EL.n_exons,EL.se_i,EL.starts_i,EL.ends_i,EL.lengths
+            FROM exon_set ES
+            JOIN LATERAL (SELECT
+                 count(*) AS n_exons,
+                 array_to_string(array_agg(format('%s,%s',iE.start_i,iE.end_i) ORDER BY iE.ord),';') AS se_i,
+                 array_agg(iE.start_i            ORDER BY iE.ord) AS starts_i,
+                 array_agg(iE.end_i              ORDER BY iE.ord) AS ends_i,
+                 array_agg((iE.end_i-iE.start_i) ORDER BY iE.ord) AS lengths
+                 FROM exon iE
+                 WHERE iE.exon_set_id = ES.exon_set_id
+                 GROUP BY iE.exon_set_id) EL ON true;
+    """)
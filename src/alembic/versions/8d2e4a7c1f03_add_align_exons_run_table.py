@@ -0,0 +1,35 @@
+"""add align-exons run table for sharded runs
+
+Revision ID: 8d2e4a7c1f03
+Revises: 3b1f6c0e9a52
+Create Date: 2026-10-18 20:41:37.902114
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8d2e4a7c1f03'
+down_revision: Union[str, None] = '3b1f6c0e9a52'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('align_exons_run',
+        sa.Column('n_shards', sa.Integer(), nullable=False),
+        sa.Column('shard', sa.Integer(), nullable=False),
+        sa.Column('status', sa.Text(), nullable=False),
+        sa.Column('started', sa.DateTime(), nullable=False),
+        sa.Column('finished', sa.DateTime(), nullable=True),
+        sa.CheckConstraint("status in ('running', 'done')", name='align_exons_run_status'),
+        sa.PrimaryKeyConstraint('n_shards', 'shard'),
+        schema='uta'
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('align_exons_run', schema='uta')
@@ -0,0 +1,35 @@
+"""make the unique key of tx_exon_aln_mv non-null
+
+Revision ID: 9c4f1e7a3b60
+Revises: 6b0e3c9d4a72
+Create Date: 2026-10-19 05:11:42.380517
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9c4f1e7a3b60'
+down_revision: Union[str, None] = '6b0e3c9d4a72'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # exon pairs without an alignment have a null exon_aln_id, which
+    # would otherwise never conflict (ids start at 1)
+    op.execute("""
+        DROP INDEX IF EXISTS tx_exon_aln_mv_exon_aln_ix;
+        CREATE UNIQUE INDEX tx_exon_aln_mv_exon_aln_ix
+            ON tx_exon_aln_mv(tx_exon_id, alt_exon_id, coalesce(exon_aln_id, 0));
+    """)
+
+
+def downgrade() -> None:
+    op.execute("""
+        DROP INDEX IF EXISTS tx_exon_aln_mv_exon_aln_ix;
+        CREATE UNIQUE INDEX tx_exon_aln_mv_exon_aln_ix ON tx_exon_aln_mv(tx_exon_id, alt_exon_id, exon_aln_id);
+    """)
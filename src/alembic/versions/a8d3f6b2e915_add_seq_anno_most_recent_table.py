@@ -0,0 +1,78 @@
+"""add seq_anno_most_recent table in place of DISTINCT ON view
+
+Revision ID: a8d3f6b2e915
+Revises: 5f2b8e1d4c37
+Create Date: 2026-10-19 00:18:33.571204
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a8d3f6b2e915'
+down_revision: Union[str, None] = '5f2b8e1d4c37'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('seq_anno_most_recent',
+        sa.Column('ac', sa.Text(), nullable=False),
+        sa.Column('seq_anno_id', sa.Integer(), nullable=False),
+        sa.Column('seq_id', sa.Text(), nullable=True),
+        sa.Column('added', sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(['seq_anno_id'], ['uta.seq_anno.seq_anno_id'], onupdate='CASCADE', ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('ac', postgresql_include=['seq_id']),
+        schema='uta'
+    )
+    op.execute("""
+        INSERT INTO seq_anno_most_recent (ac, seq_anno_id, seq_id, added)
+            SELECT DISTINCT ON (ac) ac, seq_anno_id, seq_id, added
+            FROM seq_anno
+            ORDER BY ac, added DESC, seq_anno_id DESC;
+    """)
+    op.execute("""
+        CREATE OR REPLACE VIEW _seq_anno_most_recent AS
+            SELECT SA.*
+            FROM seq_anno_most_recent M
+            JOIN seq_anno SA ON M.seq_anno_id=SA.seq_anno_id;
+    """)
+    op.execute("""
+        CREATE OR REPLACE VIEW exon_set_exons_fp_v AS
+            SELECT ESE.*,md5(format('%s;%s',lower(ASA.seq_id),ESE.se_i)) AS es_fingerprint
+            FROM exon_set_exons_v ESE
+            JOIN seq_anno_most_recent ASA ON ESE.alt_ac=ASA.ac;
+    """)
+    op.execute("""
+        CREATE OR REPLACE VIEW _cds_exons_fp_v AS
+            SELECT SA.seq_id, md5(format('%s;%s',LOWER(SA.seq_id),CTEF.cds_se_i)) AS cds_es_fp,
+                   md5(cds_exon_lengths) AS cds_exon_lengths_fp, CTEF.*
+            FROM _cds_exons_flat_v CTEF
+            JOIN seq_anno_most_recent SA ON CTEF.tx_ac=SA.ac;
+    """)
+
+
+def downgrade() -> None:
+    op.execute("""
+        CREATE OR REPLACE VIEW _seq_anno_most_recent AS
+            SELECT DISTINCT ON (ac) *
+            FROM seq_anno
+            ORDER BY ac,added DESC;
+    """)
+    op.execute("""
+        CREATE OR REPLACE VIEW exon_set_exons_fp_v AS
+            SELECT ESE.*,md5(format('%s;%s',lower(ASA.seq_id),ESE.se_i)) AS es_fingerprint
+            FROM exon_set_exons_v ESE
+            JOIN LATERAL (SELECT iSA.seq_id FROM _seq_anno_most_recent iSA WHERE iSA.ac=ESE.alt_ac OFFSET 0) ASA ON true;
+    """)
+    op.execute("""
+        CREATE OR REPLACE VIEW _cds_exons_fp_v AS
+            SELECT SA.seq_id, md5(format('%s;%s',LOWER(SA.seq_id),CTEF.cds_se_i)) AS cds_es_fp,
+                   md5(cds_exon_lengths) AS cds_exon_lengths_fp, CTEF.*
+            FROM _cds_exons_flat_v CTEF
+            JOIN LATERAL (SELECT ISA.seq_id FROM _seq_anno_most_recent ISA WHERE ISA.ac=CTEF.tx_ac OFFSET 0) SA ON true;
+    """)
+    op.drop_table('seq_anno_most_recent', schema='uta')
@@ -0,0 +1,241 @@
+"""maintain exon set summaries as tables for incremental refresh
+
+Revision ID: c4e9b2d7a6f1
+Revises: 8d2e4a7c1f03
+Create Date: 2026-10-18 22:05:12.418390
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c4e9b2d7a6f1'
+down_revision: Union[str, None] = '8d2e4a7c1f03'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('stale_tx',
+        sa.Column('tx_ac', sa.Text(), nullable=False),
+        sa.Column('added', sa.DateTime(), server_default=sa.text('now()'), nullable=False),
+        sa.PrimaryKeyConstraint('tx_ac'),
+        schema='uta'
+    )
+
+    # defining views, with lateral lookups (fenced with OFFSET 0 so that
+    # they aren't pulled up) so that filters on tx_ac use indexes
+    op.execute("""
+        CREATE OR REPLACE VIEW exon_set_exons_v AS
+            SELECT ES.*,EL.n_exons,EL.se_i,EL.starts_i,EL.ends_i,EL.lengths
+            FROM exon_set ES
+            JOIN LATERAL (SELECT
+                 count(*) AS n_exons,
+                 array_to_string(array_agg(format('%s,%s',iE.start_i,iE.end_i) ORDER BY iE.ord),';') AS se_i,
+                 array_agg(iE.start_i            ORDER BY iE.ord) AS starts_i,
+                 array_agg(iE.end_i              ORDER BY iE.ord) AS ends_i,
+                 array_agg((iE.end_i-iE.start_i) ORDER BY iE.ord) AS lengths
+                 FROM exon iE
+                 WHERE iE.exon_set_id = ES.exon_set_id
+                 GROUP BY iE.exon_set_id) EL ON true;
+    """)
+    op.execute("""
+        CREATE OR REPLACE VIEW exon_set_exons_fp_v AS
+            SELECT ESE.*,md5(format('%s;%s',lower(ASA.seq_id),ESE.se_i)) AS es_fingerprint
+            FROM exon_set_exons_v ESE
+            JOIN LATERAL (SELECT iSA.seq_id FROM _seq_anno_most_recent iSA WHERE iSA.ac=ESE.alt_ac OFFSET 0) ASA ON true;
+    """)
+    op.execute("""
+        CREATE OR REPLACE VIEW _cds_exons_fp_v AS
+            SELECT SA.seq_id, md5(format('%s;%s',LOWER(SA.seq_id),CTEF.cds_se_i)) AS cds_es_fp,
+                   md5(cds_exon_lengths) AS cds_exon_lengths_fp, CTEF.*
+            FROM _cds_exons_flat_v CTEF
+            JOIN LATERAL (SELECT ISA.seq_id FROM _seq_anno_most_recent ISA WHERE ISA.ac=CTEF.tx_ac OFFSET 0) SA ON true;
+    """)
+
+    # replace matviews with tables of the same names, rewritten by refresh-matviews
+    op.execute("DROP VIEW IF EXISTS tx_similarity_v CASCADE;")
+    op.execute("DROP MATERIALIZED VIEW IF EXISTS tx_def_summary_mv CASCADE;")
+    op.execute("DROP VIEW IF EXISTS tx_def_summary_dv CASCADE;")
+    op.execute("DROP MATERIALIZED VIEW IF EXISTS tx_exon_set_summary_mv CASCADE;")
+    op.execute("DROP VIEW IF EXISTS tx_exon_set_summary_dv CASCADE;")
+    op.execute("DROP MATERIALIZED VIEW IF EXISTS exon_set_exons_fp_mv CASCADE;")
+    op.execute("DROP MATERIALIZED VIEW IF EXISTS tx_exon_aln_mv CASCADE;")
+    op.execute("""
+            CREATE TABLE exon_set_exons_fp_mv AS SELECT * FROM exon_set_exons_fp_v WITH NO DATA;
+            CREATE INDEX exon_set_exons_fp_mv_tx_ac_ix ON exon_set_exons_fp_mv(tx_ac);
+            CREATE INDEX exon_set_exons_fp_mv_alt_ac_ix ON exon_set_exons_fp_mv(alt_ac);
+            CREATE INDEX exon_set_exons_fp_mv_alt_aln_method_ix ON exon_set_exons_fp_mv(alt_aln_method);
+            GRANT SELECT ON exon_set_exons_fp_mv TO public;
+        """)
+    op.execute("""
+            CREATE VIEW tx_exon_set_summary_dv AS
+                SELECT G.symbol, G.symbol as hgnc, G.gene_id, cds_md5, es_fingerprint, tx_ac, alt_ac,
+                       alt_aln_method, alt_strand, exon_set_id, n_exons, se_i, starts_i, ends_i, lengths
+                FROM transcript T
+                JOIN gene G ON T.gene_id=G.gene_id
+                JOIN exon_set_exons_fp_mv ESE ON T.ac=ESE.tx_ac;
+        """)
+    op.execute("""
+            CREATE TABLE tx_exon_set_summary_mv AS SELECT * FROM tx_exon_set_summary_dv WITH NO DATA;
+            CREATE INDEX tx_exon_set_summary_mv_cds_md5_ix ON tx_exon_set_summary_mv(cds_md5);
+            CREATE INDEX tx_exon_set_summary_mv_es_fingerprint_ix ON tx_exon_set_summary_mv(es_fingerprint);
+            CREATE INDEX tx_exon_set_summary_mv_tx_ac_ix ON tx_exon_set_summary_mv(tx_ac);
+            CREATE INDEX tx_exon_set_summary_mv_alt_ac_ix ON tx_exon_set_summary_mv(alt_ac);
+            CREATE INDEX tx_exon_set_summary_mv_alt_aln_method_ix ON tx_exon_set_summary_mv(alt_aln_method);
+            GRANT SELECT ON tx_exon_set_summary_mv TO public;
+        """)
+    op.execute("""
+            CREATE VIEW tx_def_summary_dv AS
+                SELECT TESS.exon_set_id, TESS.tx_ac, TESS.alt_ac, TESS.alt_aln_method, TESS.alt_strand,
+                       TESS.symbol, TESS.hgnc, TESS.gene_id, TESS.cds_md5, TESS.es_fingerprint, CEF.cds_es_fp,
+                       CEF.cds_exon_lengths_fp, TESS.n_exons, TESS.se_i, CEF.cds_se_i, TESS.starts_i,
+                       TESS.ends_i, TESS.lengths, T.cds_start_i, T.cds_end_i, CEF.cds_start_exon, CEF.cds_end_exon
+                FROM tx_exon_set_summary_mv TESS
+                JOIN transcript T ON TESS.tx_ac=T.ac
+                LEFT JOIN LATERAL (SELECT * FROM _cds_exons_fp_v iCEF
+                                   WHERE iCEF.exon_set_id=TESS.exon_set_id OFFSET 0) CEF ON true
+                WHERE TESS.alt_aln_method = 'transcript';
+        """)
+    op.execute("""
+            CREATE TABLE tx_def_summary_mv AS SELECT * FROM tx_def_summary_dv WITH NO DATA;
+            CREATE INDEX tx_def_summary_mv_tx_ac ON tx_def_summary_mv (tx_ac);
+            CREATE INDEX tx_def_summary_mv_alt_ac ON tx_def_summary_mv (alt_ac);
+            CREATE INDEX tx_def_summary_mv_alt_aln_method ON tx_def_summary_mv (alt_aln_method);
+            CREATE INDEX tx_def_summary_mv_hgnc ON tx_def_summary_mv (hgnc);
+            CREATE INDEX tx_def_summary_mv_symbol ON tx_def_summary_mv (symbol);
+            CREATE INDEX tx_def_summary_mv_gene_id ON tx_def_summary_mv (gene_id);
+        """)
+    _create_tx_similarity_v()
+    op.execute("""
+            CREATE TABLE tx_exon_aln_mv AS SELECT * FROM tx_exon_aln_v WITH NO DATA;
+            CREATE INDEX tx_exon_aln_mv_tx_alt_ac_ix ON tx_exon_aln_mv(tx_ac, alt_ac, alt_aln_method);
+            GRANT SELECT ON tx_exon_aln_mv TO public;
+        """)
+    op.execute("""
+            INSERT INTO exon_set_exons_fp_mv SELECT * FROM exon_set_exons_fp_v;
+            INSERT INTO tx_exon_set_summary_mv SELECT * FROM tx_exon_set_summary_dv;
+            INSERT INTO tx_def_summary_mv SELECT * FROM tx_def_summary_dv;
+            INSERT INTO tx_exon_aln_mv SELECT * FROM tx_exon_aln_v;
+        """)
+
+
+def downgrade() -> None:
+    op.execute("DROP VIEW IF EXISTS tx_similarity_v CASCADE;")
+    op.execute("DROP TABLE IF EXISTS tx_def_summary_mv CASCADE;")
+    op.execute("DROP VIEW IF EXISTS tx_def_summary_dv CASCADE;")
+    op.execute("DROP TABLE IF EXISTS tx_exon_set_summary_mv CASCADE;")
+    op.execute("DROP VIEW IF EXISTS tx_exon_set_summary_dv CASCADE;")
+    op.execute("DROP TABLE IF EXISTS exon_set_exons_fp_mv CASCADE;")
+    op.execute("DROP TABLE IF EXISTS tx_exon_aln_mv CASCADE;")
+
+    op.execute("""
+        CREATE OR REPLACE VIEW _cds_exons_fp_v AS
+            SELECT SA.seq_id, md5(format('%s;%s',LOWER(SA.seq_id),CTEF.cds_se_i)) AS cds_es_fp,
+                   md5(cds_exon_lengths) AS cds_exon_lengths_fp, CTEF.*
+            FROM _cds_exons_flat_v CTEF
+            JOIN _seq_anno_most_recent SA ON CTEF.tx_ac=SA.ac;
+    """)
+    op.execute("""
+        CREATE OR REPLACE VIEW exon_set_exons_fp_v AS
+            SELECT ESE.*,md5(format('%s;%s',lower(ASA.seq_id),ESE.se_i)) AS es_fingerprint
+            FROM exon_set_exons_v ESE
+            JOIN _seq_anno_most_recent ASA ON ESE.alt_ac=ASA.ac;
+    """)
+    op.execute("""
+        CREATE OR REPLACE VIEW exon_set_exons_v AS
+            SELECT ES.*,EL.n_exons,EL.se_i,EL.starts_i,EL.ends_i,EL.lengths
+            FROM exon_set ES
+            JOIN (SELECT
+                 iES.exon_set_id,
+                 count(*) AS n_exons,
+                 array_to_string(array_agg(format('%s,%s',iE.start_i,iE.end_i) ORDER BY iE.ord),';') AS se_i,
+                 array_agg(iE.start_i            ORDER BY iE.ord) AS starts_i,
+                 array_agg(iE.end_i              ORDER BY iE.ord) AS ends_i,
+                 array_agg((iE.end_i-iE.start_i) ORDER BY iE.ord) AS lengths
+                 FROM exon_set iES
+                 JOIN exon iE ON iES.exon_set_id=iE.exon_set_id
+                 GROUP BY iES.exon_set_id) EL
+                 ON ES.exon_set_id = EL.exon_set_id;
+    """)
+
+    op.execute("""
+        CREATE MATERIALIZED VIEW exon_set_exons_fp_mv AS SELECT * FROM exon_set_exons_fp_v WITH NO DATA;
+        CREATE INDEX exon_set_exons_fp_mv_tx_ac_ix ON exon_set_exons_fp_mv(tx_ac);
+        CREATE INDEX exon_set_exons_fp_mv_alt_ac_ix ON exon_set_exons_fp_mv(alt_ac);
+        CREATE INDEX exon_set_exons_fp_mv_alt_aln_method_ix ON exon_set_exons_fp_mv(alt_aln_method);
+        GRANT SELECT ON exon_set_exons_fp_mv TO public;
+        REFRESH MATERIALIZED VIEW exon_set_exons_fp_mv;
+    """)
+    op.execute("""
+            CREATE VIEW tx_exon_set_summary_dv AS
+                SELECT G.symbol, G.symbol as hgnc, G.gene_id, cds_md5, es_fingerprint, tx_ac, alt_ac,
+                       alt_aln_method, alt_strand, exon_set_id, n_exons, se_i, starts_i, ends_i, lengths
+                FROM transcript T
+                JOIN gene G ON T.gene_id=G.gene_id
+                JOIN exon_set_exons_fp_mv ESE ON T.ac=ESE.tx_ac;
+        """)
+    op.execute("""
+            CREATE MATERIALIZED VIEW tx_exon_set_summary_mv AS SELECT * FROM tx_exon_set_summary_dv WITH NO DATA;
+            CREATE INDEX tx_exon_set_summary_mv_cds_md5_ix ON tx_exon_set_summary_mv(cds_md5);
+            CREATE INDEX tx_exon_set_summary_mv_es_fingerprint_ix ON tx_exon_set_summary_mv(es_fingerprint);
+            CREATE INDEX tx_exon_set_summary_mv_tx_ac_ix ON tx_exon_set_summary_mv(tx_ac);
+            CREATE INDEX tx_exon_set_summary_mv_alt_ac_ix ON tx_exon_set_summary_mv(alt_ac);
+            CREATE INDEX tx_exon_set_summary_mv_alt_aln_method_ix ON tx_exon_set_summary_mv(alt_aln_method);
+            GRANT SELECT ON tx_exon_set_summary_mv TO public;
+            REFRESH MATERIALIZED VIEW tx_exon_set_summary_mv;
+        """)
+    op.execute("""
+            CREATE VIEW tx_def_summary_dv AS
+                SELECT TESS.exon_set_id, TESS.tx_ac, TESS.alt_ac, TESS.alt_aln_method, TESS.alt_strand,
+                       TESS.symbol, TESS.hgnc, TESS.gene_id, TESS.cds_md5, TESS.es_fingerprint, CEF.cds_es_fp,
+                       CEF.cds_exon_lengths_fp, TESS.n_exons, TESS.se_i, CEF.cds_se_i, TESS.starts_i,
+                       TESS.ends_i, TESS.lengths, T.cds_start_i, T.cds_end_i, CEF.cds_start_exon, CEF.cds_end_exon
+                FROM tx_exon_set_summary_mv TESS
+                JOIN transcript T ON TESS.tx_ac=T.ac
+                LEFT JOIN _cds_exons_fp_v CEF ON TESS.exon_set_id=CEF.exon_set_id
+                WHERE TESS.alt_aln_method = 'transcript';
+        """)
+    op.execute("""
+            CREATE MATERIALIZED VIEW tx_def_summary_mv AS SELECT * FROM tx_def_summary_dv WITH NO DATA;
+            CREATE INDEX tx_def_summary_mv_tx_ac ON tx_def_summary_mv (tx_ac);
+            CREATE INDEX tx_def_summary_mv_alt_ac ON tx_def_summary_mv (alt_ac);
+            CREATE INDEX tx_def_summary_mv_alt_aln_method ON tx_def_summary_mv (alt_aln_method);
+            CREATE INDEX tx_def_summary_mv_hgnc ON tx_def_summary_mv (hgnc);
+            CREATE INDEX tx_def_summary_mv_symbol ON tx_def_summary_mv (symbol);
+            CREATE INDEX tx_def_summary_mv_gene_id ON tx_def_summary_mv (gene_id);
+            REFRESH MATERIALIZED VIEW tx_def_summary_mv;
+        """)
+    _create_tx_similarity_v()
+    op.execute("""
+            CREATE MATERIALIZED VIEW tx_exon_aln_mv AS SELECT * FROM tx_exon_aln_v WITH NO DATA;
+            CREATE INDEX tx_exon_aln_mv_tx_alt_ac_ix ON tx_exon_aln_mv(tx_ac, alt_ac, alt_aln_method);
+            REFRESH MATERIALIZED VIEW tx_exon_aln_mv;
+        """)
+
+    op.drop_table('stale_tx', schema='uta')
+
+
+def _create_tx_similarity_v() -> None:
+    op.execute("""
+        CREATE VIEW tx_similarity_v AS
+        SELECT DISTINCT
+               D1.tx_ac as tx_ac1, D2.tx_ac as tx_ac2,
+               D1.hgnc = D2.hgnc as hgnc_eq,
+               D1.symbol = D2.symbol as symbol_eq,
+               D1.cds_md5=D2.cds_md5 as cds_eq,
+               D1.es_fingerprint=D2.es_fingerprint as es_fp_eq,
+               D1.cds_es_fp=D2.cds_es_fp as cds_es_fp_eq,
+               D1.cds_exon_lengths_fp=D2.cds_exon_lengths_fp as cds_exon_lengths_fp_eq
+        FROM tx_def_summary_mv D1
+        JOIN tx_def_summary_mv D2 on (D1.tx_ac != D2.tx_ac
+                                      and (D1.symbol=D2.symbol
+                                           or D1.cds_md5=D2.cds_md5
+                                           or D1.es_fingerprint=D2.es_fingerprint
+                                           or D1.cds_es_fp=D2.cds_es_fp
+                                           or D1.cds_exon_lengths_fp=D2.cds_exon_lengths_fp
+                                           ));
+    """)
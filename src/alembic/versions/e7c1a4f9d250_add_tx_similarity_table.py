@@ -0,0 +1,99 @@
+"""add tx_similarity_mv table of co-bucketed transcript pairs
+
+Revision ID: e7c1a4f9d250
+Revises: a8d3f6b2e915
+Create Date: 2026-10-19 01:26:05.930417
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e7c1a4f9d250'
+down_revision: Union[str, None] = 'a8d3f6b2e915'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.execute("""
+        CREATE INDEX tx_def_summary_mv_cds_md5 ON tx_def_summary_mv (cds_md5);
+        CREATE INDEX tx_def_summary_mv_es_fingerprint ON tx_def_summary_mv (es_fingerprint);
+        CREATE INDEX tx_def_summary_mv_cds_es_fp ON tx_def_summary_mv (cds_es_fp);
+        CREATE INDEX tx_def_summary_mv_cds_exon_lengths_fp ON tx_def_summary_mv (cds_exon_lengths_fp);
+    """)
+    # pairs that share a bucket (symbol, cds_md5, or a fingerprint), found
+    # with one equijoin per bucket instead of a join on an OR of them
+    op.execute("""
+        CREATE VIEW tx_similarity_dv AS
+        SELECT DISTINCT
+               P.tx_ac1, P.tx_ac2,
+               D1.hgnc = D2.hgnc as hgnc_eq,
+               D1.symbol = D2.symbol as symbol_eq,
+               D1.cds_md5=D2.cds_md5 as cds_eq,
+               D1.es_fingerprint=D2.es_fingerprint as es_fp_eq,
+               D1.cds_es_fp=D2.cds_es_fp as cds_es_fp_eq,
+               D1.cds_exon_lengths_fp=D2.cds_exon_lengths_fp as cds_exon_lengths_fp_eq
+        FROM (SELECT iD1.tx_ac AS tx_ac1, iD2.tx_ac AS tx_ac2
+              FROM tx_def_summary_mv iD1 JOIN tx_def_summary_mv iD2 ON iD1.symbol=iD2.symbol
+              UNION
+              SELECT iD1.tx_ac, iD2.tx_ac
+              FROM tx_def_summary_mv iD1 JOIN tx_def_summary_mv iD2 ON iD1.cds_md5=iD2.cds_md5
+              UNION
+              SELECT iD1.tx_ac, iD2.tx_ac
+              FROM tx_def_summary_mv iD1 JOIN tx_def_summary_mv iD2 ON iD1.es_fingerprint=iD2.es_fingerprint
+              UNION
+              SELECT iD1.tx_ac, iD2.tx_ac
+              FROM tx_def_summary_mv iD1 JOIN tx_def_summary_mv iD2 ON iD1.cds_es_fp=iD2.cds_es_fp
+              UNION
+              SELECT iD1.tx_ac, iD2.tx_ac
+              FROM tx_def_summary_mv iD1 JOIN tx_def_summary_mv iD2 ON iD1.cds_exon_lengths_fp=iD2.cds_exon_lengths_fp
+             ) P
+        JOIN tx_def_summary_mv D1 ON P.tx_ac1=D1.tx_ac
+        JOIN tx_def_summary_mv D2 ON P.tx_ac2=D2.tx_ac
+        WHERE P.tx_ac1 != P.tx_ac2;
+    """)
+    op.execute("""
+        CREATE TABLE tx_similarity_mv AS SELECT * FROM tx_similarity_dv WITH NO DATA;
+        CREATE UNIQUE INDEX tx_similarity_mv_tx_ac1_tx_ac2 ON tx_similarity_mv (tx_ac1, tx_ac2);
+        CREATE INDEX tx_similarity_mv_tx_ac2 ON tx_similarity_mv (tx_ac2);
+        GRANT SELECT ON tx_similarity_mv TO public;
+        INSERT INTO tx_similarity_mv SELECT * FROM tx_similarity_dv;
+    """)
+    op.execute("""
+        CREATE OR REPLACE VIEW tx_similarity_v AS
+        SELECT * FROM tx_similarity_mv;
+    """)
+
+
+def downgrade() -> None:
+    op.execute("""
+        CREATE OR REPLACE VIEW tx_similarity_v AS
+        SELECT DISTINCT
+               D1.tx_ac as tx_ac1, D2.tx_ac as tx_ac2,
+               D1.hgnc = D2.hgnc as hgnc_eq,
+               D1.symbol = D2.symbol as symbol_eq,
+               D1.cds_md5=D2.cds_md5 as cds_eq,
+               D1.es_fingerprint=D2.es_fingerprint as es_fp_eq,
+               D1.cds_es_fp=D2.cds_es_fp as cds_es_fp_eq,
+               D1.cds_exon_lengths_fp=D2.cds_exon_lengths_fp as cds_exon_lengths_fp_eq
+        FROM tx_def_summary_mv D1
+        JOIN tx_def_summary_mv D2 on (D1.tx_ac != D2.tx_ac
+                                      and (D1.symbol=D2.symbol
+                                           or D1.cds_md5=D2.cds_md5
+                                           or D1.es_fingerprint=D2.es_fingerprint
+                                           or D1.cds_es_fp=D2.cds_es_fp
+                                           or D1.cds_exon_lengths_fp=D2.cds_exon_lengths_fp
+                                           ));
+    """)
+    op.execute("DROP TABLE IF EXISTS tx_similarity_mv;")
+    op.execute("DROP VIEW IF EXISTS tx_similarity_dv;")
+    op.execute("""
+        DROP INDEX IF EXISTS tx_def_summary_mv_cds_exon_lengths_fp;
+        DROP INDEX IF EXISTS tx_def_summary_mv_cds_es_fp;
+        DROP INDEX IF EXISTS tx_def_summary_mv_es_fingerprint;
+        DROP INDEX IF EXISTS tx_def_summary_mv_cds_md5;
+    """)
@@ -12,18 +12,34 @@ Usage:
   uta (-C CONF ...) [options] load-origin FILE
   uta (-C CONF ...) [options] load-seqinfo FILE
   uta (-C CONF ...) [options] load-geneinfo FILE
-  uta (-C CONF ...) [options] load-txinfo FILE
+  uta (-C CONF ...) [options] load-txinfo FILE [--bulk] [--dry-run]
   uta (-C CONF ...) [options] load-exonset FILE
   uta (-C CONF ...) [options] load-assoc-ac FILE
-  uta (-C CONF ...) [options] load-sequences
-  uta (-C CONF ...) [options] align-exons [--sql SQL]
+  uta (-C CONF ...) [options] load-sequences [--workers N] [--batch-size N]
+  uta (-C CONF ...) [options] align-exons [--sql SQL] [--tx-ac-file PATH] [--alt-ac AC] [--alt-aln-method METHOD] [--workers N] [--batch-size N] [--resume | --retry-failed] [--shard K/N]
+  uta (-C CONF ...) [options] align-exons --verify-shards N
   uta (-C CONF ...) [options] load-ncbi-seqgene FILE
   uta (-C CONF ...) [options] grant-permissions
-  uta (-C CONF ...) [options] refresh-matviews
+  uta (-C CONF ...) [options] refresh-matviews [--workers N] [--incremental]
   uta (-C CONF ...) [options] analyze
 
 Options:
   -C CONF, --conf CONF	Configuration to read (required)
+  --sql SQL             SQL predicate on tx_alt_exon_pairs_v selecting exon pairs to align
+  --tx-ac-file PATH     Align only transcripts listed (one per line) in PATH
+  --alt-ac AC           Align only exon pairs on reference sequence AC
+  --alt-aln-method METHOD  Align only exon pairs from alignment method METHOD
+  --workers N           Number of worker processes (align-exons, load-txinfo) or
+                        threads (load-sequences, refresh-matviews) [default: 1]
+  --batch-size N        Rows written per batch (and commit) by bulk loaders
+  --bulk                Load with set-based SQL over a staging table (load-txinfo)
+  --dry-run             Only compute CDS digests and report their timing (load-txinfo)
+  --resume              Continue an interrupted align-exons run from its checkpoints
+  --retry-failed        Realign only align-exons accessions that previously failed
+  --shard K/N           Align only shard K of N, partitioned by tx_ac
+  --verify-shards N     Check that all N align-exons shards completed
+  --incremental         Refresh summary tables only for transcripts changed since
+                        the last refresh (refresh-matviews)
 
 Examples:
   $ ./bin/uta --conf etc/uta.conf create-schema --drop-current
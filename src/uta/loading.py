@@ -1,25 +1,33 @@
 from __future__ import absolute_import, division, print_function, unicode_literals
 
+import collections
+import concurrent.futures
 import csv
 import datetime
-import gzip
 import hashlib
+import io
 import itertools
 import logging
+import math
+import multiprocessing
+import multiprocessing.pool
+import threading
 import time
-from typing import Any, Dict, List
+from typing import Any, Dict, Iterable, List
 
 from biocommons.seqrepo import SeqRepo
 from bioutils.coordinates import strand_pm_to_int, MINUS_STRAND
 from bioutils.digests import seq_md5
 from bioutils.sequences import reverse_complement
-from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
 from sqlalchemy.orm.exc import NoResultFound
-from sqlalchemy import text
+from sqlalchemy import func, text, tuple_
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+import numpy as np
 import psycopg2.extras
+import psycopg2.sql
 import six
-from uta_align.align.algorithms import cigar_alignment, needleman_wunsch_gotoh_align
+from uta_align.align.algorithms import needleman_wunsch_gotoh_align
 
 from uta.lru_cache import lru_cache
 
@@ -30,7 +38,10 @@ import uta.formats.seqinfo as ufsi
 import uta.formats.txinfo as ufti
 import uta.parsers.geneinfo
 import uta.parsers.seqgene
-from uta.exceptions import ExonStructureMismatchError
+from uta.exceptions import UTAError
+from uta.tools.cigar_memo import CigarMemo
+from uta.tools.file_utils import InputFile
+from uta.tools.seq_window_cache import SeqWindowCache
 
 usam = uta.models
 
@@ -40,7 +51,8 @@ def align_exons(session, opts, cf):
     # N.B. setup.py declares dependencies for using uta as a client.  The
     # imports below are loading depenencies only and are not in setup.py.
 
-    update_period = 1000
+    n_workers = int(opts.get("--workers") or 1)
+    batch_size = int(opts.get("--batch-size") or 1000)   # rows per COPY and commit
 
     def _get_cursor(con):
         cur = con.cursor(cursor_factory=psycopg2.extras.NamedTupleCursor)
@@ -49,108 +61,680 @@ def align_exons(session, opts, cf):
         cur.execute("set search_path = " + usam.schema_name)
         return cur
 
-    def align(s1, s2):
-        score, cigar = needleman_wunsch_gotoh_align(s1.encode("ascii"),
-                                                    s2.encode("ascii"),
-                                                    extended_cigar=True)
-        tx_aseq, alt_aseq = cigar_alignment(
-            tx_seq, alt_seq, cigar, hide_match=False)
-        return tx_aseq.decode("ascii"), alt_aseq.decode("ascii"), cigar.to_string().decode("ascii")
-
-    aln_sel_sql = """
-    SELECT * FROM tx_alt_exon_pairs_v TAEP
-    WHERE exon_aln_id is NULL and tx_ac !~ '/'
-    ORDER BY tx_ac, alt_ac
-    """
-
-    aln_ins_sql = """
-    INSERT INTO exon_aln (tx_exon_id,alt_exon_id,cigar,added)
-    VALUES (%s,%s,%s,%s)
-    """
-
     con = session.bind.pool.connect()
     cur = _get_cursor(con)
-    cur.execute(aln_sel_sql)
-    n_rows = cur.rowcount
+
+    if opts.get("--verify-shards"):
+        try:
+            _verify_align_exons_shards(cur, int(opts["--verify-shards"]))
+        finally:
+            cur.close()
+            con.close()
+        return
+
+    # Shards partition exon pairs by tx_ac, so that shards may run
+    # concurrently (e.g., on separate hosts) without overlap.
+    shard, n_shards = _parse_shard(opts.get("--shard") or "1/1")
+    shard_pred = _aln_shard_predicate(shard, n_shards)
+    subset_preds = _aln_subset_predicates(opts)
+    if subset_preds and (opts.get("--resume") or opts.get("--retry-failed")):
+        raise UTAError("align-exons subset options select exon pairs for new runs only")
+    cur.execute("""
+        INSERT INTO align_exons_run (n_shards, shard, status, started) VALUES (%s, %s, 'running', now())
+        ON CONFLICT (n_shards, shard) DO UPDATE SET status='running', started=now(), finished=NULL
+        """, (n_shards, shard))
+    if opts.get("--retry-failed"):
+        queue_from_sql = _aln_retry_failed_from_sql
+    else:
+        if not opts.get("--resume"):
+            if n_shards == 1:
+                cur.execute("TRUNCATE align_exons_queue, align_exons_checkpoint")
+            else:
+                cur.execute("DELETE FROM align_exons_queue WHERE " + shard_pred)
+                cur.execute("DELETE FROM align_exons_checkpoint WHERE " + shard_pred)
+            cur.execute(psycopg2.sql.SQL(" AND ").join(
+                [psycopg2.sql.SQL(_aln_queue_sql), psycopg2.sql.SQL(shard_pred)] + subset_preds))
+            logger.info("queued {n} exon pairs from tx_alt_exon_pairs_v for shard {shard}/{n_shards}".format(
+                n=cur.rowcount, shard=shard, n_shards=n_shards))
+        queue_from_sql = _aln_pending_from_sql
+    queue_from_sql += " AND " + _aln_shard_predicate(shard, n_shards, col="Q.tx_ac")
+    con.commit()
+    cur.execute("SELECT count(*) AS n " + queue_from_sql)
+    n_rows = cur.fetchone().n
 
     if n_rows == 0:
+        _finish_align_exons_run(cur, shard, n_shards)
+        con.commit()
+        cur.close()
+        con.close()
         return
 
-    logger.info("{} exon pairs to align".format(n_rows))
+    logger.info("{} exon pairs to align with {} worker(s)".format(n_rows, n_workers))
+
+    # The queue is streamed through a server-side cursor. It lives on a
+    # separate connection because commits on con would close it.
+    qcon = session.bind.pool.connect()
+    _get_cursor(qcon).close()
+    qcur = qcon.cursor("align_exons_queue", cursor_factory=psycopg2.extras.NamedTupleCursor)
+    qcur.itersize = _aln_fetch_size
+    qcur.execute("SELECT Q.* " + queue_from_sql + " ORDER BY Q.tx_ac, Q.alt_ac")
+
+    # Workers fetch sequences and align; this process is the only
+    # writer. Results are consumed in submission order, so exon_aln
+    # rows are inserted in the same order for any number of workers.
+    pairs = (_ExonPair(*(getattr(r, f) for f in _ExonPair._fields)) for r in qcur)
+    batches = _batch_exon_pairs(pairs, _aln_batch_size)
+    memo_path = cf.get("loading", "aln_memo_file", fallback=None)
+    memo = CigarMemo(memo_path, _aln_memo_params) if memo_path else None
+    if memo is not None:
+        logger.info("{path}: {n} memoized alignments".format(path=memo_path, n=len(memo)))
+
+    if n_workers > 1:
+        pool = multiprocessing.Pool(n_workers, initializer=_align_exons_worker_init, initargs=(cf,))
+        results = _imap_ordered(pool, _align_exon_pairs, batches, window=2 * n_workers)
+    else:
+        pool = None
+        _align_exons_worker_init(cf)
+        results = map(_align_exon_pairs, batches)
 
-    sf = _get_seqfetcher(cf)
+    aln_stats = collections.Counter()
 
-    def _fetch_seq(ac, s, e):
-        logger.debug("fetching sequence {ac}[{s}:{e}]".format(ac=ac,s=s,e=e))
-        seq = sf.fetch(ac,s,e)
-        assert seq is not None, "sequence {ac}[{s}:{e}] should never be None (coordinates bogus?)".format(ac=ac,s=s,e=e)
-        if isinstance(seq, six.binary_type):
-            seq = seq.decode("ascii")  # force into unicode
-        assert isinstance(seq, six.text_type)
-        return seq
+    def _iter_results():
+        for batch_results, memo_items, batch_aln_stats in results:
+            aln_stats.update(batch_aln_stats)
+            if memo is not None and memo_items:
+                memo.update(memo_items)
+            yield from batch_results
 
-    rows = cur.fetchall()
     ac_warning = set()
     tx_acs = set()
+    aln_rows = []
+    ckpt_rows = []
     aln_rate_s = None
     decay_rate = 0.25
     n0, t0 = 0, time.time()
 
-    for i_r, r in enumerate(rows):
-        if i_r > 0 and (i_r % update_period == 0 or (i_r + 1) == n_rows):
-            con.commit()
+    def _commit(n_done):
+        # exon alignments and the checkpoints of the (tx_ac, alt_ac)
+        # groups they complete are committed together
+        nonlocal aln_rows, ckpt_rows, tx_acs, aln_rate_s, n0, t0
+        _copy_exon_alns(cur, aln_rows)
+        _upsert_align_exons_checkpoints(cur, ckpt_rows)
+        if tx_acs:
+            cur.execute("INSERT INTO stale_tx (tx_ac, added) SELECT unnest(%s::text[]), clock_timestamp() "
+                        "ON CONFLICT (tx_ac) DO UPDATE SET added = clock_timestamp()",
+                        (sorted(tx_acs),))
+        con.commit()
+        aln_rows, ckpt_rows = [], []
+        n1, t1 = n_done, time.time()
+        nd, td = n1 - n0, max(t1 - t0, 1e-6)
+        aln_rate = nd / td      # aln rate on this update period
+        if aln_rate_s is None:  # aln_rate_s is EWMA smoothed average
+            aln_rate_s = aln_rate
+        else:
+            aln_rate_s = decay_rate * aln_rate + (1.0 - decay_rate) * aln_rate_s
+        etr = (n_rows - n_done) / aln_rate_s if aln_rate_s else 0  # etr in secs
+        etr_s = str(datetime.timedelta(seconds=round(etr)))  # etr as H:M:S
+        logger.info("{i_r}/{n_rows} {p_r:.1f}%; committed; speed={speed:.1f}/{speed_s:.1f} aln/sec (inst/emwa); etr={etr:.0f}s ({etr_s}); {n_tx} tx".format(
+            i_r=n_done, n_rows=n_rows, p_r=n_done / n_rows * 100, speed=aln_rate, speed_s=aln_rate_s, etr=etr,
+            etr_s=etr_s, n_tx=len(tx_acs)))
+        tx_acs = set()
+        n0, t0 = n1, t1
+
+    group, group_n, group_reason = None, 0, None
+    try:
+        for i_r, (r, cigar_str, missing_ac) in enumerate(_iter_results()):
+            if (r.tx_ac, r.alt_ac) != group:
+                if group is not None:
+                    ckpt_rows.append(_align_exons_checkpoint_row(group, group_n, group_reason))
+                    if len(aln_rows) >= batch_size:
+                        _commit(i_r)
+                group, group_n, group_reason = (r.tx_ac, r.alt_ac), 0, None
+            group_n += 1
+
+            if r.tx_ac in ac_warning or r.alt_ac in ac_warning:
+                group_reason = group_reason or "{ac}: Not in sequence sources".format(
+                    ac=r.tx_ac if r.tx_ac in ac_warning else r.alt_ac)
+            elif missing_ac is not None:
+                logger.warning(
+                    "{ac}: Not in sequence sources; can't align".format(ac=missing_ac))
+                ac_warning.add(r.tx_ac)
+                group_reason = group_reason or "{ac}: Not in sequence sources".format(ac=missing_ac)
+            else:
+                added = datetime.datetime.now()
+                aln_rows.append((r.tx_exon_id, r.alt_exon_id, cigar_str, added))
+                tx_acs.add(r.tx_ac)
+        ckpt_rows.append(_align_exons_checkpoint_row(group, group_n, group_reason))
+        _finish_align_exons_run(cur, shard, n_shards)
+        _commit(n_rows)
+    finally:
+        if pool is not None:
+            pool.terminate()
+        qcur.close()
+        qcon.close()
 
-        if r.tx_ac in ac_warning or r.alt_ac in ac_warning:
-            continue
+    cur.close()
+    con.close()
+    logger.info("{} distinct sequence accessions not found".format(len(ac_warning)))
+    n_fetches = aln_stats["seq_hits"] + aln_stats["seq_misses"]
+    logger.info("sequence cache: {hits} hits, {misses} misses ({p:.1f}% hits); "
+                "{windows} windows loaded ({mb:.1f} MB); {evictions} evictions".format(
+                    hits=aln_stats["seq_hits"], misses=aln_stats["seq_misses"],
+                    p=aln_stats["seq_hits"] / n_fetches * 100 if n_fetches else 0,
+                    windows=aln_stats["seq_windows"], mb=aln_stats["seq_bytes"] / 1e6,
+                    evictions=aln_stats["seq_evictions"]))
+    logger.info("alignments: {ungapped} ungapped, {banded} banded, {nw} needleman-wunsch".format(
+        ungapped=aln_stats["aln_ungapped"], banded=aln_stats["aln_banded"], nw=aln_stats["aln_nw"]))
+    if memo is not None:
+        logger.info("alignment memo: {hits} reused, {misses} aligned; {n} memoized alignments".format(
+            hits=aln_stats["memo_hits"], misses=aln_stats["memo_misses"], n=len(memo)))
+        memo.close()
+
+
+# align-exons work queue: a fresh run snapshots pending exon pairs (of
+# its shard) into align_exons_queue; --resume skips (tx_ac, alt_ac)
+# groups that have a checkpoint, and --retry-failed revisits only failed
+# groups
+_aln_queue_sql = """
+INSERT INTO align_exons_queue (tx_ac, alt_ac, alt_strand, tx_exon_id, alt_exon_id,
+                               tx_start_i, tx_end_i, alt_start_i, alt_end_i)
+SELECT tx_ac, alt_ac, alt_strand, tx_exon_id, alt_exon_id, tx_start_i, tx_end_i, alt_start_i, alt_end_i
+FROM tx_alt_exon_pairs_v TAEP
+WHERE exon_aln_id is NULL and tx_ac !~ '/'
+"""
+_aln_pending_from_sql = """
+FROM align_exons_queue Q
+WHERE NOT EXISTS (SELECT 1 FROM align_exons_checkpoint C WHERE C.tx_ac=Q.tx_ac AND C.alt_ac=Q.alt_ac)
+"""
+_aln_retry_failed_from_sql = """
+FROM align_exons_queue Q
+JOIN align_exons_checkpoint C ON C.tx_ac=Q.tx_ac AND C.alt_ac=Q.alt_ac AND C.status='failed'
+WHERE NOT EXISTS (SELECT 1 FROM exon_aln EA WHERE EA.tx_exon_id=Q.tx_exon_id AND EA.alt_exon_id=Q.alt_exon_id)
+"""
+
+# exon pairs fetched per round trip from the align-exons queue cursor
+_aln_fetch_size = 10000
+
+# minimum number of exon pairs sent to an align-exons worker per task
+_aln_batch_size = 250
+
+# exon pair fields needed by align-exons workers; a plain namedtuple
+# because rows from psycopg2's NamedTupleCursor can't be pickled
+_ExonPair = collections.namedtuple("_ExonPair", [
+    "tx_ac", "alt_ac", "alt_strand", "tx_exon_id", "alt_exon_id",
+    "tx_start_i", "tx_end_i", "alt_start_i", "alt_end_i"])
+
+# scoring for exon alignments (the needleman_wunsch_gotoh_align defaults)
+_aln_scores = dict(match_score=10, mismatch_score=-9, gap_open_score=-15, gap_extend_score=-6)
+_aln_memo_params = "needleman_wunsch_gotoh_align({}, extended_cigar)".format(
+    ",".join("{}={}".format(k, v) for k, v in sorted(_aln_scores.items())))
+
+# An ungapped alignment of equal-length sequences with k mismatches
+# scores n*match - k*(match-mismatch); any gapped alignment needs at
+# least one insertion and one deletion, and so scores at most
+# (n-1)*match + 2*gap_open. The ungapped alignment is therefore the
+# unique optimum when k*(match-mismatch) < match - 2*gap_open.
+_ungapped_max_mismatches = math.ceil(
+    (_aln_scores["match_score"] - 2 * _aln_scores["gap_open_score"])
+    / (_aln_scores["match_score"] - _aln_scores["mismatch_score"])) - 1
+
+# exon pairs at least this long are aligned within a band (see
+# _banded_cigar); 0 disables banding
+_aln_band_min_len = 10000
+_aln_band_margin = 64
+
+# traceback flags, as in uta_align
+_TRACE_DEL, _TRACE_INS, _TRACE_MATCH, _TRACE_NEXT_DEL, _TRACE_NEXT_INS = 1, 2, 4, 8, 16
+
+_aln_seq_cache = None       # per-process SeqWindowCache; see _align_exons_worker_init
+_aln_memo = None            # per-process read-only CigarMemo, or None
+
+
+def _align_exons_worker_init(cf):
+    global _aln_seq_cache, _aln_memo, _aln_band_min_len, _aln_band_margin
+    _aln_band_min_len = cf.getint("loading", "aln_band_min_len", fallback=_aln_band_min_len)
+    _aln_band_margin = cf.getint("loading", "aln_band_margin", fallback=_aln_band_margin)
+    max_bytes = cf.getint("loading", "seq_cache_mb", fallback=256) * 1000000
+    _aln_seq_cache = SeqWindowCache(_get_seqfetcher(cf), max_bytes=max_bytes)
+    memo_path = cf.get("loading", "aln_memo_file", fallback=None)
+    _aln_memo = CigarMemo(memo_path, _aln_memo_params, readonly=True) if memo_path else None
+
+
+def _align_exon_pairs(pairs):
+    """fetch sequences for and align each exon pair in `pairs`
+
+    Returns a tuple of (results, memo_items, stats). results is a list
+    of (pair, cigar_str, missing_ac) tuples in the order of `pairs`;
+    exactly one of cigar_str and missing_ac is None. memo_items are
+    (digest, cigar_str) pairs for alignments that were not memoized.
+    stats counts sequence cache and memo activity for this batch.
+
+    Each transcript is fetched once in full, and the genomic sequence
+    is fetched once per (tx_ac, alt_ac) as a window spanning all of its
+    exons; exon sequences are then sliced from the cache.
 
+    """
+    results = []
+    memo_items = {}
+    stats = collections.Counter()
+    for (tx_ac, alt_ac), group in itertools.groupby(pairs, key=lambda p: (p.tx_ac, p.alt_ac)):
+        group = list(group)
         try:
-            tx_seq = _fetch_seq(r.tx_ac, r.tx_start_i, r.tx_end_i)
+            _aln_seq_cache.prefetch(tx_ac)
+            _aln_seq_cache.prefetch(alt_ac,
+                                    min(p.alt_start_i for p in group),
+                                    max(p.alt_end_i for p in group))
         except KeyError:
-            import IPython; IPython.embed()	  ### TODO: Remove IPython.embed()
-            logger.warning(
-                "{r.tx_ac}: Not in sequence sources; can't align".format(r=r))
-            ac_warning.add(r.tx_ac)
-            continue
+            pass                # reported per exon pair below
 
-        try:
-            alt_seq = _fetch_seq(r.alt_ac, r.alt_start_i, r.alt_end_i)
-        except KeyError:
-            logger.warning(
-                "{r.alt_ac}: Not in sequence sources; can't align".format(r=r))
-            ac_warning.add(r.tx_ac)
-            continue
+        for p in group:
+            try:
+                tx_seq = _fetch_exon_seq(_aln_seq_cache, p.tx_ac, p.tx_start_i, p.tx_end_i).upper()
+            except KeyError:
+                results.append((p, None, p.tx_ac))
+                continue
+
+            try:
+                alt_seq = _fetch_exon_seq(_aln_seq_cache, p.alt_ac, p.alt_start_i, p.alt_end_i).upper()
+            except KeyError:
+                results.append((p, None, p.alt_ac))
+                continue
+
+            cigar_str = None
+            if _aln_memo is not None:
+                digest = CigarMemo.digest(tx_seq, alt_seq, p.alt_strand)
+                cigar_str = memo_items.get(digest) or _aln_memo.get(digest)
+                stats["memo_hits" if cigar_str is not None else "memo_misses"] += 1
+            if cigar_str is None:
+                if p.alt_strand == MINUS_STRAND:
+                    alt_seq = reverse_complement(alt_seq)
+                cigar_str, aln_method = _align_exon_seqs(tx_seq, alt_seq)
+                stats["aln_" + aln_method] += 1
+                if _aln_memo is not None:
+                    memo_items[digest] = cigar_str
+            results.append((p, cigar_str, None))
+
+    stats.update({"seq_" + k: v for k, v in _aln_seq_cache.reset_stats().items()})
+    return results, list(memo_items.items()), stats
+
+
+def _align_exon_seqs(tx_seq, alt_seq):
+    """return (cigar_str, method) for the global alignment of tx_seq with
+    alt_seq, where cigar_str is an extended CIGAR string and method
+    names the algorithm that was used"""
+    cigar_str = _ungapped_cigar(tx_seq, alt_seq)
+    if cigar_str is not None:
+        return cigar_str, "ungapped"
+    if _aln_band_min_len and max(len(tx_seq), len(alt_seq)) >= _aln_band_min_len:
+        cigar_str = _banded_cigar(tx_seq, alt_seq, _aln_band_margin)
+        if cigar_str is not None:
+            return cigar_str, "banded"
+    score, cigar = needleman_wunsch_gotoh_align(tx_seq.encode("ascii"),
+                                                alt_seq.encode("ascii"),
+                                                extended_cigar=True,
+                                                **_aln_scores)
+    return cigar.to_string().decode("ascii"), "nw"
+
+
+def _ungapped_cigar(tx_seq, alt_seq):
+    """return the extended CIGAR string for the ungapped alignment of
+    equal-length sequences with at most _ungapped_max_mismatches
+    mismatches, or None otherwise
+
+    Within those limits, the ungapped alignment is the unique optimal
+    global alignment, so the CIGAR is identical to that from
+    needleman_wunsch_gotoh_align.
+
+    """
+    if len(tx_seq) != len(alt_seq):
+        return None
+    mismatches = np.flatnonzero(np.frombuffer(tx_seq.encode("ascii"), dtype=np.uint8)
+                                != np.frombuffer(alt_seq.encode("ascii"), dtype=np.uint8))
+    if len(mismatches) > _ungapped_max_mismatches:
+        return None
+    runs = []                   # [op, count]
+    pos = 0
+    for mm in mismatches.tolist():
+        if mm > pos:
+            runs.append(["=", mm - pos])
+        if runs and runs[-1][0] == "X":
+            runs[-1][1] += 1
+        else:
+            runs.append(["X", 1])
+        pos = mm + 1
+    if len(tx_seq) > pos:
+        runs.append(["=", len(tx_seq) - pos])
+    return "".join("{}{}".format(n, op) for op, n in runs)
+
+
+def _banded_cigar(tx_seq, alt_seq, margin):
+    """return the extended CIGAR string for the global alignment of
+    tx_seq with alt_seq computed within a diagonal band, or None if
+    the banded alignment can't be shown to equal the full one
+
+    The band spans the length difference plus `margin` on each side.
+    Any alignment that leaves the band has at least |m-n|+2*(margin+1)
+    gapped bases, which bounds its score; if the banded score beats
+    that bound, the banded alignment is the unrestricted optimum and
+    its CIGAR is identical to that from needleman_wunsch_gotoh_align.
+    Otherwise, the band is widened once to the margin that the bound
+    requires, unless that band would be too wide to be worthwhile.
 
-        if r.alt_strand == MINUS_STRAND:
-            alt_seq = reverse_complement(alt_seq)
-        tx_seq = tx_seq.upper()
-        alt_seq = alt_seq.upper()
+    """
+    match, mismatch, gap_open, gap_extend = (_aln_scores[k] for k in (
+        "match_score", "mismatch_score", "gap_open_score", "gap_extend_score"))
+    n, m = len(tx_seq), len(alt_seq)
+    if n == 0 or m == 0:
+        return None
 
-        tx_aseq, alt_aseq, cigar_str = align(tx_seq, alt_seq)
+    def _max_outside_score_x2(margin):
+        # twice the best possible score of an alignment that leaves the band
+        g = abs(m - n) + 2 * (margin + 1)
+        return match * (n + m - g) + 4 * gap_open + 2 * (g - 2) * gap_extend
+
+    for attempt in range(2):
+        lo = min(0, m - n) - margin
+        width = max(0, m - n) + margin - lo + 1
+        if width > max(n, m) // 8:
+            return None
+        score, trace = _banded_nw(tx_seq, alt_seq, lo, width)
+        if 2 * score > _max_outside_score_x2(margin):
+            return _banded_traceback(tx_seq, alt_seq, lo, trace)
+        # smallest margin for which the bound would hold for this score
+        x = match * (n + m) + 4 * gap_open - 4 * gap_extend - 2 * score
+        g = x // (match - 2 * gap_extend) + 1
+        margin = max(margin + 1, -(-(g - abs(m - n) - 2) // 2))
+    return None
+
+
+def _banded_nw(tx_seq, alt_seq, lo, width):
+    """fill the banded Gotoh matrices for tx_seq (rows) and alt_seq
+    (columns); returns (score, trace), where trace[i, k] holds
+    traceback flags for cell (i, j=i+lo+k)
+
+    The recurrences and traceback flags are those of uta_align's
+    align_global_full. Insertion scores are computed for a whole row
+    at once with a running maximum, which is equivalent to the
+    column-by-column recurrence because gap_open < gap_extend.
 
-        added = datetime.datetime.now()
-        cur.execute(aln_ins_sql, [r.tx_exon_id, r.alt_exon_id, cigar_str, added])
-        tx_acs.add(r.tx_ac)
+    """
+    match, mismatch, gap_open, gap_extend = (_aln_scores[k] for k in (
+        "match_score", "mismatch_score", "gap_open_score", "gap_extend_score"))
+    n, m = len(tx_seq), len(alt_seq)
+    tx = np.frombuffer(tx_seq.encode("ascii"), dtype=np.uint8)
+    alt = np.frombuffer(alt_seq.encode("ascii"), dtype=np.uint8)
+    ninf = -(1 << 40)
+    ks = np.arange(width, dtype=np.int64)
+    trace = np.zeros((n + 1, width), dtype=np.uint8)
+
+    # row 0; prev_s and prev_d carry a trailing sentinel for the cell above the band
+    j = lo + ks
+    valid = (j >= 1) & (j <= m)
+    prev_s = np.full(width + 1, ninf, dtype=np.int64)
+    prev_s[:width] = np.where(valid, gap_open + (j - 1) * gap_extend, ninf)
+    prev_s[:width][j == 0] = 0
+    prev_d = np.full(width + 1, ninf, dtype=np.int64)
+    trace[0] = np.where(valid, _TRACE_INS, 0)
+
+    ins = np.full(width, ninf, dtype=np.int64)
+    insccost = np.full(width, ninf, dtype=np.int64)
+    ins_open = gap_open - ks * gap_extend
+    ins_ext = (ks[1:] - 1) * gap_extend
+    alt_pad = np.zeros(m + 2 * width, dtype=np.uint8)      # alt[j-1] at alt_pad[j - 1 + width]
+    alt_pad[width:width + m] = alt
+    sub = np.array([mismatch, match], dtype=np.int64)
+
+    for i in range(1, n + 1):
+        j0 = i + lo
+        matcost = prev_s[:width] + sub[(alt_pad[j0 - 1 + width:j0 - 1 + 2 * width] == tx[i - 1]).view(np.uint8)]
+        delccost = prev_d[1:] + gap_extend
+        delcost = np.maximum(prev_s[1:] + gap_open, delccost)
+        t = np.maximum(matcost, delcost)
+        edge = j0 < 1 or j0 + width - 1 > m
+        if edge:
+            # band runs off the matrix: mask cells outside it, set column 0
+            j = j0 + ks
+            valid = (j >= 1) & (j <= m)
+            col0 = j == 0
+            col0_score = gap_open + (i - 1) * gap_extend
+            t[~valid] = ninf
+            t[col0] = col0_score
+
+        ins[1:] = np.maximum.accumulate(t + ins_open)[:-1] + ins_ext
+        insccost[1:] = ins[:-1] + gap_extend
+        cur_s = np.maximum(t, ins)
+
+        back = (cur_s == matcost).view(np.uint8) * np.uint8(_TRACE_MATCH)
+        back |= (cur_s == ins).view(np.uint8) * np.uint8(_TRACE_INS)
+        back |= (cur_s == delcost).view(np.uint8) * np.uint8(_TRACE_DEL)
+        back |= (delcost == delccost).view(np.uint8) * np.uint8(_TRACE_NEXT_DEL)
+        back |= (ins == insccost).view(np.uint8) * np.uint8(_TRACE_NEXT_INS)
+        if edge:
+            cur_s[~valid] = ninf
+            cur_s[col0] = col0_score
+            delcost[~valid] = ninf
+            back[~valid] = 0
+            back[col0] = _TRACE_DEL
+        trace[i] = back
+
+        prev_s[:width] = cur_s
+        prev_d[:width] = delcost
+
+    return int(prev_s[m - n - lo]), trace
+
+
+def _banded_traceback(tx_seq, alt_seq, lo, trace):
+    """return extended CIGAR string from banded trace, following the
+    same precedence as uta_align's _roll_cigar_gotoh"""
+    i, j = len(tx_seq), len(alt_seq)
+    runs = []
+    op = None
+    count = 0
+    back = _TRACE_MATCH
+    while True:
+        last_back, last_op = back, op
+        back = int(trace[i, j - i - lo])
+        if op == "D" and last_back & _TRACE_NEXT_DEL:
+            op = "D"
+        elif op == "I" and last_back & _TRACE_NEXT_INS:
+            op = "I"
+        elif back & _TRACE_MATCH:
+            op = "M"
+        elif back & _TRACE_DEL:
+            op = "D"
+        elif back & _TRACE_INS:
+            op = "I"
+        else:
+            break
+
+        if op == "M":
+            i -= 1
+            j -= 1
+            op = "=" if tx_seq[i] == alt_seq[j] else "X"
+        elif op == "D":
+            i -= 1
+        else:
+            j -= 1
 
-        if i_r > 0 and (i_r % update_period == 0 or (i_r + 1) == n_rows):
-            con.commit()
-            n1, t1 = i_r, time.time()
-            nd, td = n1 - n0, t1 - t0
-            aln_rate = nd / td      # aln rate on this update period
-            if aln_rate_s is None:  # aln_rate_s is EWMA smoothed average
-                aln_rate_s = aln_rate
-            else:
-                aln_rate_s = decay_rate * aln_rate + (1.0 - decay_rate) * aln_rate_s
-            etr = (n_rows - i_r - 1) / aln_rate_s        # etr in secs
-            etr_s = str(datetime.timedelta(seconds=round(etr)))  # etr as H:M:S
-            logger.info("{i_r}/{n_rows} {p_r:.1f}%; committed; speed={speed:.1f}/{speed_s:.1f} aln/sec (inst/emwa); etr={etr:.0f}s ({etr_s}); {n_tx} tx".format(
-                i_r=i_r, n_rows=n_rows, p_r=i_r / n_rows * 100, speed=aln_rate, speed_s=aln_rate_s, etr=etr,
-                etr_s=etr_s, n_tx=len(tx_acs)))
-            tx_acs = set()
-            n0, t0 = n1, t1
+        if count and last_op != op:
+            runs.append((count, last_op))
+            count = 1
+        else:
+            count += 1
+    if count:
+        runs.append((count, op))
+    return "".join("{}{}".format(c, o) for c, o in reversed(runs))
+
+
+def _batch_exon_pairs(pairs, batch_size):
+    """group exon pairs into lists of at least batch_size pairs (except
+    the last), without splitting a (tx_ac, alt_ac) across lists"""
+    batch = []
+    for _, group in itertools.groupby(pairs, key=lambda p: (p.tx_ac, p.alt_ac)):
+        batch.extend(group)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _copy_exon_alns(cur, aln_rows):
+    """write (tx_exon_id, alt_exon_id, cigar, added) tuples to exon_aln
+    with a single COPY"""
+    if not aln_rows:
+        return
+    _copy_rows(cur, "exon_aln", ("tx_exon_id", "alt_exon_id", "cigar", "added"), aln_rows)
 
-    cur.close()
-    con.close()
-    logger.info("{} distinct sequence accessions not found".format(len(ac_warning)))
+
+def _copy_rows(cur, table, columns, rows):
+    """write rows (sequences of values for columns) to table with a
+    single COPY; None is written as NULL. rows may be any iterable and
+    is consumed as the server reads it."""
+    lines = ("\t".join("\\N" if v is None else str(v).translate(_copy_escapes) for v in row) + "\n"
+             for row in rows)
+    cur.copy_expert("COPY {table} ({columns}) FROM STDIN".format(table=table, columns=",".join(columns)),
+                    _CopyReader(lines))
+
+
+class _CopyReader:
+    """minimal file-like object over an iterable of lines, for
+    cursor.copy_expert"""
+
+    def __init__(self, lines):
+        self._lines = iter(lines)
+        self._buf = ""
+
+    def read(self, size=-1):
+        chunks = [self._buf]
+        n = len(self._buf)
+        while size < 0 or n < size:
+            line = next(self._lines, None)
+            if line is None:
+                break
+            chunks.append(line)
+            n += len(line)
+        data = "".join(chunks)
+        if size < 0:
+            size = len(data)
+        self._buf = data[size:]
+        return data[:size]
+
+
+# escapes for COPY text format
+_copy_escapes = str.maketrans({"\\": "\\\\", "\t": "\\t", "\n": "\\n", "\r": "\\r"})
+
+
+def _parse_shard(shard_str):
+    """return (shard, n_shards) from "K/N", where 1 <= K <= N"""
+    try:
+        shard, n_shards = (int(v) for v in shard_str.split("/"))
+    except ValueError:
+        raise UTAError("{}: shard must be K/N".format(shard_str))
+    if not 1 <= shard <= n_shards:
+        raise UTAError("{}: shard must be K/N with 1 <= K <= N".format(shard_str))
+    return shard, n_shards
+
+
+def _aln_subset_predicates(opts):
+    """return predicates, as psycopg2.sql objects, restricting
+    tx_alt_exon_pairs_v to the exon pairs selected by align-exons
+    subset options
+
+    Values are composed into the predicates as literals, so that the
+    query is executed without parameters and the --sql predicate is
+    passed to the server as given (e.g., with % in LIKE patterns).
+
+    """
+    preds = []
+    if opts.get("--sql"):
+        preds.append(psycopg2.sql.SQL("({})").format(psycopg2.sql.SQL(opts["--sql"])))
+    if opts.get("--tx-ac-file"):
+        with open(opts["--tx-ac-file"]) as fh:
+            tx_acs = [line.strip() for line in fh if line.strip() and not line.startswith("#")]
+        logger.info("{fn}: {n} transcript accessions".format(fn=opts["--tx-ac-file"], n=len(tx_acs)))
+        preds.append(psycopg2.sql.SQL("tx_ac = ANY({})").format(psycopg2.sql.Literal(tx_acs)))
+    if opts.get("--alt-ac"):
+        preds.append(psycopg2.sql.SQL("alt_ac = {}").format(psycopg2.sql.Literal(opts["--alt-ac"])))
+    if opts.get("--alt-aln-method"):
+        preds.append(psycopg2.sql.SQL("alt_aln_method = {}").format(psycopg2.sql.Literal(opts["--alt-aln-method"])))
+    return preds
+
+
+def _aln_shard_predicate(shard, n_shards, col="tx_ac"):
+    """return SQL predicate selecting rows in shard (of n_shards) by
+    the first 32 bits of md5(tx_ac)"""
+    if n_shards == 1:
+        return "true"
+    return "mod(('x' || substr(md5({col}), 1, 8))::bit(32)::bigint, {n_shards}) = {i}".format(
+        col=col, n_shards=n_shards, i=shard - 1)
+
+
+def _finish_align_exons_run(cur, shard, n_shards):
+    cur.execute("UPDATE align_exons_run SET status='done', finished=now() WHERE n_shards=%s AND shard=%s",
+                (n_shards, shard))
+
+
+def _verify_align_exons_shards(cur, n_shards):
+    """raise UTAError unless all n_shards align-exons shards are done
+    and every unaligned exon pair belongs to a failed (tx_ac, alt_ac)"""
+    cur.execute("SELECT shard FROM align_exons_run WHERE n_shards=%s AND status='done'", (n_shards,))
+    done = {r.shard for r in cur.fetchall()}
+    not_done = sorted(set(range(1, n_shards + 1)) - done)
+    if not_done:
+        raise UTAError("align-exons shards not done: {}".format(
+            ", ".join("{}/{}".format(k, n_shards) for k in not_done)))
+    cur.execute("""
+        SELECT count(*) AS n FROM tx_alt_exon_pairs_v TAEP
+        WHERE exon_aln_id is NULL and tx_ac !~ '/' AND NOT EXISTS (
+            SELECT 1 FROM align_exons_checkpoint C
+            WHERE C.tx_ac=TAEP.tx_ac AND C.alt_ac=TAEP.alt_ac AND C.status='failed')
+        """)
+    n_pending = cur.fetchone().n
+    if n_pending:
+        raise UTAError("{} exon pairs remain unaligned after all {} align-exons shards".format(n_pending, n_shards))
+    cur.execute("SELECT count(*) AS n FROM align_exons_checkpoint WHERE status='failed'")
+    logger.info("all {n_shards} align-exons shards done; {n_failed} (tx_ac, alt_ac) failed".format(
+        n_shards=n_shards, n_failed=cur.fetchone().n))
+
+
+def _align_exons_checkpoint_row(group, n_pairs, reason):
+    tx_ac, alt_ac = group
+    status = "done" if reason is None else "failed"
+    return (tx_ac, alt_ac, status, reason, n_pairs, datetime.datetime.now())
+
+
+def _upsert_align_exons_checkpoints(cur, ckpt_rows):
+    """record align-exons progress for (tx_ac, alt_ac) groups"""
+    if not ckpt_rows:
+        return
+    psycopg2.extras.execute_values(cur, """
+        INSERT INTO align_exons_checkpoint (tx_ac, alt_ac, status, reason, n_pairs, updated) VALUES %s
+        ON CONFLICT (tx_ac, alt_ac) DO UPDATE
+        SET status=excluded.status, reason=excluded.reason, n_pairs=excluded.n_pairs, updated=excluded.updated
+        """, ckpt_rows)
+
+
+def _fetch_exon_seq(sf, ac, s, e):
+    logger.debug("fetching sequence {ac}[{s}:{e}]".format(ac=ac, s=s, e=e))
+    seq = sf.fetch(ac, s, e)
+    assert seq is not None, "sequence {ac}[{s}:{e}] should never be None (coordinates bogus?)".format(ac=ac, s=s, e=e)
+    if isinstance(seq, six.binary_type):
+        seq = seq.decode("ascii")  # force into unicode
+    assert isinstance(seq, six.text_type)
+    return seq
+
+
+def _imap_ordered(pool, func, iterable, window):
+    """like pool.imap, but keeps at most `window` tasks in flight so
+    that `iterable` is consumed lazily"""
+    pending = collections.deque()
+    for item in iterable:
+        pending.append(pool.apply_async(func, (item,)))
+        if len(pending) >= window:
+            yield pending.popleft().get()
+    while pending:
+        yield pending.popleft().get()
 
 
 def analyze(session, opts, cf):
@@ -274,55 +858,90 @@ def load_assoc_ac(session, opts, cf):
     """
     Insert rows into `associated_accessions` table in the UTA database,
     using data from a file written by sbin/assoc-acs-merge.
+
+    Rows are deduplicated in memory and inserted --batch-size at a time
+    with ON CONFLICT DO NOTHING against the unique_pair_in_origin index,
+    so that existing associations are left as they are.
     """
     logger.info("load_assoc_ac")
 
-    admin_role = cf.get("uta", "admin_role")
-    session.execute(text(f"set role {admin_role};"))
-    session.execute(text(f"set search_path = {usam.schema_name};"))
+    batch_size = int(opts.get("--batch-size") or _assoc_ac_batch_size)
+
+    con = session.bind.pool.connect()
+    cur = con.cursor()
+    cur.execute("set role {admin_role};".format(admin_role=cf.get("uta", "admin_role")))
+    cur.execute("set search_path = " + usam.schema_name)
     fname = opts["FILE"]
 
-    with gzip.open(fname, "rt") as fhandle:
+    seen = set()
+    n_rows = n_added = n_existing = 0
+
+    def _new_keys(fhandle):
+        nonlocal n_rows
         for file_row in csv.DictReader(fhandle, delimiter="\t"):
-            row = {
-                "origin": file_row["origin"],
-                "pro_ac": file_row["pro_ac"],
-                "tx_ac": file_row["tx_ac"],
-            }
-            aa, created = _get_or_insert(
-                session=session,
-                table=usam.AssociatedAccessions,
-                row=row,
-                row_identifier=('origin', 'tx_ac', 'pro_ac'),
-            )
-            if created:
-                # If committing on every insert is too slow, we can
-                # look into committing in batches like load_txinfo does.
-                session.commit()
-                logger.info(f"Added: {aa.tx_ac}, {aa.pro_ac}, {aa.origin}")
-            else:
-                logger.info(f"Already exists: {file_row}")
-                # All fields should should match when unique identifiers match.
-                # Discrepancies should be investigated.
-                existing_row = {
-                    "origin": aa.origin,
-                    "pro_ac": aa.pro_ac,
-                    "tx_ac": aa.tx_ac,
-                }
+            n_rows += 1
+            key = (file_row["origin"], file_row["tx_ac"], file_row["pro_ac"])
+            if key not in seen:
+                seen.add(key)
+                yield key
+
+    with InputFile(fname) as fhandle:
+        for batch in _chunked(_new_keys(fhandle), batch_size):
+            psycopg2.extras.execute_values(cur, """
+                INSERT INTO associated_accessions (origin, tx_ac, pro_ac) VALUES %s
+                ON CONFLICT (origin, tx_ac, pro_ac) DO NOTHING
+                """, batch, page_size=len(batch))
+            con.commit()
+            n_added += cur.rowcount
+            n_existing += len(batch) - cur.rowcount
+            logger.info("{n_rows} rows {p:.1f}%; {n_added} added, {n_existing} already exist; committed".format(
+                n_rows=n_rows, p=fhandle.progress() * 100, n_added=n_added, n_existing=n_existing))
+
+    cur.close()
+    con.close()
+    logger.info("{n_rows} rows; {n_added} added, {n_existing} already exist, {n_dups} duplicates in file".format(
+        n_rows=n_rows, n_added=n_added, n_existing=n_existing, n_dups=n_rows - len(seen)))
+
+
+# associated accessions per load-assoc-ac INSERT and commit
+_assoc_ac_batch_size = 10000
+
+
+# exon sets per load-exonset transaction
+_exonset_batch_size = 1000
 
 
 def load_exonset(session, opts, cf):
-    # exonsets and associated exons are loaded together
+    """load exon sets and their exons
 
-    update_period = 25
+    Transcript exon counts are read once up front and kept current as
+    transcript exon sets are written; a transcript missing from them is
+    looked up again before its row is skipped. Existing exon sets
+    are looked up once per batch of input rows, and each exon set is
+    written with its exons in a single statement inside a savepoint,
+    so that a row failing with IntegrityError is rolled back without
+    losing the rest of its batch. Batches are committed together.
 
-    session.execute(
-        text("set role {admin_role};".format(admin_role=cf.get("uta", "admin_role")))
-    )
-    session.execute(text("set search_path = " + usam.schema_name))
+    """
+
+    added = datetime.datetime.now()
 
-    n_rows = len(gzip.open(opts["FILE"], "rt").readlines()) - 1
-    esr = ufes.ExonSetReader(gzip.open(opts["FILE"], "rt"))
+    con = session.bind.pool.connect()
+    cur = con.cursor()
+    cur.execute("set role {admin_role};".format(admin_role=cf.get("uta", "admin_role")))
+    cur.execute("set search_path = " + usam.schema_name)
+
+    cur.execute("""
+        SELECT ES.tx_ac, count(E.exon_id) FROM exon_set ES
+        LEFT JOIN exon E ON E.exon_set_id = ES.exon_set_id
+        WHERE ES.alt_aln_method = 'transcript' AND ES.alt_ac = ES.tx_ac
+        GROUP BY ES.tx_ac
+        """)
+    tx_exon_counts = dict(cur.fetchall())
+    logger.info("{} transcript exon counts loaded".format(len(tx_exon_counts)))
+
+    fh = InputFile(opts["FILE"])
+    esr = ufes.ExonSetReader(fh)
     logger.info("opened " + opts["FILE"])
 
     n_new = 0
@@ -330,46 +949,63 @@ def load_exonset(session, opts, cf):
     n_deprecated = 0
     n_skipped = 0
     n_errors = 0
-    for i_es, es in enumerate(esr):
-        skipped = False
-        try:
-            # determine if alignment and transcript have the same exon structure
-            tx_es = (
-                session.query(usam.ExonSet)
-                .filter(
-                    usam.ExonSet.tx_ac == es.tx_ac,
-                    usam.ExonSet.alt_ac == es.tx_ac,
-                    usam.ExonSet.alt_aln_method == "transcript",
-                )
-                .one()
+
+    def _log_progress(i_es):
+        logger.info(
+            "{i_es} {p:.1f}%; {n_new} new, {n_unchanged} unchanged, {n_deprecated} deprecated, {n_skipped} skipped, {n_errors} n_errors; committed".format(
+                i_es=i_es,
+                n_new=n_new,
+                n_unchanged=n_unchanged,
+                n_deprecated=n_deprecated,
+                n_skipped=n_skipped,
+                n_errors=n_errors,
+                p=fh.progress() * 100,
             )
-            tx_exon_count = len(tx_es.exons_se_i())
+        )
+
+    i_es = -1
+    for batch in _chunked(enumerate(esr), _exonset_batch_size):
+        existing = _fetch_exon_sets(cur, {(es.tx_ac, es.alt_ac) for _, es in batch})
+        for i_es, es in batch:
+            tx_exon_count = tx_exon_counts.get(es.tx_ac)
+            if tx_exon_count is None:
+                # the transcript exon set may have been written since the counts were read
+                cur.execute("""
+                    SELECT count(E.exon_id) FROM exon_set ES
+                    LEFT JOIN exon E ON E.exon_set_id = ES.exon_set_id
+                    WHERE ES.tx_ac = %s AND ES.alt_ac = ES.tx_ac AND ES.alt_aln_method = 'transcript'
+                    GROUP BY ES.exon_set_id
+                    """, (es.tx_ac,))
+                row = cur.fetchone()
+                if row is not None:
+                    tx_exon_count = tx_exon_counts[es.tx_ac] = row[0]
+            if tx_exon_count is None:
+                logger.warning("NoResultFound for transcript ExonSet: {es.tx_ac}".format(es=es))
+                n_skipped += 1
+                continue
             aln_exon_count = len(es.exons_se_i.split(";"))
-            if tx_exon_count == aln_exon_count:
-                n, o = _upsert_exon_set_record(
-                    session, es.tx_ac, es.alt_ac, es.strand, es.method, es.exons_se_i
-                )
-                session.commit()
-            else:
-                raise ExonStructureMismatchError(
+            if tx_exon_count != aln_exon_count:
+                logger.warning(
                     "Exon structure mismatch: {tx_exon_count} exons in transcript {es.tx_ac}; {aln_exon_count} in alignment {es.alt_ac}".format(
                         tx_exon_count=tx_exon_count,
                         aln_exon_count=aln_exon_count,
                         es=es,
                     )
                 )
-        except IntegrityError as e:
-            logger.exception(e)
-            session.rollback()
-            n_errors += 1
-        except NoResultFound as e:
-            logger.exception(e)
-            logger.warning("NoResultFound for transcript ExonSet: {es.tx_ac}".format(es=es))
-            skipped = True
-        except ExonStructureMismatchError as e:
-            logger.exception(e)
-            skipped = True
-        else:
+                n_skipped += 1
+                continue
+            try:
+                cur.execute("SAVEPOINT load_exonset")
+                [(n, o)] = _upsert_exon_sets(cur, existing, [(es.tx_ac, es.alt_ac, es.strand, es.method,
+                                                              es.exons_se_i)], added)
+                cur.execute("RELEASE SAVEPOINT load_exonset")
+            except psycopg2.IntegrityError as e:
+                logger.exception(e)
+                cur.execute("ROLLBACK TO SAVEPOINT load_exonset")
+                n_errors += 1
+                continue
+            if n is not None and es.method == "transcript" and es.alt_ac == es.tx_ac:
+                tx_exon_counts[es.tx_ac] = aln_exon_count
             (no) = (n is not None, o is not None)
             if no == (True, False):
                 n_new += 1
@@ -377,49 +1013,104 @@ def load_exonset(session, opts, cf):
                 n_deprecated += 1
             elif no == (False, True):
                 n_unchanged += 1
-        finally:
-            if skipped:
-                n_skipped += 1
-            if i_es % update_period == 0 or i_es + 1 == n_rows:
-                logger.info(
-                    "{i_es}/{n_rows} {p:.1f}%; {n_new} new, {n_unchanged} unchanged, {n_deprecated} deprecated, {n_skipped} skipped, {n_errors} n_errors".format(
-                        i_es=i_es,
-                        n_rows=n_rows,
-                        n_new=n_new,
-                        n_unchanged=n_unchanged,
-                        n_deprecated=n_deprecated,
-                        n_skipped=n_skipped,
-                        n_errors=n_errors,
-                        p=(i_es + 1) / n_rows * 100,
-                    )
-                )
+        con.commit()
+        _log_progress(i_es)
 
-    session.commit()
+    con.commit()
+    _log_progress(i_es)
+    fh.close()
+    cur.close()
+    con.close()
+
+
+def _chunked(iterable, n):
+    """yield lists of up to n consecutive items from iterable"""
+    it = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(it, n))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _fetch_exon_sets(cur, tx_alt_acs):
+    """return {(tx_ac, alt_ac, alt_aln_method): (exon_set_id, exons in transcript order)}
+    for all exon sets of the given (tx_ac, alt_ac) pairs"""
+    if not tx_alt_acs:
+        return {}
+    rows = psycopg2.extras.execute_values(cur, """
+        SELECT ES.tx_ac, ES.alt_ac, ES.alt_aln_method, ES.exon_set_id,
+               coalesce(string_agg(E.start_i || ',' || E.end_i, ';'
+                   ORDER BY E.ord), '')
+        FROM (VALUES %s) V (tx_ac, alt_ac)
+        JOIN exon_set ES ON ES.tx_ac = V.tx_ac AND ES.alt_ac = V.alt_ac
+        LEFT JOIN exon E ON E.exon_set_id = ES.exon_set_id
+        GROUP BY ES.exon_set_id
+        """, sorted(tx_alt_acs), fetch=True)
+    return {(tx_ac, alt_ac, method): (es_id, es_ess) for tx_ac, alt_ac, method, es_id, es_ess in rows}
 
 
 def load_geneinfo(session, opts, cf):
-    session.execute(text("set role {admin_role};".format(
-        admin_role=cf.get("uta", "admin_role"))))
-    session.execute(text("set search_path = " + usam.schema_name))
+    """insert or update genes from a geneinfo file
+
+    Genes are upserted --batch-size at a time with INSERT ... ON
+    CONFLICT; rows whose content matches the stored gene are left
+    untouched, so that only changed genes are written.
+
+    """
+
+    batch_size = int(opts.get("--batch-size") or _geneinfo_batch_size)
+    added = datetime.datetime.now()
+
+    con = session.bind.pool.connect()
+    cur = con.cursor()
+    cur.execute("set role {admin_role};".format(admin_role=cf.get("uta", "admin_role")))
+    cur.execute("set search_path = " + usam.schema_name)
 
-    gir = ufgi.GeneInfoReader(gzip.open(opts["FILE"], 'rt'))
+    fh = InputFile(opts["FILE"])
+    gir = ufgi.GeneInfoReader(fh)
     logger.info("opened " + opts["FILE"])
 
-    for i_gi, gi in enumerate(gir):
-        session.merge(
-            usam.Gene(
-                gene_id=gi.gene_id,
-                hgnc=gi.hgnc,
-                symbol=gi.gene_symbol,
-                maploc=gi.maploc,
-                descr=gi.descr,
-                summary=gi.summary,
-                aliases=gi.aliases,
-                type=gi.type,
-                xrefs=gi.xrefs,
-            ))
-        logger.debug("Added {gi.gene_symbol}: {gi.gene_id} ({gi.summary})".format(gi=gi))
-    session.commit()
+    n_rows = n_inserted = n_updated = n_unchanged = 0
+    for batch in _chunked(gir, batch_size):
+        # the last of several rows for a gene wins, as with session.merge
+        genes = {gi.gene_id: gi for gi in batch}
+        # aliases and xrefs are lists, stored as their array text representation
+        rows = [(gi.gene_id, gi.hgnc, gi.gene_symbol, gi.maploc, gi.descr, gi.summary, gi.aliases, gi.type,
+                 gi.xrefs, added) for gi in genes.values()]
+        written = psycopg2.extras.execute_values(cur, """
+            INSERT INTO gene AS G (gene_id, hgnc, symbol, maploc, descr, summary, aliases, type, xrefs, added)
+            VALUES %s
+            ON CONFLICT (gene_id) DO UPDATE SET
+                hgnc = EXCLUDED.hgnc, symbol = EXCLUDED.symbol, maploc = EXCLUDED.maploc, descr = EXCLUDED.descr,
+                summary = EXCLUDED.summary, aliases = EXCLUDED.aliases, type = EXCLUDED.type, xrefs = EXCLUDED.xrefs
+            WHERE (G.hgnc, G.symbol, G.maploc, G.descr, G.summary, G.aliases, G.type, G.xrefs)
+                  IS DISTINCT FROM (EXCLUDED.hgnc, EXCLUDED.symbol, EXCLUDED.maploc, EXCLUDED.descr,
+                                    EXCLUDED.summary, EXCLUDED.aliases, EXCLUDED.type, EXCLUDED.xrefs)
+            RETURNING G.gene_id, (xmax = 0)
+            """, rows, page_size=len(rows), fetch=True)
+        updated_gene_ids = [gene_id for gene_id, inserted in written if not inserted]
+        if updated_gene_ids:
+            cur.execute("""
+                INSERT INTO stale_tx (tx_ac, added) SELECT ac, clock_timestamp() FROM transcript WHERE gene_id = ANY(%s)
+                ON CONFLICT (tx_ac) DO UPDATE SET added = clock_timestamp()
+                """, (updated_gene_ids,))
+        con.commit()
+        n_rows += len(batch)
+        n_batch_inserted = sum(1 for _, inserted in written if inserted)
+        n_inserted += n_batch_inserted
+        n_updated += len(written) - n_batch_inserted
+        n_unchanged += len(rows) - len(written)
+        logger.info("{n_rows} rows {p:.1f}%; {n_inserted} inserted, {n_updated} updated, {n_unchanged} unchanged; committed".format(
+            n_rows=n_rows, p=fh.progress() * 100, n_inserted=n_inserted, n_updated=n_updated, n_unchanged=n_unchanged))
+
+    fh.close()
+    cur.close()
+    con.close()
+
+
+# genes per load-geneinfo upsert and commit
+_geneinfo_batch_size = 1000
 
 
 def load_ncbi_seqgene(session, opts, cf):
@@ -465,7 +1156,7 @@ def load_ncbi_seqgene(session, opts, cf):
     sg_filter = lambda r: (r["transcript"].startswith("NM_")
                            and r["group_label"] == "GRCh37.p10-Primary Assembly"
                            and r["feature_type"] in ["CDS", "UTR"])
-    sgparser = uta.parsers.seqgene.SeqGeneParser(gzip.open(opts["FILE"], 'rt'),
+    sgparser = uta.parsers.seqgene.SeqGeneParser(InputFile(opts["FILE"]),
                                                  filter=sg_filter)
     slurp = sorted(list(sgparser),
                    key=lambda r: (r["transcript"], r["group_label"], r["chr_start"], r["chr_stop"]))
@@ -501,7 +1192,7 @@ def load_origin(session, opts, cf):
         admin_role=cf.get("uta", "admin_role"))))
     session.execute(text("set search_path = " + usam.schema_name))
 
-    orir = csv.DictReader(open(opts["FILE"]), delimiter='\t')
+    orir = csv.DictReader(InputFile(opts["FILE"]), delimiter='\t')
     for rec in orir:
         ori = usam.Origin(name=rec["name"],
                           descr=_none_if_empty(rec["descr"]),
@@ -521,143 +1212,215 @@ def load_origin(session, opts, cf):
 
 def load_seqinfo(session, opts, cf):
     """load Seq entries with accessions from fasta file
-    """
 
-    # TODO: load_seqinfo is horrifically slow (via sqlalchemy). There
-    # must be a better way.
+    seqinfo rows are streamed into a temporary table with COPY, and
+    seq and seq_anno rows are then written with a few set-based
+    statements. Only sequences that are not yet in seq are fetched.
 
-    update_period = 100
+    """
 
     # TODO: Don't store sequences in UTA
     # load sequences up to max_len in size
     # 2e6 was chosen empirically based on sizes of NMs, NGs, NWs, NTs, NCs
     max_len = int(2e6)
 
+    added = datetime.datetime.now()
 
-    session.execute(text("set role {admin_role};".format(
-        admin_role=cf.get("uta", "admin_role"))))
-    session.execute(text("set search_path = " + usam.schema_name))
-
-    n_rows = len(gzip.open(opts["FILE"]).readlines()) - 1
-
-    sir = ufsi.SeqInfoReader(gzip.open(opts["FILE"], 'rt'))
-    logger.info("opened " + opts["FILE"])
+    con = session.bind.pool.connect()
+    cur = con.cursor()
+    cur.execute("set role {admin_role};".format(admin_role=cf.get("uta", "admin_role")))
+    cur.execute("set search_path = " + usam.schema_name)
+
+    cur.execute("""
+        CREATE TEMP TABLE seqinfo_stage (md5 text, origin text, ac text, descr text, len int) ON COMMIT DROP;
+        CREATE TEMP TABLE seqinfo_seq (seq_id text, len int, seq text) ON COMMIT DROP;
+        """)
+    with InputFile(opts["FILE"]) as fh:
+        logger.info("opened " + opts["FILE"])
+        _copy_rows(cur, "seqinfo_stage", ("md5", "origin", "ac", "descr", "len"),
+                   ((si.md5, si.origin, si.ac, si.descr, si.len) for si in ufsi.SeqInfoReader(fh)))
+    cur.execute("SELECT count(*), count(DISTINCT md5) FROM seqinfo_stage")
+    n_rows, n_md5s = cur.fetchone()
+    logger.info("staged {n_rows} seqinfo rows for {n_md5s} sequences".format(n_rows=n_rows, n_md5s=n_md5s))
+
+    cur.execute("""
+        SELECT DISTINCT S.origin FROM seqinfo_stage S
+        WHERE NOT EXISTS (SELECT 1 FROM origin O WHERE O.name = S.origin) ORDER BY S.origin
+        """)
+    missing_origins = [r[0] for r in cur.fetchall()]
+    if missing_origins:
+        raise UTAError("origin(s) not in database: " + ", ".join(missing_origins))
+
+    # accessions that map to more than one sequence, in the file or against seq_anno
+    cur.execute("""
+        SELECT origin, ac, array_agg(md5 ORDER BY md5) FROM (
+            SELECT S.origin, S.ac, S.md5 FROM seqinfo_stage S
+            UNION
+            SELECT S.origin, S.ac, A.seq_id FROM seqinfo_stage S
+            JOIN origin O ON O.name = S.origin
+            JOIN seq_anno A ON A.origin_id = O.origin_id AND A.ac = S.ac
+        ) X
+        GROUP BY origin, ac HAVING count(DISTINCT md5) > 1 ORDER BY origin, ac
+        """)
+    conflicts = cur.fetchall()
+    for origin, ac, md5s in conflicts:
+        logger.error("{origin}:{ac}: accession maps to multiple sequences: {md5s}".format(
+            origin=origin, ac=ac, md5s=", ".join(md5s)))
+    if conflicts:
+        raise UTAError("{n} accession(s) map to multiple sequences; nothing loaded".format(n=len(conflicts)))
+
+    # this is to satisfy a FK dependency, which should be reconsidered
+    cur.execute("""
+        SELECT DISTINCT ON (S.md5) S.md5, S.ac, S.len FROM seqinfo_stage S
+        WHERE NOT EXISTS (SELECT 1 FROM seq Q WHERE Q.seq_id = S.md5) ORDER BY S.md5, S.ac
+        """)
+    new_seqs = cur.fetchall()
+    logger.info("{} new sequences to fetch".format(len(new_seqs)))
 
     sf = _get_seqfetcher(cf)
+    bad_md5s = []
+
+    def _fetch_new_seqs():
+        for i_seq, (md5, ac, seq_len) in enumerate(new_seqs):
+            seq = str(sf.fetch(ac)).upper()
+            if seq_len != len(seq):
+                logger.error("Expected a sequence of length {seq_len} for {md5}; got length {len2} for {ac}; skipping".format(
+                    seq_len=seq_len, md5=md5, len2=len(seq), ac=ac))
+                bad_md5s.append(md5)
+                continue
+            yield (md5, seq_len, seq if len(seq) < max_len else None)
+            if (i_seq + 1) % 1000 == 0:
+                logger.info("{i}/{n} sequences fetched".format(i=i_seq + 1, n=len(new_seqs)))
+
+    _copy_rows(cur, "seqinfo_seq", ("seq_id", "len", "seq"), _fetch_new_seqs())
+    if bad_md5s:
+        cur.execute("DELETE FROM seqinfo_stage WHERE md5 = ANY(%s)", (bad_md5s,))
+    cur.execute("INSERT INTO seq (seq_id, len, seq) SELECT seq_id, len, seq FROM seqinfo_seq ON CONFLICT (seq_id) DO NOTHING")
+    n_seqs = cur.rowcount
+
+    cur.execute("""
+        UPDATE seq_anno A SET descr = S.descr
+        FROM seqinfo_stage S JOIN origin O ON O.name = S.origin
+        WHERE A.origin_id = O.origin_id AND A.ac = S.ac AND S.descr <> '' AND A.descr IS DISTINCT FROM S.descr
+        """)
+    n_updated = cur.rowcount
+
+    cur.execute("""
+        INSERT INTO seq_anno (origin_id, seq_id, ac, descr, added)
+        SELECT DISTINCT ON (O.origin_id, S.ac) O.origin_id, S.md5, S.ac, S.descr, %s
+        FROM seqinfo_stage S JOIN origin O ON O.name = S.origin
+        ORDER BY O.origin_id, S.ac, S.descr DESC
+        ON CONFLICT (origin_id, ac) DO NOTHING
+        """, (added,))
+    n_created = cur.rowcount
+
+    # seq_anno_most_recent, and stale_tx for exon sets on accessions whose
+    # most recent sequence changed, are brought up to date by triggers on
+    # seq_anno (see usam.seq_anno_most_recent_ddl)
+
+    con.commit()
+    cur.close()
+    con.close()
+    logger.info("{n_created} annotations created, {n_updated} descriptions updated, {n_seqs} sequences created/"
+                "{n_md5s} sequences seen ({n_skipped} skipped); committed".format(
+                    n_created=n_created, n_updated=n_updated, n_seqs=n_seqs, n_md5s=n_md5s,
+                    n_skipped=len(bad_md5s)))
 
-    _md5_seq_cache = {}
-    def _upsert_seq(si):
-        if si.md5 in _md5_seq_cache:
-            return _md5_seq_cache[si.md5]
-
-        u_seq = session.query(usam.Seq).filter(usam.Seq.seq_id == md5).first()
-        if u_seq is None:
-            seq = str(sf[si.ac]).upper()
-            if int(si.len) != len(seq):
-                raise RuntimeError("Expected a sequence of length {si.len} for {si.md5}; got length {len2} for {si.ac}; skipping".format(
-                    si=si, len2=len(seq)))
-            iseq = seq if len(seq) < max_len else None
-            u_seq = usam.Seq(seq_id=si.md5, len=si.len, seq=iseq)
-            session.add(u_seq)
-        _md5_seq_cache[si.md5] = u_seq
-        return _md5_seq_cache[si.md5]
-
-    i_md5 = 0
-    n_created = 0
-    for md5, si_iter in itertools.groupby(sorted(sir, key=lambda si: si.md5),
-                                          key=lambda si: si.md5):
-        sis = list(si_iter)
-
-        # if sequence doesn't exist in sequence table, make it
-        # this is to satisfy a FK dependency, which should be reconsidered
-        si = sis[0]
-        try:
-            u_seq = _upsert_seq(si)
-        except RuntimeError as e:
-            logger.exception(e)
-            continue
 
-        for si in sis:
-            u_ori = session.query(usam.Origin).filter(
-                usam.Origin.name == si.origin).one()
-            u_seqanno = session.query(usam.SeqAnno).filter(
-                usam.SeqAnno.origin_id == u_ori.origin_id,
-                usam.SeqAnno.ac == si.ac).first()
-            logger.debug("seq_anno({si.origin},{si.ac},{si.md5}) {st}".format(
-                si=si, st="exists" if u_seqanno is not None else "doesn't exist"))
-            if u_seqanno:
-                # update descr, perhaps
-                if u_seqanno.seq_id != si.md5:
-                    raise RuntimeError("{si.origin}:{si.ac} for {si.md5}: accession already exists for {seq_id}".format(
-                        si=si, seq_id=u_seqanno.seq_id))
-                if si.descr and u_seqanno.descr != si.descr:
-                    u_seqanno.descr = si.descr
-                    session.merge(u_seqanno)
-            else:
-                # create the new annotation
-                logger.debug("creating seq_anno({si.origin},{si.ac},{si.md5})".format(si=si))
-                u_seqanno = usam.SeqAnno(origin_id=u_ori.origin_id, seq_id=si.md5,
-                                         ac=si.ac, descr=si.descr)
-                session.add(u_seqanno)
-                n_created += 1
-
-        i_md5 += 1
-        if i_md5 % update_period == 1:
-            logger.info("{n_created} annotations created/{i_md5} sequences seen ({p:.1f}%)/{n_rows} sequences total".format(
-                n_created=n_created, i_md5=i_md5, n_rows=n_rows, md5=md5, p=i_md5 / n_rows * 100))
-            session.commit()
-    session.commit()
+def load_sequences(session, opts, cf):
+    """store sequences for seq rows that lack them
 
+    Sequences are fetched by a pool of --workers threads, each with its
+    own seqfetcher, and written --batch-size at a time with one UPDATE
+    and commit per batch.
 
-def load_sequences(session, opts, cf):
+    """
 
     # TODO: Don't store sequences in UTA
     # load sequences up to max_len in size
     # 2e6 was chosen empirically based on sizes of NMs, NGs, NWs, NTs, NCs
     max_len = int(2e6)
 
-    session.execute(text("set role {admin_role};".format(
-        admin_role=cf.get("uta", "admin_role"))))
-    session.execute(text("set search_path = " + usam.schema_name))
+    n_workers = int(opts.get("--workers") or 1)
+    batch_size = int(opts.get("--batch-size") or _seq_batch_size)
 
-    sf = _get_seqfetcher(cf)
+    con = session.bind.pool.connect()
+    cur = con.cursor()
+    cur.execute("set role {admin_role};".format(admin_role=cf.get("uta", "admin_role")))
+    cur.execute("set search_path = " + usam.schema_name)
 
     # fetch accessions for given sequences
-    sql = """
-    select S.seq_id,S.len,array_agg(SA.ac order by SA.ac~'^ENST',SA.ac) as acs
-    from seq S
-    join seq_anno SA on S.seq_id=SA.seq_id
-    where S.len <= {max_len} and S.seq is NULL
-    group by S.seq_id,len
-    """.format(max_len=max_len)
-
-    def _fetch_first(acs):
-        # try all accessions in acs, return sequence of first that returns a
-        # sequence
-        for ac in row["acs"]:
-            try:
-                return sf.fetch(ac)
-            except KeyError:
-                pass
-        return None
+    cur.execute("""
+        select S.seq_id,S.len,array_agg(SA.ac order by SA.ac~'^ENST',SA.ac) as acs
+        from seq S
+        join seq_anno SA on S.seq_id=SA.seq_id
+        where S.len <= %s and S.seq is NULL
+        group by S.seq_id,len
+        """, (max_len,))
+    rows = cur.fetchall()
+    logger.info("{n} sequences to load with {n_workers} thread(s)".format(n=len(rows), n_workers=n_workers))
+
+    if n_workers > 1:
+        pool = multiprocessing.pool.ThreadPool(n_workers, initializer=_seq_fetch_init, initargs=(cf,))
+        seqs = _imap_ordered(pool, _fetch_first_seq, (acs for _, _, acs in rows), window=2 * batch_size)
+    else:
+        pool = None
+        _seq_fetch_init(cf)
+        seqs = map(_fetch_first_seq, (acs for _, _, acs in rows))
+
+    n_loaded = 0
+    try:
+        rows_seqs = zip(rows, seqs)
+        for i_batch, batch in enumerate(_chunked(rows_seqs, batch_size)):
+            updates = []
+            for (seq_id, seq_len, acs), seq in batch:
+                if seq is None:
+                    logger.warning("No sequence found for {acs}".format(acs=acs))
+                    continue
+                seq = seq.upper()
+                if seq_len != len(seq):
+                    logger.error("Expected a sequence of length {len} for {md5} ({acs}); got sequence of length {len2}".format(
+                        len=seq_len, md5=seq_id, acs=acs, len2=len(seq)))
+                    continue
+                updates.append((seq_id, seq))
+            if updates:
+                psycopg2.extras.execute_values(cur, """
+                    UPDATE seq S SET seq = V.seq FROM (VALUES %s) V (seq_id, seq) WHERE S.seq_id = V.seq_id
+                    """, updates, page_size=len(updates))
+            con.commit()
+            n_loaded += len(updates)
+            n_seen = min((i_batch + 1) * batch_size, len(rows))
+            logger.info("{n_seen}/{n_rows} {p:.1f}%; {n_loaded} sequences loaded; committed".format(
+                n_seen=n_seen, n_rows=len(rows), p=n_seen / len(rows) * 100, n_loaded=n_loaded))
+    finally:
+        if pool is not None:
+            pool.terminate()
+        cur.close()
+        con.close()
+
+
+# sequences per load-sequences UPDATE and commit
+_seq_batch_size = 100
+
+_seq_fetch_local = threading.local()   # per-thread config and seqfetcher; see _seq_fetch_init
 
-    for row in session.execute(sql):
-        seq = _fetch_first(row["acs"])
-        if seq is None:
-            logger.warn("No sequence found for {acs}".format(acs=row["acs"]))
-            continue
-        seq = seq.upper()
-        if row["len"] != len(seq):
-            logger.error("Expected a sequence of length {len} for {md5} ({acs}); got sequence of length {len2}".format(
-                len=row["len"], md5=row["seq_id"], acs=row["acs"], len2=len(seq)))
-            continue
-        assert row["len"] == len(seq), "expected a sequence of length {len} for {md5} ({acs}); got length {len2}".format(
-            len=row["len"], md5=row["seq_id"], acs=row["acs"], len2=len(seq))
-        session.execute(usam.Seq.__table__.update().values(
-            seq=seq).where(usam.Seq.seq_id == row["seq_id"]))
-        logger.info("loaded sequence of length {len} for {md5} ({acs})".format(
-            len=len(seq), md5=row["seq_id"], acs=row["acs"]))
-        session.commit()
+
+def _seq_fetch_init(cf):
+    _seq_fetch_local.cf = cf
+    _seq_fetch_local.sf = None
+
+
+def _fetch_first_seq(acs):
+    """return the sequence of the first accession in acs that has
+    one, or None"""
+    if _seq_fetch_local.sf is None:
+        _seq_fetch_local.sf = _get_seqfetcher(_seq_fetch_local.cf)
+    for ac in acs:
+        try:
+            return _seq_fetch_local.sf.fetch(ac)
+        except KeyError:
+            pass
+    return None
 
 
 def load_sql(session, opts, cf):
@@ -668,13 +1431,17 @@ def load_sql(session, opts, cf):
 
     for fn in opts["FILES"]:
         logger.info("loading " + fn)
-        session.execute(open(fn).read())
+        session.execute(text(open(fn).read()))
     session.commit()
 
 
 def load_txinfo(session, opts, cf):
+    if opts.get("--bulk") and not opts.get("--dry-run"):
+        return _load_txinfo_bulk(session, opts, cf)
+
     self_aln_method = "transcript"
     update_period = 250
+    n_workers = int(opts.get("--workers") or 1)
     sf = None                 # established on first use, below
 
     @lru_cache(maxsize=100)
@@ -687,8 +1454,8 @@ def load_txinfo(session, opts, cf):
             raise e
         return ori
 
-    n_rows = len(gzip.open(opts["FILE"], 'rt').readlines()) - 1
-    tir = ufti.TxInfoReader(gzip.open(opts["FILE"], 'rt'))
+    fh = InputFile(opts["FILE"])
+    tir = ufti.TxInfoReader(fh)
     logger.info("opened " + opts["FILE"])
 
     session.execute(text("set role {admin_role};".format(
@@ -700,7 +1467,34 @@ def load_txinfo(session, opts, cf):
     n_cds_changed = 0
     n_exons_changed = 0
 
-    for i_ti, ti in enumerate(tir):
+    def _log_progress(i_ti, final=False):
+        if i_ti % update_period == 0 or final:
+            session.commit()
+            logger.info("{i_ti} {p:.1f}%; {n_new} new, {n_unchanged} unchanged, "
+                        "{n_cds_changed} cds changed, {n_exons_changed} exons changed; commited".format(
+                i_ti=i_ti,
+                n_new=n_new, n_unchanged=n_unchanged, n_cds_changed=n_cds_changed, n_exons_changed=n_exons_changed,
+                p=fh.progress() * 100))
+
+    # Transcripts whose CDS, gene, exons, and translation exceptions
+    # match the current state are counted as unchanged without queries;
+    # all others go through the ORM below.
+    tx_index, te_index = _preload_txinfo_index(session, cf, self_aln_method)
+
+    # CDS digests of new and changed transcripts are computed ahead of
+    # the database work, in n_workers processes
+    ti_md5s = _iter_txinfo_cds_md5s(tir, tx_index, cf, n_workers)
+
+    if opts.get("--dry-run"):
+        t0 = time.time()
+        n_md5 = sum(1 for _, pre_cds_md5 in ti_md5s if pre_cds_md5 is not None)
+        td = time.time() - t0
+        logger.info("dry run: {n} CDS digests computed in {td:.1f}s ({rate:.1f}/s) with {n_workers} worker(s); "
+                    "database unchanged".format(n=n_md5, td=td, rate=n_md5 / td if td else 0, n_workers=n_workers))
+        return
+
+    i_ti = -1
+    for i_ti, (ti, pre_cds_md5) in enumerate(ti_md5s):
         if ti.exons_se_i == "":
             logger.warning(ti.ac + ": no exons?!; skipping.")
             continue
@@ -713,6 +1507,16 @@ def load_txinfo(session, opts, cf):
             codon_table = None
             cds_md5 = None
 
+        tx_state = tx_index.pop(ti.ac, None)     # popped: a repeated ac must see the updated state
+        if tx_state == (cds_start_i, cds_end_i, ti.gene_id, _exons_digest(ti.exons_se_i)):
+            tes = _create_translation_exceptions(ti.ac, ti.transl_except.split(";")) if ti.transl_except else []
+            if te_index.get(ti.ac, set()).issuperset(
+                    (te["start_position"], te["end_position"], te["amino_acid"]) for te in tes):
+                logger.debug("Transcript {ti.ac} exon structure unchanged".format(ti=ti))
+                n_unchanged += 1
+                _log_progress(i_ti)
+                continue
+
         # 1. Fetch or make the Transcript record
         existing = session.query(usam.Transcript).filter(
             usam.Transcript.ac == ti.ac,
@@ -727,21 +1531,22 @@ def load_txinfo(session, opts, cf):
                 u_tx.ac = "{u_tx.ac}/{u_tx.cds_start_i}..{u_tx.cds_end_i}".format(u_tx=u_tx)
                 logger.warn("Transcript {ti.ac}: CDS coordinates changed!; renamed to {u_tx.ac}".format(ti=ti, u_tx=u_tx))
                 session.flush()
+                _mark_stale_tx(session, [u_tx.ac])
                 u_tx = None
                 n_cds_changed += 1
 
-            if ti.transl_except:
-                # if the transl_except exists, make sure it exists in the database.
+            if u_tx is not None and ti.transl_except:
+                # if the transl_except exists, make sure it exists in the database;
+                # a transcript replaced above gets them with its new record below
                 te_list = _create_translation_exceptions(
                     transcript=ti.ac, transl_except_list=ti.transl_except.split(";")
                 )
-                for te_data in te_list:
-                    te, created = _get_or_insert(
-                        session=session,
-                        table=usam.TranslationException,
-                        row=te_data,
-                        row_identifier=("tx_ac", "start_position", "end_position", "amino_acid"),
-                    )
+                for te, created in _get_or_insert_many(
+                    session=session,
+                    table=usam.TranslationException,
+                    rows=te_list,
+                    row_identifier=("tx_ac", "start_position", "end_position", "amino_acid"),
+                ):
                     if created:
                         logger.info(
                             f"TranslationException added: {te.tx_ac}, {te.start_position}, {te.end_position}, {te.amino_acid}"
@@ -759,7 +1564,9 @@ def load_txinfo(session, opts, cf):
         if u_tx is None:
             ori = _fetch_origin_by_name(ti.origin)
 
-            if ti.cds_se_i:
+            if ti.cds_se_i and pre_cds_md5 is not None:
+                cds_md5 = pre_cds_md5
+            elif ti.cds_se_i:
                 if sf is None:
                     sf = _get_seqfetcher(cf)
                 try:
@@ -808,13 +1615,300 @@ def load_txinfo(session, opts, cf):
             logger.debug("Transcript {ti.ac} exon structure unchanged".format(ti=ti))
             n_unchanged += 1
 
-        if i_ti % update_period == 0 or i_ti + 1 == n_rows:
-            session.commit()
-            logger.info("{i_ti}/{n_rows} {p:.1f}%; {n_new} new, {n_unchanged} unchanged, "
-                        "{n_cds_changed} cds changed, {n_exons_changed} exons changed; commited".format(
-                i_ti=i_ti, n_rows=n_rows,
-                n_new=n_new, n_unchanged=n_unchanged, n_cds_changed=n_cds_changed, n_exons_changed=n_exons_changed,
-                p=(i_ti + 1) / n_rows * 100))
+        _log_progress(i_ti)
+
+    _log_progress(i_ti, final=True)
+    fh.close()
+
+
+def _preload_txinfo_index(session, cf, self_aln_method):
+    """return (tx_index, te_index) describing current transcripts, read
+    with one streaming query each
+
+    tx_index maps tx_ac to (cds_start_i, cds_end_i, gene_id, digest of
+    the exons of its self-alignment exon set, see _exons_digest).
+    te_index maps tx_ac to a set of (start_position, end_position,
+    amino_acid) translation exceptions.
+
+    """
+    con = session.bind.pool.connect()
+    cur = con.cursor()
+    cur.execute("set role {admin_role};".format(admin_role=cf.get("uta", "admin_role")))
+    cur.execute("set search_path = " + usam.schema_name)
+
+    tx_index = {}
+    cur = con.cursor("txinfo_index")
+    cur.itersize = 50000
+    cur.execute("""
+        SELECT T.ac, T.cds_start_i, T.cds_end_i, T.gene_id,
+               md5(coalesce(string_agg(E.start_i || ',' || E.end_i, ';'
+                   ORDER BY CASE WHEN ES.alt_strand = -1 THEN -E.start_i ELSE E.start_i END), ''))
+        FROM transcript T
+        JOIN exon_set ES ON ES.tx_ac = T.ac AND ES.alt_ac = T.ac AND ES.alt_aln_method = %s
+        LEFT JOIN exon E ON E.exon_set_id = ES.exon_set_id
+        GROUP BY T.ac, ES.exon_set_id
+        """, (self_aln_method,))
+    for ac, cds_start_i, cds_end_i, gene_id, exons_md5 in cur:
+        tx_index[ac] = (cds_start_i, cds_end_i, gene_id, bytes.fromhex(exons_md5))
+    cur.close()
+
+    te_index = collections.defaultdict(set)
+    cur = con.cursor("txinfo_te_index")
+    cur.itersize = 50000
+    cur.execute("SELECT tx_ac, start_position, end_position, amino_acid FROM translation_exception")
+    for tx_ac, start_position, end_position, amino_acid in cur:
+        te_index[tx_ac].add((start_position, end_position, amino_acid))
+    cur.close()
+    con.close()
+
+    logger.info("preloaded {n_tx} transcripts and {n_te} translation exceptions".format(
+        n_tx=len(tx_index), n_te=sum(len(v) for v in te_index.values())))
+    return tx_index, te_index
+
+
+def _iter_txinfo_cds_md5s(tir, tx_index, cf, n_workers):
+    """yield (ti, cds_md5) for txinfo rows, in order
+
+    cds_md5 is computed ahead for rows with a CDS that is new or changed
+    according to tx_index, and is None for other rows and for rows
+    whose sequence is missing.
+
+    """
+    pending = collections.deque()
+
+    def _cds_region(ti):
+        if not ti.cds_se_i or ti.exons_se_i == "":
+            return None
+        cds_start_i, cds_end_i = map(int, ti.cds_se_i.split(","))
+        tx_state = tx_index.get(ti.ac)
+        if tx_state is not None and tx_state[:2] == (cds_start_i, cds_end_i):
+            return None
+        return (ti.ac, cds_start_i, cds_end_i)
+
+    def _region_batches():
+        while True:
+            batch = list(itertools.islice(tir, _cds_md5_batch_size))
+            if not batch:
+                return
+            pending.append(batch)
+            yield [_cds_region(ti) for ti in batch]
+
+    for md5s in _imap_cds_md5s(cf, _region_batches(), n_workers):
+        yield from zip(pending.popleft(), md5s)
+
+
+def _imap_cds_md5s(cf, region_batches, n_workers):
+    """yield lists of CDS md5s for batches of (ac, start_i, end_i)
+    regions (see _cds_md5_batch), in order"""
+    if n_workers > 1:
+        pool = multiprocessing.Pool(n_workers, initializer=_cds_md5_worker_init, initargs=(cf,))
+        try:
+            yield from _imap_ordered(pool, _cds_md5_batch, region_batches, window=2 * n_workers)
+        finally:
+            pool.terminate()
+    else:
+        _cds_md5_worker_init(cf)
+        yield from map(_cds_md5_batch, region_batches)
+
+
+# txinfo rows per CDS md5 task
+_cds_md5_batch_size = 100
+
+_cds_md5_cf = None          # per-process config and seqfetcher; see _cds_md5_worker_init
+_cds_md5_sf = None
+
+
+def _cds_md5_worker_init(cf):
+    global _cds_md5_cf, _cds_md5_sf
+    _cds_md5_cf, _cds_md5_sf = cf, None
+
+
+def _cds_md5_batch(regions):
+    """return md5s of the sequences of (ac, start_i, end_i) regions;
+    None for regions that are None or whose sequence is missing"""
+    global _cds_md5_sf
+    md5s = []
+    for region in regions:
+        if region is None:
+            md5s.append(None)
+            continue
+        if _cds_md5_sf is None:
+            _cds_md5_sf = _get_seqfetcher(_cds_md5_cf)
+        try:
+            md5s.append(seq_md5(_cds_md5_sf.fetch(*region)))
+        except KeyError:
+            md5s.append(None)
+    return md5s
+
+
+def _exons_digest(ess):
+    """return compact digest of an exons_se_i string, as in tx_index"""
+    return hashlib.md5(ess.encode("ascii")).digest()
+
+
+def _load_txinfo_bulk(session, opts, cf):
+    """load txinfo with set-based SQL instead of per-transcript queries
+
+    Parsed rows are COPYed into temporary (unlogged) staging tables, and
+    transcripts are then classified and inserted with a few statements
+    over the whole file, and their exon sets a batch at a time with
+    _upsert_exon_sets. The records written and the new, unchanged,
+    cds changed, and exons changed counts are those of the row-by-row
+    load in load_txinfo, for files with at most one row per accession.
+
+    """
+    self_aln_method = "transcript"
+    added = datetime.datetime.now()
+    n_workers = int(opts.get("--workers") or 1)
+
+    con = session.bind.pool.connect()
+    cur = con.cursor()
+    cur.execute("set role {admin_role};".format(admin_role=cf.get("uta", "admin_role")))
+    cur.execute("set search_path = " + usam.schema_name)
+
+    def _tx_rows(fh):
+        for ti in ufti.TxInfoReader(fh):
+            if ti.exons_se_i == "":
+                logger.warning(ti.ac + ": no exons?!; skipping.")
+                continue
+            if ti.cds_se_i:
+                cds_start_i, cds_end_i = map(int, ti.cds_se_i.split(","))
+                codon_table = ti.codon_table
+            else:
+                cds_start_i = cds_end_i = codon_table = None
+            yield (ti.ac, ti.origin, ti.gene_id, cds_start_i, cds_end_i, codon_table, ti.exons_se_i,
+                   ti.transl_except or None)
+
+    cur.execute("""
+        CREATE TEMP TABLE txinfo_stage (ac text, origin text, gene_id text, cds_start_i int, cds_end_i int,
+                                        codon_table text, exons_se_i text, transl_except text) ON COMMIT DROP;
+        CREATE TEMP TABLE txinfo_te_stage (tx_ac text, start_position int, end_position int, amino_acid text)
+            ON COMMIT DROP;
+        CREATE TEMP TABLE txinfo_cds_md5 (ac text primary key, cds_md5 text) ON COMMIT DROP;
+        """)
+    # rows are streamed from the file into COPY; translation exceptions
+    # are expanded from the few staged rows that have them
+    with InputFile(opts["FILE"]) as fh:
+        logger.info("opened " + opts["FILE"])
+        _copy_rows(cur, "txinfo_stage",
+                   ("ac", "origin", "gene_id", "cds_start_i", "cds_end_i", "codon_table", "exons_se_i",
+                    "transl_except"), _tx_rows(fh))
+    cur.execute("SELECT ac, transl_except FROM txinfo_stage WHERE transl_except IS NOT NULL")
+    _copy_rows(cur, "txinfo_te_stage", ("tx_ac", "start_position", "end_position", "amino_acid"),
+               ((te["tx_ac"], te["start_position"], te["end_position"], te["amino_acid"])
+                for ac, transl_except in cur.fetchall()
+                for te in _create_translation_exceptions(ac, transl_except.split(";"))))
+    cur.execute("SELECT (SELECT count(*) FROM txinfo_stage), (SELECT count(*) FROM txinfo_te_stage)")
+    n_tx, n_te = cur.fetchone()
+    logger.info("staged {n_tx} transcripts and {n_te} translation exceptions".format(n_tx=n_tx, n_te=n_te))
+
+    cur.execute("SELECT ac FROM txinfo_stage GROUP BY ac HAVING count(*) > 1 ORDER BY ac")
+    dup_acs = [r[0] for r in cur.fetchall()]
+    if dup_acs:
+        raise UTAError("{n} accessions occur more than once (e.g., {acs}); use the row-by-row load".format(
+            n=len(dup_acs), acs=", ".join(dup_acs[:5])))
+    cur.execute("ALTER TABLE txinfo_stage ADD PRIMARY KEY (ac); ANALYZE txinfo_stage; ANALYZE txinfo_te_stage")
+
+    # 1. Archive transcripts whose CDS changed by renaming them (and,
+    # by cascade, their exon sets) to ac/cds_start_i..cds_end_i
+    cur.execute("""
+        UPDATE transcript T
+        SET ac = T.ac || '/' || coalesce(T.cds_start_i::text, 'None') || '..' || coalesce(T.cds_end_i::text, 'None')
+        FROM txinfo_stage S
+        WHERE T.ac = S.ac AND (T.cds_start_i, T.cds_end_i) IS DISTINCT FROM (S.cds_start_i, S.cds_end_i)
+        RETURNING S.ac, T.ac
+        """)
+    cds_changed = cur.fetchall()
+    for ac, new_ac in cds_changed:
+        logger.warning("Transcript {ac}: CDS coordinates changed!; renamed to {new_ac}".format(ac=ac, new_ac=new_ac))
+    if cds_changed:
+        cur.execute("INSERT INTO stale_tx (tx_ac, added) SELECT unnest(%s::text[]), clock_timestamp() "
+                    "ON CONFLICT (tx_ac) DO UPDATE SET added = clock_timestamp()",
+                    ([new_ac for _, new_ac in cds_changed],))
+    n_cds_changed = len(cds_changed)
+
+    cur.execute("""
+        SELECT S.ac, T.gene_id, S.gene_id FROM txinfo_stage S JOIN transcript T ON T.ac = S.ac
+        WHERE T.gene_id IS DISTINCT FROM S.gene_id
+        """)
+    for ac, old_gene_id, new_gene_id in cur.fetchall():
+        logger.warning("{ac}: GeneID changed from {old} to {new}".format(ac=ac, old=old_gene_id, new=new_gene_id))
+
+    # 2. Insert new transcripts (including those whose CDS changed)
+    cur.execute("""
+        SELECT DISTINCT S.origin FROM txinfo_stage S LEFT JOIN origin O ON O.name = S.origin
+        WHERE O.origin_id IS NULL AND NOT EXISTS (SELECT 1 FROM transcript T WHERE T.ac = S.ac)
+        """)
+    missing_origins = [r[0] for r in cur.fetchall()]
+    if missing_origins:
+        raise UTAError("No origin for " + ", ".join(missing_origins))
+
+    cur.execute("""
+        SELECT S.ac, S.cds_start_i, S.cds_end_i FROM txinfo_stage S
+        WHERE S.cds_start_i IS NOT NULL AND NOT EXISTS (SELECT 1 FROM transcript T WHERE T.ac = S.ac)
+        """)
+    cds_rows = cur.fetchall()
+    if cds_rows:
+        region_batches = (cds_rows[i:i + _cds_md5_batch_size] for i in range(0, len(cds_rows), _cds_md5_batch_size))
+        md5s = itertools.chain.from_iterable(_imap_cds_md5s(cf, region_batches, n_workers))
+        md5_rows = []
+        for (ac, _, _), cds_md5 in zip(cds_rows, md5s):
+            if cds_md5 is None:
+                raise Exception("{ac}: not in sequence database".format(ac=ac))
+            md5_rows.append((ac, cds_md5))
+        _copy_rows(cur, "txinfo_cds_md5", ("ac", "cds_md5"), md5_rows)
+
+    # codon_table is the column default for non-coding transcripts, as for ORM inserts with codon_table=None
+    cur.execute("""
+        INSERT INTO transcript (ac, origin_id, gene_id, cds_start_i, cds_end_i, cds_md5, codon_table, added)
+        SELECT S.ac, O.origin_id, S.gene_id, S.cds_start_i, S.cds_end_i, M.cds_md5, coalesce(S.codon_table, '1'), %s
+        FROM txinfo_stage S
+        JOIN origin O ON O.name = S.origin
+        LEFT JOIN txinfo_cds_md5 M ON M.ac = S.ac
+        WHERE NOT EXISTS (SELECT 1 FROM transcript T WHERE T.ac = S.ac)
+        """, (added,))
+    logger.info("{} transcripts inserted".format(cur.rowcount))
+
+    cur.execute("""
+        INSERT INTO translation_exception (tx_ac, start_position, end_position, amino_acid)
+        SELECT DISTINCT E.tx_ac, E.start_position, E.end_position, E.amino_acid FROM txinfo_te_stage E
+        WHERE NOT EXISTS (
+            SELECT 1 FROM translation_exception X
+            WHERE X.tx_ac = E.tx_ac AND X.start_position = E.start_position
+                  AND X.end_position = E.end_position AND X.amino_acid = E.amino_acid)
+        """)
+    logger.info("{} translation exceptions inserted".format(cur.rowcount))
+
+    # 3. Upsert exon sets and exons, a batch of transcripts at a time;
+    # changed exon sets are archived as in _upsert_exon_set_record
+    n_new = n_unchanged = n_exons_changed = n_es = n_exons = 0
+    stage_cur = con.cursor("txinfo_stage_es")
+    stage_cur.itersize = _exonset_batch_size
+    stage_cur.execute("SELECT ac, exons_se_i FROM txinfo_stage ORDER BY ac")
+    for batch in _chunked(stage_cur, _exonset_batch_size):
+        existing = _fetch_exon_sets(cur, {(ac, ac) for ac, _ in batch})
+        results = _upsert_exon_sets(cur, existing, [(ac, ac, 1, self_aln_method, ess) for ac, ess in batch], added)
+        for (ac, ess), (n, o) in zip(batch, results):
+            (no) = (n is not None, o is not None)
+            if no == (True, False):
+                n_new += 1
+            elif no == (True, True):
+                logger.warning("Transcript {ac} exon structure changed".format(ac=ac))
+                n_exons_changed += 1
+            elif no == (False, True):
+                n_unchanged += 1
+            if n is not None:
+                n_es += 1
+                n_exons += len(ess.split(";"))
+    stage_cur.close()
+
+    con.commit()
+    cur.close()
+    con.close()
+    logger.info("{n_rows} rows; {n_new} new, {n_unchanged} unchanged, {n_cds_changed} cds changed, "
+                "{n_exons_changed} exons changed; {n_es} exon sets and {n_exons} exons inserted; committed".format(
+                    n_rows=n_tx, n_new=n_new, n_unchanged=n_unchanged, n_cds_changed=n_cds_changed,
+                    n_exons_changed=n_exons_changed, n_es=n_es, n_exons=n_exons))
 
 
 def _create_translation_exceptions(transcript: str, transl_except_list: List[str]) -> List[Dict]:
@@ -851,35 +1945,197 @@ def _create_translation_exceptions(transcript: str, transl_except_list: List[str
     return result
 
 
+# tables that are maintained by refresh-matviews from their defining
+# views in place of matviews, as {table: (view, transcript key columns)};
+# rows are rewritten per transcript, for all transcripts or, with
+# --incremental, for those in stale_tx
+_summary_tables = {
+    "exon_set_exons_fp_mv": ("exon_set_exons_fp_v", ("tx_ac",)),
+    "tx_exon_set_summary_mv": ("tx_exon_set_summary_dv", ("tx_ac",)),
+    "tx_def_summary_mv": ("tx_def_summary_dv", ("tx_ac",)),
+    "tx_exon_aln_mv": ("tx_exon_aln_v", ("tx_ac",)),
+    "tx_similarity_mv": ("tx_similarity_dv", ("tx_ac1", "tx_ac2")),
+}
+
+# views read in place of the defining view by incremental refreshes,
+# where a filter on the keys can't be applied before an aggregate of
+# the defining view; see sql/views.sql
+_summary_table_incremental_views = {
+    "tx_def_summary_mv": "_tx_def_summary_by_tx_v",
+}
+
+
 def refresh_matviews(session, opts, cf):
-    session.execute(text("set role {admin_role};".format(
-        admin_role=cf.get("uta", "admin_role"))))
+    """refresh all materialized views and summary tables in the uta
+    schema, in dependency order
+
+    Dependencies between matviews and summary tables, direct or
+    through plain views, are read from pg_depend and pg_rewrite. Each
+    is refreshed once all of those it depends on have been, on its own
+    connection, and up to --workers refreshes run at a time.
+
+    Summary tables (see _summary_tables) are rewritten from their
+    defining views within a transaction, so readers are not blocked.
+    With --incremental, only the rows of transcripts recorded in
+    stale_tx by loaders are rewritten; matviews are always refreshed
+    in full. Transcripts are removed from stale_tx once all refreshes
+    succeed, unless a loader has marked them again since they were
+    read.
+
+    """
+
+    n_workers = int(opts.get("--workers") or 1)
+    incremental = bool(opts.get("--incremental"))
+    admin_role = cf.get("uta", "admin_role")
+
+    session.execute(text("set role {admin_role};".format(admin_role=admin_role)))
     session.execute(text("set search_path = " + usam.schema_name))
 
-    # matviews must be updated in dependency order. Unfortunately,
-    # it's difficult to determine this programmatically. The "right"
-    # solution is a recursive CTE, but I was unable to find or write
-    # one readily. This function should be consdered a placeholder for
-    # the right way to update, which doesn't exist yet.
+    pending = _matview_dependencies(session)
+    tx_acs = None
+    if any(rel in _summary_tables for rel in pending):
+        # the lock waits for loaders that have marked transcripts but not
+        # yet committed, and makes later marks carry a later time
+        session.execute(text("LOCK TABLE {}.stale_tx IN SHARE MODE".format(usam.schema_name)))
+        read_at = session.execute(text("SELECT CAST(clock_timestamp() AS timestamp)")).scalar()
+        tx_acs = [ac for (ac,) in session.query(usam.StaleTx.tx_ac)]
+        session.commit()
+    logger.info("refreshing {n} matviews and summary tables with {n_workers} thread(s){stale}: {deps}".format(
+        n=len(pending), n_workers=n_workers,
+        stale="; {} stale transcripts".format(len(tx_acs)) if tx_acs is not None else "",
+        deps="; ".join("{mv} <- {d}".format(mv=mv, d=",".join(sorted(d)) or "-") for mv, d in sorted(pending.items()))))
+
+    t0 = time.time()
+    running = {}
+    with concurrent.futures.ThreadPoolExecutor(n_workers) as executor:
+        while pending or running:
+            for mv in sorted(mv for mv, deps in pending.items() if not deps):
+                del pending[mv]
+                if mv in _summary_tables:
+                    future = executor.submit(_refresh_summary_table, session.bind, admin_role, mv,
+                                             tx_acs if incremental else None)
+                else:
+                    future = executor.submit(_refresh_matview, session.bind, admin_role, mv)
+                running[future] = mv
+            if not running:
+                raise UTAError("matview dependencies form a cycle: " + ", ".join(sorted(pending)))
+            done, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                mv = running.pop(future)
+                future.result()
+                for deps in pending.values():
+                    deps.discard(mv)
+
+    if tx_acs:
+        # transcripts marked again during the refresh stay stale; the
+        # session's connection may have changed since the role was set
+        session.execute(text("set role {admin_role};".format(admin_role=admin_role)))
+        session.query(usam.StaleTx).filter(
+            usam.StaleTx.tx_ac.in_(tx_acs), usam.StaleTx.added <= read_at).delete(synchronize_session=False)
+        session.commit()
+    logger.info("refreshed matviews in {:.1f}s".format(time.time() - t0))
+
+
+def _matview_dependencies(session):
+    """return {relation: set of relations it depends on} for all
+    matviews and summary tables in the uta schema, following
+    dependencies through plain views; summary tables depend on what
+    their defining views do"""
+    rows = session.execute(text("""
+        WITH RECURSIVE nodes (oid, def_oid) AS (
+            SELECT M.oid, M.oid FROM pg_class M
+            WHERE M.relkind = 'm' AND M.relnamespace = CAST(:schema AS regnamespace)
+          UNION ALL
+            SELECT T.oid, V.oid
+            FROM unnest(CAST(:tables AS text[]), CAST(:views AS text[])) S (tbl, vw)
+            JOIN pg_class T ON T.relname = S.tbl AND T.relkind = 'r' AND T.relnamespace = CAST(:schema AS regnamespace)
+            JOIN pg_class V ON V.relname = S.vw AND V.relkind = 'v' AND V.relnamespace = T.relnamespace
+        ), deps (node, rel) AS (
+            SELECT N.oid, D.refobjid
+            FROM nodes N
+            JOIN pg_rewrite R ON R.ev_class = N.def_oid
+            JOIN pg_depend D ON D.classid = 'pg_rewrite'::regclass AND D.objid = R.oid
+                                AND D.refclassid = 'pg_class'::regclass AND D.refobjid <> R.ev_class
+          UNION
+            SELECT deps.node, D.refobjid
+            FROM deps
+            JOIN pg_class V ON V.oid = deps.rel AND V.relkind = 'v'
+            JOIN pg_rewrite R ON R.ev_class = V.oid
+            JOIN pg_depend D ON D.classid = 'pg_rewrite'::regclass AND D.objid = R.oid
+                                AND D.refclassid = 'pg_class'::regclass AND D.refobjid <> R.ev_class
+        )
+        SELECT M.relname, NULL FROM nodes N JOIN pg_class M ON M.oid = N.oid
+        UNION
+        SELECT M.relname, DM.relname
+        FROM deps
+        JOIN nodes DN ON DN.oid = deps.rel
+        JOIN pg_class M ON M.oid = deps.node
+        JOIN pg_class DM ON DM.oid = deps.rel
+        WHERE deps.rel <> deps.node
+        """), {"schema": usam.schema_name, "tables": list(_summary_tables), "views": [view for view, _ in _summary_tables.values()]})
+    deps = {}
+    for mv, dep in rows:
+        deps.setdefault(mv, set())
+        if dep is not None:
+            deps[mv].add(dep)
+    return deps
+
+
+def _refresh_matview(engine, admin_role, mv):
+    """refresh matview mv on a connection of its own"""
+    con = engine.pool.connect()
+    try:
+        cur = con.cursor()
+        cur.execute("set role {admin_role};".format(admin_role=admin_role))
+        cur.execute("set search_path = " + usam.schema_name)
+        cmd = "refresh materialized view " + mv
+        logger.info(cmd)
+        t0 = time.time()
+        cur.execute(cmd)
+        con.commit()
+        logger.info("{cmd}: done in {t:.1f}s".format(cmd=cmd, t=time.time() - t0))
+    finally:
+        con.close()
+
 
-    # TODO: Determine mv refresh order programmatically.
-    # sql = "select concat(schemaname,".",matviewname) as fqrn from pg_matviews where schemaname="{schema}"".format(
-    #     schema=schema)
-    # rows = list(session.execute(sql))
-    # cmds = [ "refresh materialized view {fqrn}".format(fqrn=row["fqrn"]) for row in rows ]
+def _refresh_summary_table(engine, admin_role, table, tx_acs):
+    """rewrite summary table from its defining view on a connection of
+    its own, for all transcripts or for those in tx_acs
 
-    cmds = [
-        # N.B. Order matters!
-        "refresh materialized view exon_set_exons_fp_mv",
-        "refresh materialized view tx_exon_set_summary_mv",
-        "refresh materialized view tx_def_summary_mv",
-        "refresh materialized view tx_exon_aln_mv",
-    ]
+    Rows are selected from the view (or its incremental variant, see
+    _summary_table_incremental_views) with one query per key column, so
+    that each filter can use indexes.
 
-    for cmd in cmds:
+    """
+    view, keys = _summary_tables[table]
+    if tx_acs is not None:
+        view = _summary_table_incremental_views.get(table, view)
+    con = engine.pool.connect()
+    try:
+        cur = con.cursor()
+        cur.execute("set role {admin_role};".format(admin_role=admin_role))
+        cur.execute("set search_path = " + usam.schema_name)
+        cmd = "refresh summary table {table} ({which})".format(
+            table=table, which="all transcripts" if tx_acs is None else "{} transcripts".format(len(tx_acs)))
         logger.info(cmd)
-        session.execute(text(cmd))
-    session.commit()
+        t0 = time.time()
+        if tx_acs is None:
+            cur.execute("DELETE FROM {table}".format(table=table))
+            n_deleted = cur.rowcount
+            cur.execute("INSERT INTO {table} SELECT * FROM {view}".format(table=table, view=view))
+        else:
+            params = {"tx_acs": tx_acs}
+            cur.execute("DELETE FROM {table} WHERE {where}".format(
+                table=table, where=" OR ".join("{} = ANY(%(tx_acs)s)".format(k) for k in keys)), params)
+            n_deleted = cur.rowcount
+            cur.execute("INSERT INTO {table} {select}".format(table=table, select=" UNION ".join(
+                "SELECT * FROM {view} WHERE {k} = ANY(%(tx_acs)s)".format(view=view, k=k) for k in keys)), params)
+        n_inserted = cur.rowcount
+        con.commit()
+        logger.info("{cmd}: done in {t:.1f}s; {n_deleted} rows deleted, {n_inserted} inserted".format(
+            cmd=cmd, t=time.time() - t0, n_deleted=n_deleted, n_inserted=n_inserted))
+    finally:
+        con.close()
 
 
 def _get_mfdb(cf):
@@ -927,6 +2183,58 @@ def _get_or_insert(
     return row_instance, created
 
 
+def _get_or_insert_many(
+    session: Session,
+    table: type[usam.Base],
+    rows: Iterable[dict[str, Any]],
+    row_identifier: str | tuple[str, ...],
+    batch_size: int = 1000,
+) -> list[tuple[usam.Base, bool]]:
+    """
+    Batched counterpart of `_get_or_insert`: returns a list of (model, created) for each of `rows`, in order.
+
+    Existing rows are found with one query per batch of `batch_size` rows, and the remaining rows are added
+    together and, as with `_get_or_insert`, left pending until the caller's next flush. A row that repeats
+    the identifier of an earlier row in `rows` is matched to it (created=False), as `_get_or_insert` does
+    when called once per row.
+
+    KeyError may be raised if `row_identifier` refers to columns not present as keys in `row`.
+    sqlalchemy.exc.IntegrityError may be raised on the next flush, as for `_get_or_insert`.
+    """
+    if isinstance(row_identifier, str):
+        row_identifier = (row_identifier,)
+    key_cols = [getattr(table, ri) for ri in row_identifier]
+
+    results = []
+    instances = {}
+    for batch in _chunked(rows, batch_size):
+        keys = [tuple(row[ri] for ri in row_identifier) for row in batch]
+        missing = {k for k in keys if k not in instances}
+        if missing:
+            # rows added from earlier batches are left pending for the caller to flush
+            with session.no_autoflush:
+                for row_instance in session.query(table).filter(tuple_(*key_cols).in_(list(missing))):
+                    instances[tuple(getattr(row_instance, ri) for ri in row_identifier)] = row_instance
+        new_instances = []
+        for row, key in zip(batch, keys):
+            if key in instances:
+                results.append((instances[key], False))
+            else:
+                row_instance = instances[key] = table(**row)
+                new_instances.append(row_instance)
+                results.append((row_instance, True))
+        session.add_all(new_instances)
+    return results
+
+
+def _mark_stale_tx(session, tx_acs):
+    """record transcripts whose summary rows are out of date, stamped
+    with the current time so that a refresh already under way doesn't
+    clear them; see refresh_matviews"""
+    stmt = pg_insert(usam.StaleTx).values([{"tx_ac": ac, "added": func.clock_timestamp()} for ac in tx_acs])
+    session.execute(stmt.on_conflict_do_update(index_elements=["tx_ac"], set_={"added": func.clock_timestamp()}))
+
+
 def _upsert_exon_set_record(session, tx_ac, alt_ac, strand, method, ess):
 
     """idempotent insert into exon_set and exon tables, archiving prior records if needed;
@@ -936,87 +2244,128 @@ def _upsert_exon_set_record(session, tx_ac, alt_ac, strand, method, ess):
     (None, old) -- prior record and unchanged; nothing was inserted
     (new, old)  -- prior record existed and was changed
 
+    Records are written with _upsert_exon_sets on the session's connection.
+
     """
 
-    key = (tx_ac, alt_ac, method)
+    session.flush()
+    with session.connection().connection.cursor() as cur:
+        cur.execute("set local search_path = " + usam.schema_name)
+        existing = _fetch_exon_sets(cur, {(tx_ac, alt_ac)})
+        [(new_es_id, old_es_id)] = _upsert_exon_sets(
+            cur, existing, [(tx_ac, alt_ac, strand, method, ess)], datetime.datetime.now())
+    # the old record may have been archived under a new alt_aln_method
+    new_es = session.get(usam.ExonSet, new_es_id) if new_es_id is not None else None
+    old_es = session.get(usam.ExonSet, old_es_id, populate_existing=True) if old_es_id is not None else None
+    return new_es, old_es
 
-    existing = session.query(usam.ExonSet).filter(
-        usam.ExonSet.tx_ac == tx_ac,
-        usam.ExonSet.alt_ac == alt_ac,
-        usam.ExonSet.alt_aln_method == method,
-        )
 
-    assert existing.count() <= 1, "Expected max 1 existing exon sets with key ({key})".format(key=key)
+def _upsert_exon_sets(cur, existing, rows, added):
+    """insert exon sets and their exons with cur, archiving prior records
+    if needed; rows are (tx_ac, alt_ac, strand, method, ess) tuples with
+    at most one row per (tx_ac, alt_ac, method), and `existing` is a map
+    from _fetch_exon_sets that is updated with the records written
 
-    if existing.count() == 1:
-        es = existing[0]
-        es_ess = es.exons_as_str(transcript_order=True)
-        esh = hashlib.sha1(es_ess.encode("ascii")).hexdigest()[:8]
-        alt_aln_method_with_hash = method + "/" + esh
+    returns a list of (new_exon_set_id, old_exon_set_id) tuples, one for
+    each row, as follows:
 
-        if es_ess == ess:
-            # same as existing w/alt_aln_method=='transcript'
-            return (None, es)
+    (new, None) -- no prior record; new was inserted
+    (None, old) -- prior record and unchanged, or changed to exons that
+                   were archived before; nothing was inserted
+    (new, old)  -- prior record existed and was changed; old was
+                   archived with alt_aln_method method/<hash of its exons>
 
-        # state: 1 exon set exists, and it differs from incoming
+    """
 
-        # It's possible that we've seen this alternative before, so look again with hash
-        existing = session.query(usam.ExonSet).filter(
-            usam.ExonSet.tx_ac == tx_ac,
-            usam.ExonSet.alt_ac == alt_ac,
-            usam.ExonSet.alt_aln_method == alt_aln_method_with_hash,
-            )
-        if existing.count() == 1:
+    results = []
+    archived = []
+    renamed = []
+    inserts = []
+    for i, (tx_ac, alt_ac, strand, method, ess) in enumerate(rows):
+        key = (tx_ac, alt_ac, method)
+
+        if key in existing:
+            old_es_id, es_ess = existing[key]
+            if es_ess == ess:
+                results.append((None, old_es_id))
+                continue
+
+            # state: 1 exon set exists, and it differs from incoming
+
+            # It's possible that we've seen this alternative before, so look again with hash
+            esh = hashlib.sha1(es_ess.encode("ascii")).hexdigest()[:8]
+            alt_aln_method_with_hash = method + "/" + esh
+            hash_key = (tx_ac, alt_ac, alt_aln_method_with_hash)
+            if hash_key in existing:
+                logger.warning(
+                    "Exon set {tx_ac}/{alt_ac} with method {method} already exists with hash {esh}".format(
+                        tx_ac=tx_ac,
+                        alt_ac=alt_ac,
+                        method=method,
+                        esh=alt_aln_method_with_hash,
+                    )
+                )
+                results.append((None, existing[hash_key][0]))
+                continue
+
+            # update aln_method to add a unique exon set hash based on the *existing* exon set string
             logger.warning(
-                "Exon set {tx_ac}/{alt_ac} with method {method} already exists with hash {esh}".format(
+                "Exon set {tx_ac}/{alt_ac} with method {method} already exists, but with different exons; "
+                "existing exon set: {es_ess}; new exon set: {ess}; updated alt_aln_method of exonset to "
+                "{alt_aln_method_with_hash}".format(
                     tx_ac=tx_ac,
                     alt_ac=alt_ac,
                     method=method,
-                    esh=alt_aln_method_with_hash,
+                    es_ess=es_ess,
+                    ess=ess,
+                    alt_aln_method_with_hash=alt_aln_method_with_hash,
                 )
             )
-            return (None, existing[0])
-
-        # update aln_method to add a unique exon set hash based on the *existing* exon set string
-        logger.warning(
-            "Exon set {tx_ac}/{alt_ac} with method {method} already exists, but with different exons; "
-            "existing exon set: {es_ess}; new exon set: {ess}; updated alt_aln_method of exonset to "
-            "{alt_aln_method_with_hash}".format(
-                tx_ac=tx_ac,
-                alt_ac=alt_ac,
-                method=method,
-                es_ess=es_ess,
-                ess=ess,
-                alt_aln_method_with_hash=alt_aln_method_with_hash,
+            archived.append((old_es_id, alt_aln_method_with_hash))
+            renamed.append((key, hash_key))
+        else:
+            old_es_id = None
+
+        exons = [tuple(map(int, se.split(","))) for se in ess.split(";")]
+        exons.sort(reverse=int(strand) == MINUS_STRAND)
+        inserts.append((i, tx_ac, alt_ac, strand, method, added, [s for s, _ in exons], [e for _, e in exons]))
+        results.append((None, old_es_id))
+
+    if archived:
+        psycopg2.extras.execute_values(cur, """
+            UPDATE exon_set ES SET alt_aln_method = V.alt_aln_method
+            FROM (VALUES %s) V (exon_set_id, alt_aln_method) WHERE ES.exon_set_id = V.exon_set_id
+            """, archived)
+    new_es_ids = {}
+    if inserts:
+        new_es_ids = dict(psycopg2.extras.execute_values(cur, """
+            WITH V (i, tx_ac, alt_ac, alt_strand, alt_aln_method, added, starts_i, ends_i) AS (VALUES %s),
+            new_es AS (
+                INSERT INTO exon_set (tx_ac, alt_ac, alt_strand, alt_aln_method, added)
+                SELECT tx_ac, alt_ac, alt_strand, alt_aln_method, added FROM V ORDER BY i
+                RETURNING exon_set_id, tx_ac, alt_ac, alt_aln_method
+            ), new_exons AS (
+                INSERT INTO exon (exon_set_id, start_i, end_i, ord)
+                SELECT N.exon_set_id, X.start_i, X.end_i, X.ord - 1
+                FROM new_es N
+                JOIN V USING (tx_ac, alt_ac, alt_aln_method),
+                unnest(V.starts_i, V.ends_i) WITH ORDINALITY X (start_i, end_i, ord)
+            ), stale AS (
+                INSERT INTO stale_tx (tx_ac, added) SELECT tx_ac, clock_timestamp() FROM (SELECT DISTINCT tx_ac FROM new_es) N
+                ON CONFLICT (tx_ac) DO UPDATE SET added = clock_timestamp()
             )
-        )
-        es.alt_aln_method = alt_aln_method_with_hash
-        session.flush()
-        old_es = es
-    else:
-        old_es = None
-
-    es = usam.ExonSet(
-        tx_ac=tx_ac,
-        alt_ac=alt_ac,
-        alt_aln_method=method,
-        alt_strand=strand
-        )
-    session.add(es)
-
-    exons = [tuple(map(int, se.split(","))) for se in ess.split(";")]
-    exons.sort(reverse=int(strand) == MINUS_STRAND)
-    for i_ex, ex in enumerate(exons):
-        s, e = ex
-        ex = usam.Exon(
-            exon_set=es,
-            start_i=s,
-            end_i=e,
-            ord=i_ex,
-        )
-        session.add(ex)
-
-    return es, old_es
+            SELECT V.i, N.exon_set_id FROM new_es N JOIN V USING (tx_ac, alt_ac, alt_aln_method)
+            """, inserts, template="(%s, %s, %s, %s::smallint, %s, %s::timestamp, %s::int[], %s::int[])",
+            page_size=len(inserts), fetch=True))
+
+    # keep `existing` in step with the database for later calls
+    for key, hash_key in renamed:
+        existing[hash_key] = existing.pop(key)
+    for i, (tx_ac, alt_ac, strand, method, ess) in enumerate(rows):
+        if i in new_es_ids:
+            existing[(tx_ac, alt_ac, method)] = (new_es_ids[i], ess)
+            results[i] = (new_es_ids[i], results[i][1])
+    return results
 
 
 # <LICENSE>
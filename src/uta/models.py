@@ -94,6 +94,91 @@ class SeqAnno(Base):
     seq = sao.relationship("Seq", backref="aliases")
 
 
+class SeqAnnoMostRecent(Base):
+    """most recent seq_anno row of each accession (by added, then
+    seq_anno_id), maintained by triggers on seq_anno (see
+    seq_anno_most_recent_ddl); the primary key covers seq_id so that
+    fingerprint views read it from the index"""
+    __tablename__ = "seq_anno_most_recent"
+    __table_args__ = (
+        sa.PrimaryKeyConstraint("ac", postgresql_include=["seq_id"]),
+    )
+
+    # columns:
+    ac = sa.Column(sa.Text, nullable=False)
+    seq_anno_id = sa.Column(
+        sa.Integer, sa.ForeignKey("seq_anno.seq_anno_id", onupdate="CASCADE", ondelete="CASCADE"), nullable=False)
+    seq_id = sa.Column(sa.Text)
+    added = sa.Column(sa.DateTime, nullable=False)
+
+
+# Statement-level triggers on seq_anno rewrite seq_anno_most_recent for
+# the accessions that a statement touched, and record the transcripts of
+# exon sets on or of accessions whose most recent sequence changed, or
+# whose annotations were deleted, in stale_tx. A trigger can't have
+# transition tables for more than one event, hence three triggers.
+seq_anno_most_recent_ddl = """
+CREATE OR REPLACE FUNCTION {schema}.seq_anno_most_recent_sync() RETURNS trigger
+LANGUAGE plpgsql SET search_path = {schema} AS $$
+DECLARE
+    acs text[];
+    prev_acs text[];
+    prev_seq_ids text[];
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        SELECT array_agg(DISTINCT N.ac) INTO acs FROM new_rows N;
+    ELSIF TG_OP = 'UPDATE' THEN
+        SELECT array_agg(DISTINCT X.ac) INTO acs FROM (
+            SELECT N.ac, O.ac AS old_ac FROM new_rows N FULL JOIN old_rows O ON O.seq_anno_id = N.seq_anno_id
+            WHERE (N.ac, N.seq_id, N.added) IS DISTINCT FROM (O.ac, O.seq_id, O.added)) U,
+            LATERAL (VALUES (U.ac), (U.old_ac)) X (ac)
+        WHERE X.ac IS NOT NULL;
+    ELSE
+        SELECT array_agg(DISTINCT O.ac) INTO acs FROM old_rows O;
+    END IF;
+    IF acs IS NULL THEN
+        RETURN NULL;
+    END IF;
+
+    SELECT array_agg(M.ac), array_agg(M.seq_id) INTO prev_acs, prev_seq_ids
+    FROM seq_anno_most_recent M WHERE M.ac = ANY(acs);
+    DELETE FROM seq_anno_most_recent M WHERE M.ac = ANY(acs);
+    INSERT INTO seq_anno_most_recent (ac, seq_anno_id, seq_id, added)
+    SELECT DISTINCT ON (A.ac) A.ac, A.seq_anno_id, A.seq_id, A.added
+    FROM seq_anno A WHERE A.ac = ANY(acs)
+    ORDER BY A.ac, A.added DESC, A.seq_anno_id DESC;
+
+    WITH changed AS (
+        SELECT A.ac FROM unnest(acs) A (ac)
+        LEFT JOIN unnest(prev_acs, prev_seq_ids) P (ac, seq_id) ON P.ac = A.ac
+        LEFT JOIN seq_anno_most_recent M ON M.ac = A.ac
+        WHERE TG_OP = 'DELETE' OR M.seq_id IS DISTINCT FROM P.seq_id
+    )
+    INSERT INTO stale_tx (tx_ac, added)
+    SELECT tx_ac, clock_timestamp() FROM (
+        SELECT ES.tx_ac FROM exon_set ES WHERE ES.tx_ac IN (SELECT ac FROM changed)
+        UNION
+        SELECT ES.tx_ac FROM exon_set ES WHERE ES.alt_ac IN (SELECT ac FROM changed)) C
+    ON CONFLICT (tx_ac) DO UPDATE SET added = clock_timestamp();
+    RETURN NULL;
+END
+$$;
+
+CREATE TRIGGER seq_anno_most_recent_ins AFTER INSERT ON {schema}.seq_anno
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION {schema}.seq_anno_most_recent_sync();
+CREATE TRIGGER seq_anno_most_recent_upd AFTER UPDATE ON {schema}.seq_anno
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION {schema}.seq_anno_most_recent_sync();
+CREATE TRIGGER seq_anno_most_recent_del AFTER DELETE ON {schema}.seq_anno
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION {schema}.seq_anno_most_recent_sync();
+""".format(schema=schema_name)
+
+sa.event.listen(SeqAnnoMostRecent.__table__, "after_create",
+                sa.DDL(seq_anno_most_recent_ddl).execute_if(dialect="postgresql"))
+
+
 class Gene(Base):
     __tablename__ = "gene"
 
@@ -251,6 +336,70 @@ class ExonAln(Base):
     # methods:
 
 
+class AlignExonsQueue(Base):
+    """exon pairs pending alignment, snapshotted by align-exons so that
+    interrupted runs can resume without re-evaluating tx_alt_exon_pairs_v"""
+    __tablename__ = "align_exons_queue"
+    __table_args__ = (
+        sa.Index("align_exons_queue_tx_ac_alt_ac", "tx_ac", "alt_ac"),
+    )
+
+    # columns:
+    tx_exon_id = sa.Column(sa.Integer, primary_key=True)
+    alt_exon_id = sa.Column(sa.Integer, primary_key=True)
+    tx_ac = sa.Column(sa.Text, nullable=False)
+    alt_ac = sa.Column(sa.Text, nullable=False)
+    alt_strand = sa.Column(sa.SmallInteger, nullable=False)
+    tx_start_i = sa.Column(sa.Integer, nullable=False)
+    tx_end_i = sa.Column(sa.Integer, nullable=False)
+    alt_start_i = sa.Column(sa.Integer, nullable=False)
+    alt_end_i = sa.Column(sa.Integer, nullable=False)
+
+
+class AlignExonsCheckpoint(Base):
+    """align-exons progress per (tx_ac, alt_ac); status is 'done' or
+    'failed', with the reason for failures"""
+    __tablename__ = "align_exons_checkpoint"
+    __table_args__ = (
+        sa.CheckConstraint("status in ('done', 'failed')", "align_exons_checkpoint_status"),
+    )
+
+    # columns:
+    tx_ac = sa.Column(sa.Text, primary_key=True)
+    alt_ac = sa.Column(sa.Text, primary_key=True)
+    status = sa.Column(sa.Text, nullable=False)
+    reason = sa.Column(sa.Text, nullable=True)
+    n_pairs = sa.Column(sa.Integer, nullable=False)
+    updated = sa.Column(
+        sa.DateTime, default=datetime.datetime.now(), nullable=False)
+
+
+class AlignExonsRun(Base):
+    """status of align-exons runs by shard; unsharded runs are shard 1 of 1"""
+    __tablename__ = "align_exons_run"
+    __table_args__ = (
+        sa.CheckConstraint("status in ('running', 'done')", "align_exons_run_status"),
+    )
+
+    # columns:
+    n_shards = sa.Column(sa.Integer, primary_key=True)
+    shard = sa.Column(sa.Integer, primary_key=True)
+    status = sa.Column(sa.Text, nullable=False)
+    started = sa.Column(sa.DateTime, nullable=False)
+    finished = sa.Column(sa.DateTime, nullable=True)
+
+
+class StaleTx(Base):
+    """transcripts whose rows in the exon set summary tables are out of
+    date; recorded by loaders and consumed by refresh-matviews"""
+    __tablename__ = "stale_tx"
+
+    # columns:
+    tx_ac = sa.Column(sa.Text, primary_key=True)
+    added = sa.Column(
+        sa.DateTime, server_default=sqlalchemy.sql.functions.now(), nullable=False)
+
+
 class AssociatedAccessions(Base):
     __tablename__ = "associated_accessions"
     __table_args__ = (
@@ -0,0 +1,55 @@
+import hashlib
+import logging
+import sqlite3
+
+logger = logging.getLogger(__name__)
+
+
+class CigarMemo:
+    """
+    Persistent map of exon pair digests to CIGAR strings, stored in a
+    SQLite file so that alignments can be reused across loads.
+
+    `params` describes how the CIGARs were computed (aligner and
+    scoring). A writable memo whose stored params differ from `params`
+    is emptied when opened. Read-only memos may be opened concurrently
+    with one writer, e.g., one per worker process.
+    """
+
+    def __init__(self, path, params, readonly=False):
+        self.path = path
+        if readonly:
+            self._con = sqlite3.connect("file:{}?mode=ro".format(path), uri=True)
+            return
+        self._con = sqlite3.connect(path)
+        self._con.execute("pragma journal_mode=wal")
+        self._con.execute("create table if not exists meta (key text primary key, value text)")
+        self._con.execute("create table if not exists cigar (digest text primary key, cigar text not null)")
+        row = self._con.execute("select value from meta where key='params'").fetchone()
+        if row is not None and row[0] != params:
+            logger.warning("{path}: alignment params changed from {old} to {new}; clearing memo".format(
+                path=path, old=row[0], new=params))
+            self._con.execute("delete from cigar")
+        self._con.execute("insert or replace into meta (key, value) values ('params', ?)", (params,))
+        self._con.commit()
+
+    @staticmethod
+    def digest(tx_seq, alt_seq, strand):
+        """return key for aligning tx_seq to alt_seq, where alt_seq is
+        on the reference plus strand and aligned on `strand`"""
+        return hashlib.sha1("{};{};{}".format(tx_seq, alt_seq, strand).encode("ascii")).hexdigest()
+
+    def get(self, digest):
+        row = self._con.execute("select cigar from cigar where digest=?", (digest,)).fetchone()
+        return None if row is None else row[0]
+
+    def update(self, items):
+        """store (digest, cigar) pairs"""
+        self._con.executemany("insert or ignore into cigar (digest, cigar) values (?, ?)", items)
+        self._con.commit()
+
+    def __len__(self):
+        return self._con.execute("select count(*) from cigar").fetchone()[0]
+
+    def close(self):
+        self._con.close()
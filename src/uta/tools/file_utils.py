@@ -1,4 +1,6 @@
 import gzip
+import io
+import os
 from contextlib import contextmanager
 
 
@@ -10,3 +12,50 @@ def open_file(filename):
     else:
         with open(filename) as f:
             yield f
+
+
+class InputFile:
+    """
+    Text lines from a plain, gzip, or bgzip file, read in one streaming
+    pass. Compression is detected from the file contents, not its name.
+
+    `progress()` is the fraction of the file (as stored, i.e.,
+    compressed bytes for compressed files) consumed so far, so loaders
+    can report progress without counting rows first.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._raw = open(path, "rb")
+        self.size = os.fstat(self._raw.fileno()).st_size
+        header = self._raw.peek(14)[:14]
+        if header[:2] == b"\x1f\x8b":
+            # bgzip files are gzip files with a BGZF ("BC") extra subfield in each member
+            self.compression = "bgzip" if len(header) == 14 and header[3] & 4 and header[12:14] == b"BC" else "gzip"
+            stream = gzip.GzipFile(fileobj=self._raw)
+        else:
+            self.compression = None
+            stream = self._raw
+        self._text = io.TextIOWrapper(stream, encoding="utf-8")
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self._text)
+
+    def readline(self):
+        return self._text.readline()
+
+    def progress(self):
+        return self._raw.tell() / self.size if self.size else 1.0
+
+    def close(self):
+        self._text.close()
+        self._raw.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,96 @@
+import bisect
+import collections
+
+
+class SeqWindowCache:
+    """
+    LRU cache of sequence windows, keyed by accession, in front of a
+    sequence fetcher (e.g., SeqRepo).
+
+    Windows are loaded with `prefetch()` (or on a miss in `fetch()`)
+    and subsequences are sliced from any cached window that contains
+    them. Least recently used windows are evicted when the total
+    cached length exceeds `max_bytes`.
+
+    Counts of hits and misses (of `prefetch()` and `fetch()` alike),
+    windows loaded, bases loaded, and evictions are accumulated in
+    `stats`, a collections.Counter; `reset_stats()` returns them and
+    starts a new count.
+    """
+
+    def __init__(self, sf, max_bytes):
+        self.sf = sf
+        self.max_bytes = max_bytes
+        self.stats = collections.Counter()
+        self._windows = collections.OrderedDict()    # (ac, start, end) -> seq; end=None means to end of sequence
+        self._ac_windows = {}                       # ac -> ([start], [key]), sorted by start
+        self._n_bytes = 0
+
+    def reset_stats(self):
+        """return the stats accumulated so far, and start counting anew"""
+        stats, self.stats = self.stats, collections.Counter()
+        return stats
+
+    def prefetch(self, ac, start=None, end=None):
+        """ensure that a window covering ac[start:end] is cached; the whole
+        sequence is loaded if start and end are None"""
+        start = start or 0
+        if self._find(ac, start, end) is None:
+            self.stats["misses"] += 1
+            self._load(ac, start, end)
+        else:
+            self.stats["hits"] += 1
+
+    def fetch(self, ac, start=None, end=None):
+        """return ac[start:end], from a cached window if possible"""
+        start = start or 0
+        key = self._find(ac, start, end)
+        if key is None:
+            self.stats["misses"] += 1
+            return self._load(ac, start, end)
+        self.stats["hits"] += 1
+        w_start = key[1]
+        return self._windows[key][start - w_start:None if end is None else end - w_start]
+
+    def _find(self, ac, start, end):
+        """return the key of a cached window covering ac[start:end], or None;
+        windows starting at or before start are tried nearest first"""
+        starts, keys = self._ac_windows.get(ac, ((), ()))
+        for i in range(bisect.bisect_right(starts, start) - 1, -1, -1):
+            w_end = keys[i][2]
+            if w_end is None or (end is not None and end <= w_end):
+                self._windows.move_to_end(keys[i])
+                return keys[i]
+        return None
+
+    def _load(self, ac, start, end):
+        """fetch ac[start:end] and cache it unless it alone exceeds max_bytes"""
+        seq = self.sf.fetch(ac, start, end)
+        self.stats["windows"] += 1
+        self.stats["bytes"] += len(seq)
+        if len(seq) > self.max_bytes:
+            return seq
+        key = (ac, start, end)
+        self._windows[key] = seq
+        starts, keys = self._ac_windows.setdefault(ac, ([], []))
+        i = bisect.bisect_right(starts, start)
+        starts.insert(i, start)
+        keys.insert(i, key)
+        self._n_bytes += len(seq)
+        while self._n_bytes > self.max_bytes:
+            old_key, old_seq = self._windows.popitem(last=False)
+            self._forget(old_key)
+            self._n_bytes -= len(old_seq)
+            self.stats["evictions"] += 1
+        return seq
+
+    def _forget(self, key):
+        """remove key from the windows of its accession"""
+        ac, start, _ = key
+        starts, keys = self._ac_windows[ac]
+        i = bisect.bisect_left(starts, start)
+        while keys[i] != key:
+            i += 1
+        del starts[i], keys[i]
+        if not starts:
+            del self._ac_windows[ac]
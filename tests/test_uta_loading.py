@@ -1,16 +1,78 @@
 import configparser
+import datetime
+import gzip
+import hashlib
+import os
+import random
+import re
 import signal
+import tempfile
 import unittest
 from unittest.mock import Mock, patch
 
 import sqlalchemy as sa
 import testing.postgresql
+from bioutils.sequences import reverse_complement
+from uta_align.align.algorithms import needleman_wunsch_gotoh_align
 
 import uta
+import uta.exceptions
+import uta.formats.geneinfo as ufgi
+import uta.formats.txinfo as ufti
 import uta.loading as ul
 import uta.models as usam
 
 
+# tx_alt_exon_pairs_v as defined by alembic revision f885cb84efce
+TX_ALT_EXON_PAIRS_V_SQL = """
+CREATE VIEW uta.tx_alt_exon_pairs_v AS
+    SELECT g.symbol, g.symbol as hgnc, g.gene_id,TES.exon_SET_id AS tes_exon_SET_id,
+       AES.exon_SET_id AS aes_exon_SET_id, TES.tx_ac AS tx_ac,AES.alt_ac AS alt_ac,
+       AES.alt_strand,AES.alt_aln_method, TEX.ORD AS ORD,TEX.exon_id AS tx_exon_id,
+       AEX.exon_id AS alt_exon_id, TEX.start_i AS tx_start_i,TEX.END_i AS tx_END_i,
+       AEX.start_i AS alt_start_i, AEX.END_i AS alt_END_i, EA.exon_aln_id,EA.cigar
+    FROM uta.exon_SET tes
+    JOIN uta.transcript t ON tes.tx_ac=t.ac
+    JOIN uta.gene g ON t.gene_id=g.gene_id
+    JOIN uta.exon_set aes ON tes.tx_ac=aes.tx_ac AND tes.alt_aln_method='transcript' AND aes.alt_aln_method !~ 'transcript'
+    JOIN uta.exon tex ON tes.exon_SET_id=tex.exon_SET_id
+    JOIN uta.exon aex ON aes.exon_SET_id=aex.exon_SET_id AND tex.ORD=aex.ORD
+    LEFT JOIN uta.exon_aln ea ON ea.tx_exon_id=tex.exon_id AND ea.alt_exon_id=AEX.exon_id;
+"""
+
+_rng = random.Random(0)
+GENOME_SEQ = "".join(_rng.choice("ACGT") for _ in range(400))
+
+# NM_PLUS.1 has a SNV in exon 2 and lacks one base of exon 3;
+# NM_MINUS.1 aligns to the minus strand; NM_MISSING.1 has no sequence
+_exon2 = GENOME_SEQ[120:140]
+_exon2 = _exon2[:5] + ("A" if _exon2[5] != "A" else "C") + _exon2[6:]
+ALIGN_EXONS_SEQS = {
+    "NC_TEST.1": GENOME_SEQ,
+    "NM_PLUS.1": GENOME_SEQ[50:70] + _exon2 + GENOME_SEQ[200:215] + GENOME_SEQ[216:230],
+    "NM_MINUS.1": reverse_complement(GENOME_SEQ[300:320]) + reverse_complement(GENOME_SEQ[250:270]),
+}
+ALIGN_EXONS_EXON_SETS = [
+    # tx_ac, alt_ac, strand, method, exons_se_i
+    ("NM_PLUS.1", "NM_PLUS.1", 1, "transcript", "0,20;20,40;40,69"),
+    ("NM_PLUS.1", "NC_TEST.1", 1, "splign", "50,70;120,140;200,230"),
+    ("NM_MINUS.1", "NM_MINUS.1", 1, "transcript", "0,20;20,40"),
+    ("NM_MINUS.1", "NC_TEST.1", -1, "splign", "300,320;250,270"),
+    ("NM_MISSING.1", "NM_MISSING.1", 1, "transcript", "0,10"),
+    ("NM_MISSING.1", "NC_TEST.1", 1, "splign", "10,20"),
+]
+
+
+class FakeSeqFetcher:
+    """stands in for SeqRepo in align-exons tests"""
+
+    def __init__(self, seqs):
+        self.seqs = seqs
+
+    def fetch(self, ac, start=None, end=None):
+        return self.seqs[ac][start:end]
+
+
 class TestUtaLoading(unittest.TestCase):
 
     def setUp(self):
@@ -129,7 +191,9 @@ class TestUtaLoading(unittest.TestCase):
         cf.add_section('uta')
         cf.set('uta', 'admin_role', 'uta_admin')
 
-        ul.load_assoc_ac(self.session, {'FILE': 'tests/data/assocacs.gz'}, cf)
+        with self.assertLogs("uta.loading", level="INFO") as cm:
+            ul.load_assoc_ac(self.session, {'FILE': 'tests/data/assocacs.gz'}, cf)
+        self.assertIn("3 rows; 2 added, 1 already exist, 0 duplicates in file", cm.output[-1])
 
         # associated_accessions table should contain one record per line in file
         aa = self.session.query(usam.AssociatedAccessions).order_by(usam.AssociatedAccessions.tx_ac).all()
@@ -153,6 +217,26 @@ class TestUtaLoading(unittest.TestCase):
         ]
         self.assertEqual(aa_list, expected_aa_list)
 
+    def test__get_or_insert_many(self):
+        """
+        _get_or_insert_many should match existing rows and earlier duplicates, and insert the rest.
+        """
+        self.session.add(usam.AssociatedAccessions(origin="NCBI", tx_ac="NM_1.1", pro_ac="NP_1.1"))
+        self.session.commit()
+        rows = [{"origin": "NCBI", "tx_ac": tx_ac, "pro_ac": pro_ac}
+                for tx_ac, pro_ac in [("NM_2.1", "NP_2.1"), ("NM_1.1", "NP_1.1"), ("NM_3.1", "NP_3.1"),
+                                      ("NM_2.1", "NP_2.1"), ("NM_1.1", "NP_9.1")]]
+        with patch.object(self.session, "query", wraps=self.session.query) as query:
+            results = ul._get_or_insert_many(self.session, usam.AssociatedAccessions, iter(rows),
+                                             ("origin", "tx_ac", "pro_ac"), batch_size=2)
+        self.assertEqual(query.call_count, 3)
+        self.assertEqual([created for _, created in results], [True, False, True, False, True])
+        self.assertIs(results[0][0], results[3][0])
+        self.assertEqual([(aa.tx_ac, aa.pro_ac) for aa, _ in results],
+                         [(r["tx_ac"], r["pro_ac"]) for r in rows])
+        self.session.commit()
+        self.assertEqual(self.session.query(usam.AssociatedAccessions).count(), 4)
+
     def test_load_txinfo(self):
         """
         Loading file tests/data/txinfo.gz should create transcript, exon_set, exon, and translation_exception records in the database.
@@ -256,6 +340,137 @@ class TestUtaLoading(unittest.TestCase):
             },
         )
 
+    def _load_txinfo_rows(self, rows, opts):
+        """write txinfo rows to a file, load it, and return the (new, unchanged, cds changed, exons changed)
+        counts that were logged, or the log itself if there are none"""
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        fn = os.path.join(tmpdir.name, "txinfo.gz")
+        with gzip.open(fn, "wt") as fh:
+            tiw = ufti.TxInfoWriter(fh)
+            for row in rows:
+                tiw.write(ufti.TxInfo(*row))
+        with patch("uta.loading._get_seqfetcher", return_value=Mock(fetch=Mock(return_value="FAKESEQUENCE"))):
+            with self.assertLogs("uta.loading", level="INFO") as logs:
+                ul.load_txinfo(self.session, dict(opts, FILE=fn), self.cf)
+        self.session.commit()
+        log = "\n".join(logs.output)
+        counts = re.findall(r"(\d+) new, (\d+) unchanged, (\d+) cds changed, (\d+) exons changed", log)
+        return tuple(map(int, counts[-1])) if counts else log
+
+    def _txinfo_tables(self):
+        queries = [
+            "select ac, origin_id, gene_id, cds_start_i, cds_end_i, cds_md5, codon_table from uta.transcript",
+            """select ES.tx_ac, ES.alt_ac, ES.alt_strand, ES.alt_aln_method,
+                      string_agg(E.start_i || ',' || E.end_i || ',' || E.ord, ';' order by E.ord)
+               from uta.exon_set ES join uta.exon E on ES.exon_set_id = E.exon_set_id
+               group by ES.exon_set_id""",
+            "select tx_ac, start_position, end_position, amino_acid from uta.translation_exception",
+        ]
+        return [sorted(tuple(r) for r in self.session.execute(sa.text(q))) for q in queries]
+
+    def test_load_txinfo_cds_changed_with_transl_except(self):
+        """
+        A transcript whose CDS changed should be archived and reloaded with its translation exceptions.
+        """
+        self.session.add(usam.Origin(name="NCBI"))
+        self.session.add(usam.Gene(gene_id="140606", hgnc="SELENOM", symbol="SELENOM"))
+        self.session.commit()
+
+        a1 = ("NCBI", "NM_080430.4", "140606", "SELENOM", "63,501", "0,192;192,228;228,263;263,342;342,694", "1",
+              "(pos:205..207,aa:Sec)")
+        a2 = a1[:4] + ("66,504",) + a1[5:7] + ("(pos:208..210,aa:Sec);(pos:300,aa:TERM)",)
+        self.assertEqual(self._load_txinfo_rows([a1], {}), (1, 0, 0, 0))
+        self.assertEqual(self._load_txinfo_rows([a2], {}), (1, 0, 1, 0))
+
+        transcripts, _, tes = self._txinfo_tables()
+        self.assertEqual([(r[0], r[3], r[4]) for r in transcripts],
+                         [("NM_080430.4", 66, 504), ("NM_080430.4/63..501", 63, 501)])
+        self.assertEqual(tes, [("NM_080430.4", 207, 210, "Sec"), ("NM_080430.4", 299, 300, "TERM"),
+                               ("NM_080430.4/63..501", 204, 207, "Sec")])
+
+    def test_load_txinfo_bulk(self):
+        """
+        Bulk txinfo loads should count and write the same records as row-by-row loads.
+        """
+        self.session.add(usam.Origin(name="NCBI"))
+        self.session.add_all([usam.Gene(gene_id="140606", hgnc="SELENOM", symbol="SELENOM"),
+                              usam.Gene(gene_id="4514", hgnc="MT-CO3", symbol="MT-CO3")])
+        self.session.commit()
+
+        # origin, ac, gene_id, gene_symbol, cds_se_i, exons_se_i, codon_table, transl_except
+        a = ("NCBI", "NM_080430.4", "140606", "SELENOM", "63,501", "0,192;192,228;228,263;263,342;342,694", "1",
+             "(pos:205..207,aa:Sec)")
+        b1 = ("NCBI", "NC_012920.1_09206_09990", "4514", "MT-CO3", "0,784", "0,784", "2", "(pos:9990,aa:TERM)")
+        b2 = b1[:5] + ("0,300;300,784",) + b1[6:]
+        c1 = ("NCBI", "NM_C.1", "140606", "SELENOM", "10,100", "0,50;50,200", "1", "")
+        c2 = c1[:4] + ("13,103",) + c1[5:]
+        d = ("NCBI", "NM_D.1", "140606", "SELENOM", "", "0,90", "", "")
+        e = ("NCBI", "NM_E.1", "140606", "SELENOM", "", "", "", "")
+        a2 = a[:7] + ("(pos:205..207,aa:Sec);(pos:300,aa:TERM)",)
+        loads = [
+            [a, b1, c1],
+            [a, e, b2, c2, d],
+            [a, b1, c2, d],
+            [a2, b2, c2, d],
+        ]
+        expected_counts = [(3, 0, 0, 0), (2, 1, 1, 1), (0, 3, 0, 1), (0, 4, 0, 0)]
+
+        self.assertIn("dry run: 3 CDS digests computed", self._load_txinfo_rows(loads[0], {"--dry-run": True}))
+        self.assertEqual(self._txinfo_tables(), [[], [], []])
+
+        for opts in [{}, {"--bulk": True}, {"--workers": "2"}, {"--bulk": True, "--workers": "2"}]:
+            self.session.execute(sa.text("truncate uta.transcript cascade"))
+            self.session.commit()
+            counts = [self._load_txinfo_rows(rows, opts) for rows in loads]
+            self.assertEqual(counts, expected_counts)
+            if not opts:
+                row_tables = self._txinfo_tables()
+            self.assertEqual(self._txinfo_tables(), row_tables)
+        self.assertEqual(len(row_tables[1]), 7)
+
+        # unchanged transcripts are recognized from the preloaded index, without ORM queries
+        with patch.object(self.session, "query", side_effect=AssertionError("unexpected query")):
+            self.assertEqual(self._load_txinfo_rows(loads[2], {}), (0, 4, 0, 0))
+
+    def _load_geneinfo_rows(self, rows, opts):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            fn = os.path.join(tmpdir, "geneinfo.gz")
+            with gzip.open(fn, "wt") as fh:
+                giw = ufgi.GeneInfoWriter(fh)
+                for gi in rows:
+                    giw.write(gi)
+            with self.assertLogs("uta.loading", level="INFO") as cm:
+                ul.load_geneinfo(self.session, dict(opts, FILE=fn), self.cf)
+        return cm.output[-1]
+
+    def test_load_geneinfo(self):
+        """
+        load-geneinfo should insert new genes, update changed ones, and leave unchanged ones alone.
+        """
+        def _gi(gene_id, symbol, aliases):
+            return ufgi.GeneInfo(gene_id=gene_id, gene_symbol=symbol, tax_id="9606", hgnc=symbol, maploc="1p1",
+                                 aliases=aliases, type="protein-coding", summary="", descr=symbol + " gene",
+                                 xrefs=["HGNC:" + gene_id])
+
+        rows = [_gi("1", "A1BG", ["A1B", "ABG"]), _gi("2", "A2M", []), _gi("3", "NAT1", ["AAC1"])]
+        self.assertIn("3 rows 100.0%; 3 inserted, 0 updated, 0 unchanged",
+                      self._load_geneinfo_rows(rows, {"--batch-size": "2"}))
+
+        # gene 2 appears twice, and the last row wins
+        rows = [_gi("2", "A2M", ["X"]), _gi("1", "A1BG", ["A1B", "ABG"]), _gi("2", "A2M", ["CPAMD5"]),
+                _gi("4", "NAT2", [])]
+        self.assertIn("4 rows 100.0%; 1 inserted, 1 updated, 1 unchanged",
+                      self._load_geneinfo_rows(rows, {}))
+
+        genes = self.session.execute(sa.text("select gene_id, symbol, aliases, xrefs from uta.gene order by gene_id"))
+        self.assertEqual([tuple(r) for r in genes], [
+            ("1", "A1BG", "{A1B,ABG}", "{HGNC:1}"),
+            ("2", "A2M", "{CPAMD5}", "{HGNC:2}"),
+            ("3", "NAT1", "{AAC1}", "{HGNC:3}"),
+            ("4", "NAT2", '{""}', "{HGNC:4}"),
+        ])
+
     def test_load_exonset_with_exon_structure_mismatch(self):
         """
         Loading the test file tests/data/exonsets-mm-exons.gz should not raise an exception, exon alignments without
@@ -425,6 +640,517 @@ class TestUtaLoading(unittest.TestCase):
                 ).one()
 
 
+    def test_load_exonset_batched(self):
+        """
+        load-exonset should count new, unchanged, deprecated, skipped, and failed exon sets across
+        batches, and roll back only the failing row of a batch.
+        """
+        o1 = usam.Origin(name="NCBI")
+        g1 = usam.Gene(gene_id="1", hgnc="TEST", symbol="TEST")
+        self.session.add_all([o1, g1])
+        self.session.flush()
+        for tx_ac in ["NM_PLUS.1", "NM_MINUS.1"]:
+            self.session.add(usam.Transcript(ac=tx_ac, origin_id=o1.origin_id, gene_id="1"))
+        self.session.flush()
+        for tx_ac, alt_ac, strand, method, ess in ALIGN_EXONS_EXON_SETS[:4]:
+            if method == "transcript":
+                ul._upsert_exon_set_record(self.session, tx_ac, alt_ac, strand, method, ess)
+        self.session.commit()
+
+        rows = [
+            ("NM_PLUS.1", "NC_TEST.1", "splign", "1", "50,70;120,140;200,230"),         # new
+            ("NM_MINUS.1", "NC_TEST.1", "splign", "-1", "300,320;250,270"),             # new
+            ("NM_PLUS.1", "NC_TEST.1", "splign", "1", "50,70;120,140;200,230"),         # unchanged
+            ("NM_PLUS.1", "NC_TEST.1", "splign", "1", "50,70;120,140;200,231"),         # deprecated
+            ("NM_UNKNOWN.1", "NC_TEST.1", "splign", "1", "10,20"),                      # skipped: no transcript
+            ("NM_MINUS.1", "NC_OTHER.1", "splign", "-1", "10,20"),                      # skipped: mismatch
+            ("NM_MINUS.1", "NC_OTHER.1", "splign", "-1", "30,20;10,5"),                 # error: start_i >= end_i
+            ("NM_MINUS.1", "NC_OTHER.1", "splign", "-1", "30,40;10,20"),                # new
+        ]
+        with tempfile.TemporaryDirectory() as tmpdir:
+            fn = os.path.join(tmpdir, "exonsets.gz")
+            with gzip.open(fn, "wt") as fh:
+                fh.write("tx_ac\talt_ac\tmethod\tstrand\texons_se_i\n")
+                fh.writelines("\t".join(r) + "\n" for r in rows)
+            with patch("uta.loading._exonset_batch_size", 3), \
+                    self.assertLogs("uta.loading", level="INFO") as cm:
+                ul.load_exonset(self.session, {"FILE": fn}, self.cf)
+        self.assertIn("3 new, 1 unchanged, 1 deprecated, 2 skipped, 1 n_errors", cm.output[-1])
+
+        exon_sets = self.session.execute(sa.text("""
+            select ES.tx_ac, ES.alt_ac, ES.alt_aln_method, string_agg(E.start_i || ',' || E.end_i, ';' order by E.ord)
+            from uta.exon_set ES join uta.exon E on E.exon_set_id = ES.exon_set_id
+            where ES.alt_aln_method ~ '^splign'
+            group by ES.exon_set_id order by ES.tx_ac, ES.alt_ac, ES.alt_aln_method""")).fetchall()
+        self.assertEqual([tuple(r) for r in exon_sets], [
+            ("NM_MINUS.1", "NC_OTHER.1", "splign", "30,40;10,20"),
+            ("NM_MINUS.1", "NC_TEST.1", "splign", "300,320;250,270"),
+            ("NM_PLUS.1", "NC_TEST.1", "splign", "50,70;120,140;200,231"),
+            ("NM_PLUS.1", "NC_TEST.1", "splign/" + hashlib.sha1(b"50,70;120,140;200,230").hexdigest()[:8],
+             "50,70;120,140;200,230"),
+        ])
+
+    def test_load_exonset_new_transcript_exon_set(self):
+        """
+        load-exonset should find a transcript exon set written after the transcript exon counts were read.
+        """
+        o1 = usam.Origin(name="NCBI")
+        self.session.add_all([o1, usam.Gene(gene_id="1", hgnc="TEST", symbol="TEST")])
+        self.session.flush()
+        self.session.add(usam.Transcript(ac="NM_PLUS.1", origin_id=o1.origin_id, gene_id="1"))
+        self.session.commit()
+
+        fetch_exon_sets = ul._fetch_exon_sets
+
+        def _fetch_exon_sets(cur, keys):
+            # stands in for another loader adding the transcript exon set mid-run
+            ul._upsert_exon_sets(cur, {}, [("NM_PLUS.1", "NM_PLUS.1", 1, "transcript", "0,20;20,40;40,69")],
+                                 datetime.datetime.now())
+            return fetch_exon_sets(cur, keys)
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            fn = os.path.join(tmpdir, "exonsets.gz")
+            with gzip.open(fn, "wt") as fh:
+                fh.write("tx_ac\talt_ac\tmethod\tstrand\texons_se_i\n")
+                fh.write("NM_PLUS.1\tNC_TEST.1\tsplign\t1\t50,70;120,140;200,230\n")
+            with patch("uta.loading._fetch_exon_sets", side_effect=_fetch_exon_sets), \
+                    self.assertLogs("uta.loading", level="INFO") as cm:
+                ul.load_exonset(self.session, {"FILE": fn}, self.cf)
+        self.assertIn("1 new, 0 unchanged, 0 deprecated, 0 skipped, 0 n_errors", cm.output[-1])
+
+    def _load_seqinfo_rows(self, rows, seqs):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            fn = os.path.join(tmpdir, "seqinfo.gz")
+            with gzip.open(fn, "wt") as fh:
+                fh.write("md5\torigin\tac\tdescr\tlen\tseq\n")
+                fh.writelines("\t".join(r) + "\t\n" for r in rows)
+            with patch("uta.loading._get_seqfetcher", return_value=FakeSeqFetcher(seqs)), \
+                    self.assertLogs("uta.loading", level="INFO") as cm:
+                ul.load_seqinfo(self.session, {"FILE": fn}, self.cf)
+        return cm.output[-1]
+
+    def test_load_seqinfo(self):
+        """
+        load-seqinfo should create missing sequences and annotations, update descriptions, skip
+        sequences of unexpected length, and refuse accessions that map to another sequence.
+        """
+        for name in ["NCBI", "Ensembl"]:
+            self.session.add(usam.Origin(name=name))
+        self.session.flush()
+        self.session.add(usam.Seq(seq_id="md5a", len=4, seq="ACGT"))
+        self.session.flush()
+        self.session.add(usam.SeqAnno(origin_id=1, seq_id="md5a", ac="NM_A.1", descr="old"))
+        self.session.commit()
+
+        seqs = {"NM_A.1": "ACGT", "NM_B.1": "ggcc", "ENST_B.1": "ggcc", "NM_C.1": "AC"}
+        rows = [
+            ("md5a", "NCBI", "NM_A.1", "new", "4"),
+            ("md5b", "NCBI", "NM_B.1", "", "4"),
+            ("md5b", "Ensembl", "ENST_B.1", "B", "4"),
+            ("md5c", "NCBI", "NM_C.1", "", "3"),
+        ]
+        self.assertIn("2 annotations created, 1 descriptions updated, 1 sequences created/3 sequences seen (1 skipped)",
+                      self._load_seqinfo_rows(rows, seqs))
+        self.assertIn("0 annotations created, 0 descriptions updated, 0 sequences created/3 sequences seen (1 skipped)",
+                      self._load_seqinfo_rows(rows, seqs))
+
+        annos = self.session.execute(sa.text("""
+            select O.name, A.ac, A.seq_id, A.descr, Q.seq from uta.seq_anno A
+            join uta.origin O on O.origin_id = A.origin_id join uta.seq Q on Q.seq_id = A.seq_id
+            order by A.ac""")).fetchall()
+        self.assertEqual([tuple(r) for r in annos], [
+            ("Ensembl", "ENST_B.1", "md5b", "B", "GGCC"),
+            ("NCBI", "NM_A.1", "md5a", "new", "ACGT"),
+            ("NCBI", "NM_B.1", "md5b", "", "GGCC"),
+        ])
+        recent = self.session.execute(sa.text("select ac, seq_id from uta.seq_anno_most_recent order by ac")).fetchall()
+        self.assertEqual([tuple(r) for r in recent], [("ENST_B.1", "md5b"), ("NM_A.1", "md5a"), ("NM_B.1", "md5b")])
+
+        with self.assertRaises(uta.exceptions.UTAError):
+            self._load_seqinfo_rows([("md5b", "NCBI", "NM_A.1", "", "4"),
+                                     ("md5d", "NCBI", "NM_D.1", "", "4")], seqs)
+        self.session.rollback()
+        self.assertEqual(self.session.query(usam.SeqAnno).filter(usam.SeqAnno.ac == "NM_D.1").count(), 0)
+
+    def test_seq_anno_most_recent_triggers(self):
+        """
+        seq_anno_most_recent should follow inserts, updates, and deletes of seq_anno made by any means, and
+        transcripts with exon sets on accessions whose most recent sequence changed should be marked stale.
+        """
+        o1, o2 = usam.Origin(name="NCBI"), usam.Origin(name="Ensembl")
+        self.session.add_all([o1, o2, usam.Gene(gene_id="1", hgnc="TEST", symbol="TEST")])
+        self.session.add_all([usam.Seq(seq_id=md5, len=4) for md5 in ["md5a", "md5b"]])
+        self.session.flush()
+        self.session.add(usam.Transcript(ac="NM_1.1", origin_id=o1.origin_id, gene_id="1"))
+        self.session.flush()
+        ul._upsert_exon_set_record(self.session, "NM_1.1", "NC_1.1", 1, "splign", "100,105")
+        t0 = datetime.datetime(2020, 1, 1)
+        sa1 = usam.SeqAnno(origin_id=o1.origin_id, seq_id="md5a", ac="NC_1.1", added=t0)
+        self.session.add(sa1)
+        self.session.commit()
+        self.session.execute(sa.text("delete from uta.stale_tx"))
+        self.session.commit()
+
+        def _recent():
+            return [tuple(r) for r in self.session.execute(sa.text(
+                "select ac, seq_id from uta.seq_anno_most_recent order by ac"))]
+
+        def _stale_tx():
+            stale = {ac for (ac,) in self.session.execute(sa.text("select tx_ac from uta.stale_tx"))}
+            self.session.execute(sa.text("delete from uta.stale_tx"))
+            self.session.commit()
+            return stale
+
+        self.assertEqual(_recent(), [("NC_1.1", "md5a")])
+
+        sa2 = usam.SeqAnno(origin_id=o2.origin_id, seq_id="md5b", ac="NC_1.1", added=t0 + datetime.timedelta(1))
+        self.session.add(sa2)
+        self.session.commit()
+        self.assertEqual(_recent(), [("NC_1.1", "md5b")])
+        self.assertEqual(_stale_tx(), {"NM_1.1"})
+
+        sa1.descr = "no effect"
+        self.session.commit()
+        self.assertEqual(_recent(), [("NC_1.1", "md5b")])
+        self.assertEqual(_stale_tx(), set())
+
+        sa1.added = t0 + datetime.timedelta(2)
+        self.session.commit()
+        self.assertEqual(_recent(), [("NC_1.1", "md5a")])
+        self.assertEqual(_stale_tx(), {"NM_1.1"})
+
+        self.session.delete(sa1)
+        self.session.commit()
+        self.assertEqual(_recent(), [("NC_1.1", "md5b")])
+        self.assertEqual(_stale_tx(), {"NM_1.1"})
+
+        self.session.delete(sa2)
+        self.session.commit()
+        self.assertEqual(_recent(), [])
+        self.assertEqual(_stale_tx(), {"NM_1.1"})
+
+    def test_load_sequences(self):
+        """
+        load-sequences should store missing sequences from the first accession that has one, in
+        batches and with any number of fetch threads.
+        """
+        self.session.add(usam.Origin(name="NCBI"))
+        self.session.flush()
+        seqs = {"NM_A.1": "acgt", "ENST_B.1": "GGCC", "NM_C.1": "AC"}
+        for opts in [{"--batch-size": "2"}, {"--batch-size": "2", "--workers": "3"}]:
+            self.session.execute(sa.text("delete from uta.seq_anno; delete from uta.seq"))
+            for seq_id, seq_len, acs in [("md5a", 4, ["NM_A.1"]), ("md5b", 4, ["NM_B.1", "ENST_B.1"]),
+                                         ("md5c", 3, ["NM_C.1"]), ("md5d", 4, ["NM_D.1"])]:
+                self.session.add(usam.Seq(seq_id=seq_id, len=seq_len))
+                self.session.flush()
+                for ac in acs:
+                    self.session.add(usam.SeqAnno(origin_id=1, seq_id=seq_id, ac=ac))
+            self.session.commit()
+            with patch("uta.loading._get_seqfetcher", return_value=FakeSeqFetcher(seqs)), \
+                    self.assertLogs("uta.loading", level="INFO") as cm:
+                ul.load_sequences(self.session, opts, self.cf)
+            self.assertIn("4/4 100.0%; 2 sequences loaded", cm.output[-1])
+            self.assertTrue(any("No sequence found for ['NM_D.1']" in line for line in cm.output))
+            loaded = self.session.execute(sa.text("select seq_id, seq from uta.seq order by seq_id")).fetchall()
+            self.assertEqual([tuple(r) for r in loaded],
+                             [("md5a", "ACGT"), ("md5b", "GGCC"), ("md5c", None), ("md5d", None)])
+
+    def test_refresh_matviews(self):
+        """
+        refresh-matviews should refresh every matview after the matviews it depends on, including
+        through plain views.
+        """
+        self.session.execute(sa.text("""
+            create materialized view uta.a_mv as select gene_id from uta.gene with no data;
+            create view uta.a_v as select * from uta.a_mv;
+            create materialized view uta.b_mv as select * from uta.a_v with no data;
+            create materialized view uta.c_mv as select b.gene_id from uta.b_mv b join uta.a_mv a using (gene_id) with no data;
+            create materialized view uta.d_mv as select ac from uta.transcript with no data;
+            """))
+        self.session.add(usam.Gene(gene_id="1", hgnc="A", symbol="A"))
+        self.session.commit()
+
+        self.assertEqual(ul._matview_dependencies(self.session),
+                         {"a_mv": set(), "b_mv": {"a_mv"}, "c_mv": {"a_mv", "b_mv"}, "d_mv": set()})
+
+        with self.assertLogs("uta.loading", level="INFO") as cm:
+            ul.refresh_matviews(self.session, {"--workers": "2"}, self.cf)
+        done = [m.group(1) for m in (re.search(r"materialized view (\w+): done", line) for line in cm.output) if m]
+        self.assertEqual(sorted(done), ["a_mv", "b_mv", "c_mv", "d_mv"])
+        self.assertLess(done.index("a_mv"), done.index("b_mv"))
+        self.assertLess(done.index("b_mv"), done.index("c_mv"))
+        self.assertEqual(self.session.execute(sa.text("select gene_id from uta.c_mv")).fetchall(), [("1",)])
+
+    def test_refresh_matviews_incremental(self):
+        """
+        Summary tables should be rewritten in full by refresh-matviews, and with --incremental only
+        for the transcripts that loaders recorded in stale_tx.
+        """
+        o1 = usam.Origin(name="NCBI")
+        self.session.add_all([o1, usam.Origin(name="Ensembl"), usam.Gene(gene_id="1", hgnc="TEST", symbol="TEST")])
+        self.session.commit()
+        seqs = {"NM_1.1": "ACGT", "NM_2.1": "GGCC", "NC_1.1": "ACGTACGT"}
+        self._load_seqinfo_rows([("s1", "NCBI", "NM_1.1", "", "4"), ("s2", "NCBI", "NM_2.1", "", "4"),
+                                 ("s3", "NCBI", "NC_1.1", "", "8")], seqs)
+        for tx_ac in ["NM_1.1", "NM_2.1"]:
+            self.session.add(usam.Transcript(ac=tx_ac, origin_id=o1.origin_id, gene_id="1", hgnc="TEST",
+                                             cds_start_i=2, cds_end_i=8))
+        self.session.flush()
+        ul._upsert_exon_set_record(self.session, "NM_1.1", "NM_1.1", 1, "transcript", "0,5;5,10")
+        ul._upsert_exon_set_record(self.session, "NM_1.1", "NC_1.1", 1, "splign", "100,105;200,205")
+        ul._upsert_exon_set_record(self.session, "NM_2.1", "NM_2.1", 1, "transcript", "0,10")
+        self.session.commit()
+        ul.load_sql(self.session, {"FILES": ["sql/internal-views.sql", "sql/views.sql"]}, self.cf)
+
+        def _stale_tx():
+            return {ac for (ac,) in self.session.execute(sa.text("select tx_ac from uta.stale_tx"))}
+
+        def _assert_tables_match_views():
+            views = [(table, view) for table, (view, _) in ul._summary_tables.items()]
+            views += list(ul._summary_table_incremental_views.items())
+            for table, view in views:
+                n_diff = self.session.execute(sa.text(
+                    "select count(*) from ((table uta.{t} except all table uta.{v}) "
+                    "union all (table uta.{v} except all table uta.{t})) D".format(t=table, v=view))).scalar()
+                self.assertEqual(n_diff, 0, view)
+
+        self.assertEqual(_stale_tx(), {"NM_1.1", "NM_2.1"})
+        ul.refresh_matviews(self.session, {}, self.cf)
+        self.assertEqual(_stale_tx(), set())
+        self.assertEqual(self.session.execute(sa.text("select current_user")).scalar(), "uta_admin")
+        _assert_tables_match_views()
+        self.assertEqual(self.session.execute(sa.text("select count(*) from uta.tx_exon_aln_mv")).scalar(), 2)
+        self.assertEqual(sorted(tuple(r) for r in self.session.execute(sa.text(
+            "select tx_ac1, tx_ac2, hgnc_eq from uta.tx_similarity_v"))),
+            [("NM_1.1", "NM_2.1", True), ("NM_2.1", "NM_1.1", True)])
+
+        ul._upsert_exon_set_record(self.session, "NM_2.1", "NC_1.1", -1, "splign", "300,310")
+        self.session.commit()
+        self.assertEqual(_stale_tx(), {"NM_2.1"})
+        with self.assertLogs("uta.loading", level="INFO") as cm:
+            ul.refresh_matviews(self.session, {"--incremental": True}, self.cf)
+        self.assertIn("refresh summary table exon_set_exons_fp_mv (1 transcripts): done", "\n".join(cm.output))
+        self.assertIn("1 rows deleted, 2 inserted", "\n".join(cm.output))
+        self.assertEqual(_stale_tx(), set())
+        _assert_tables_match_views()
+        self.assertEqual(self.session.execute(sa.text("select count(*) from uta.tx_exon_aln_mv")).scalar(), 3)
+
+        # a newer sequence for NC_1.1 changes the fingerprints of exon sets on it
+        self._load_seqinfo_rows([("s4", "Ensembl", "NC_1.1", "", "8")], {"NC_1.1": "ACGTACGA"})
+        self.assertEqual(_stale_tx(), {"NM_1.1", "NM_2.1"})
+        ul.refresh_matviews(self.session, {"--incremental": True}, self.cf)
+        _assert_tables_match_views()
+        self.assertEqual(self.session.execute(sa.text(
+            "select array_agg(es_fingerprint = md5('s4;' || se_i)) from uta.exon_set_exons_fp_mv "
+            "where alt_ac = 'NC_1.1'")).scalar(), [True, True])
+
+        # a transcript marked again by a loader during the refresh stays stale
+        ul._mark_stale_tx(self.session, ["NM_1.1", "NM_2.1"])
+        self.session.commit()
+        refresh_summary_table = ul._refresh_summary_table
+
+        def _refresh_summary_table(engine, admin_role, table, tx_acs):
+            refresh_summary_table(engine, admin_role, table, tx_acs)
+            with sa.orm.Session(engine) as session:
+                ul._mark_stale_tx(session, ["NM_2.1"])
+                session.commit()
+
+        with patch("uta.loading._refresh_summary_table", side_effect=_refresh_summary_table):
+            ul.refresh_matviews(self.session, {"--incremental": True}, self.cf)
+        self.assertEqual(_stale_tx(), {"NM_2.1"})
+
+        # exon pairs without an alignment (a null exon_aln_id) are unique too
+        self.assertEqual(self.session.execute(sa.text(
+            "select count(*) from uta.tx_exon_aln_mv where exon_aln_id is null")).scalar(), 3)
+        with self.assertRaises(sa.exc.IntegrityError):
+            self.session.execute(sa.text("insert into uta.tx_exon_aln_mv select * from uta.tx_exon_aln_mv"))
+        self.session.rollback()
+
+    def _load_align_exons_fixture(self):
+        o1 = usam.Origin(name="NCBI")
+        g1 = usam.Gene(gene_id="1", hgnc="TEST", symbol="TEST")
+        self.session.add_all([o1, g1])
+        self.session.flush()
+        for tx_ac in ["NM_PLUS.1", "NM_MINUS.1", "NM_MISSING.1"]:
+            self.session.add(usam.Transcript(ac=tx_ac, origin_id=o1.origin_id, gene_id="1"))
+        self.session.flush()
+        for tx_ac, alt_ac, strand, method, ess in ALIGN_EXONS_EXON_SETS:
+            ul._upsert_exon_set_record(self.session, tx_ac, alt_ac, strand, method, ess)
+        self.session.execute(sa.text(TX_ALT_EXON_PAIRS_V_SQL))
+        self.session.commit()
+
+    def _align_exons(self, opts, seqs=ALIGN_EXONS_SEQS):
+        with patch("uta.loading._get_seqfetcher", return_value=FakeSeqFetcher(seqs)):
+            ul.align_exons(self.session, opts, self.cf)
+        self.session.commit()
+
+    def _exon_alns(self):
+        """return (tx_ac, alt_ac, ord, cigar) for each exon_aln, in insertion order"""
+        rows = self.session.execute(sa.text("""
+            select TES.tx_ac, AES.alt_ac, TE.ord, EA.cigar
+            from uta.exon_aln EA
+            join uta.exon TE on EA.tx_exon_id=TE.exon_id
+            join uta.exon AE on EA.alt_exon_id=AE.exon_id
+            join uta.exon_set TES on TE.exon_set_id=TES.exon_set_id
+            join uta.exon_set AES on AE.exon_set_id=AES.exon_set_id
+            order by EA.exon_aln_id"""))
+        return [tuple(r) for r in rows]
+
+    def test_align_exons(self):
+        """
+        align-exons should insert one exon_aln per exon pair with sequence, whatever the number of workers.
+        """
+        self._load_align_exons_fixture()
+        expected = [
+            ("NM_MINUS.1", "NC_TEST.1", 0, "20="),
+            ("NM_MINUS.1", "NC_TEST.1", 1, "20="),
+            ("NM_PLUS.1", "NC_TEST.1", 0, "20="),
+            ("NM_PLUS.1", "NC_TEST.1", 1, "5=1X14="),
+            ("NM_PLUS.1", "NC_TEST.1", 2, "15=1I14="),
+        ]
+
+        self._align_exons({})
+        self.assertEqual(self._exon_alns(), expected)
+
+        self.session.execute(sa.text("delete from uta.exon_aln"))
+        self.session.commit()
+        with patch("uta.loading._aln_fetch_size", 2):
+            self._align_exons({"--workers": "3", "--batch-size": "2"})
+        self.assertEqual(self._exon_alns(), expected)
+
+    def test_align_exons_memo(self):
+        """
+        align-exons should reuse memoized alignments instead of realigning.
+        """
+        self._load_align_exons_fixture()
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.cf.add_section("loading")
+        self.cf.set("loading", "aln_memo_file", os.path.join(tmpdir.name, "memo.sqlite"))
+
+        self._align_exons({})
+        expected = self._exon_alns()
+        self.assertEqual(len(expected), 5)
+
+        self.session.execute(sa.text("delete from uta.exon_aln"))
+        self.session.commit()
+        with patch("uta.loading.needleman_wunsch_gotoh_align", side_effect=AssertionError("should be memoized")):
+            self._align_exons({})
+        self.assertEqual(self._exon_alns(), expected)
+
+    def test_align_exons_resume(self):
+        """
+        align-exons should checkpoint each (tx_ac, alt_ac), resume from the queue without the view, and retry
+        only failed accessions.
+        """
+        self._load_align_exons_fixture()
+        self._align_exons({})
+        expected = self._exon_alns()
+        checkpoints = self.session.execute(sa.text(
+            "select tx_ac, alt_ac, status, reason, n_pairs from uta.align_exons_checkpoint order by tx_ac"))
+        self.assertEqual([tuple(r) for r in checkpoints], [
+            ("NM_MINUS.1", "NC_TEST.1", "done", None, 2),
+            ("NM_MISSING.1", "NC_TEST.1", "failed", "NM_MISSING.1: Not in sequence sources", 1),
+            ("NM_PLUS.1", "NC_TEST.1", "done", None, 3),
+        ])
+
+        # simulate a run interrupted before NM_PLUS.1 was committed
+        self.session.execute(sa.text("""
+            delete from uta.exon_aln EA using uta.exon E, uta.exon_set ES
+            where EA.tx_exon_id=E.exon_id and E.exon_set_id=ES.exon_set_id and ES.tx_ac='NM_PLUS.1'"""))
+        self.session.execute(sa.text("delete from uta.align_exons_checkpoint where tx_ac='NM_PLUS.1'"))
+        self.session.execute(sa.text("drop view uta.tx_alt_exon_pairs_v"))
+        self.session.commit()
+        self._align_exons({"--resume": True})
+        self.assertEqual(sorted(self._exon_alns()), sorted(expected))
+
+        self._align_exons({"--retry-failed": True})
+        self.assertEqual(sorted(self._exon_alns()), sorted(expected))
+
+        seqs = dict(ALIGN_EXONS_SEQS, **{"NM_MISSING.1": GENOME_SEQ[10:20]})
+        self._align_exons({"--retry-failed": True}, seqs=seqs)
+        self.assertEqual(sorted(self._exon_alns()), sorted(expected + [("NM_MISSING.1", "NC_TEST.1", 0, "10=")]))
+        status = self.session.execute(sa.text(
+            "select status from uta.align_exons_checkpoint where tx_ac='NM_MISSING.1'")).scalar()
+        self.assertEqual(status, "done")
+
+
+    def test_align_exons_shards(self):
+        """
+        align-exons shards should partition exon pairs by tx_ac, and verification should fail until all
+        shards are done.
+        """
+        self._load_align_exons_fixture()
+        self._align_exons({})
+        expected = self._exon_alns()
+        self.session.execute(sa.text("delete from uta.exon_aln"))
+        self.session.commit()
+
+        self._align_exons({"--shard": "1/2"})
+        shard1 = self._exon_alns()
+        with self.assertRaisesRegex(uta.exceptions.UTAError, "not done: 2/2"):
+            self._align_exons({"--verify-shards": "2"})
+
+        self._align_exons({"--shard": "2/2"})
+        shard2 = self._exon_alns()[len(shard1):]
+        self.assertFalse({r[0] for r in shard1} & {r[0] for r in shard2})
+        self.assertEqual(sorted(shard1 + shard2), sorted(expected))
+        self._align_exons({"--verify-shards": "2"})
+
+        self.session.execute(sa.text("delete from uta.exon_aln"))
+        self.session.commit()
+        with self.assertRaisesRegex(uta.exceptions.UTAError, "5 exon pairs remain unaligned"):
+            self._align_exons({"--verify-shards": "2"})
+
+        with self.assertRaises(uta.exceptions.UTAError):
+            self._align_exons({"--shard": "3/2"})
+
+
+    def test_align_exons_subset(self):
+        """
+        align-exons should align only the exon pairs selected by subset options.
+        """
+        self._load_align_exons_fixture()
+        self._align_exons({"--sql": "tx_ac like 'NM_P%'", "--alt-ac": "NC_TEST.1", "--alt-aln-method": "splign"})
+        self.assertEqual(self._exon_alns(), [
+            ("NM_PLUS.1", "NC_TEST.1", 0, "20="),
+            ("NM_PLUS.1", "NC_TEST.1", 1, "5=1X14="),
+            ("NM_PLUS.1", "NC_TEST.1", 2, "15=1I14="),
+        ])
+
+        self._align_exons({"--alt-aln-method": "blat"})
+        self.assertEqual(len(self._exon_alns()), 3)
+
+        with tempfile.NamedTemporaryFile("w", suffix=".txt") as fh:
+            fh.write("# panel\nNM_MINUS.1\n\n")
+            fh.flush()
+            self._align_exons({"--tx-ac-file": fh.name})
+        self.assertEqual(self._exon_alns()[3:], [
+            ("NM_MINUS.1", "NC_TEST.1", 0, "20="),
+            ("NM_MINUS.1", "NC_TEST.1", 1, "20="),
+        ])
+
+        with self.assertRaises(uta.exceptions.UTAError):
+            self._align_exons({"--alt-ac": "NC_TEST.1", "--resume": True})
+
+    def test_align_exons_sql_predicate(self):
+        """
+        align-exons --sql predicates should reach the server as given, with or without other subset options.
+        """
+        self._load_align_exons_fixture()
+        pred = "tx_ac like 'NM_%' and alt_aln_method not like '%s'"
+        for opts in [{}, {"--alt-ac": "NC_TEST.1"}]:
+            expected = self.session.execute(sa.text(
+                "select count(*) from uta.tx_alt_exon_pairs_v where exon_aln_id is null and ({pred}){alt_ac}".format(
+                    pred=pred, alt_ac=" and alt_ac = 'NC_TEST.1'" if opts else ""))).scalar()
+            self.assertGreater(expected, 0)
+            with self.assertLogs("uta.loading", level="INFO") as cm:
+                self._align_exons(dict(opts, **{"--sql": pred}))
+            self.assertIn("queued {} exon pairs".format(expected), "\n".join(cm.output))
+            self.session.execute(sa.text("delete from uta.exon_aln"))
+            self.session.commit()
+
+
 class TestUtaLoadingFunctions(unittest.TestCase):
     def test__create_translation_exceptions(self):
         transl_except_list = ['(pos:333..335,aa:Sec)', '(pos:1017,aa:TERM)']
@@ -443,3 +1169,73 @@ class TestUtaLoadingFunctions(unittest.TestCase):
                 'amino_acid': 'TERM',
             },
         ])
+
+    def test__ungapped_cigar(self):
+        """
+        The ungapped fast path should produce the same CIGARs as needleman_wunsch_gotoh_align, and be used
+        only for equal-length sequences with few mismatches.
+        """
+        rng = random.Random(1)
+        pairs = []
+        for _ in range(500):
+            n = rng.randint(1, 60)
+            start = rng.randint(0, len(GENOME_SEQ) - n)
+            seq = GENOME_SEQ[start:start + n]
+            mutated = list(seq)
+            for pos in rng.sample(range(n), min(n, rng.randint(0, 4))):
+                mutated[pos] = rng.choice("ACGT".replace(seq[pos], ""))
+            pairs.append((seq, "".join(mutated)))
+        # low-complexity sequences, for which gapped alignments compete
+        pairs += [
+            ("AAAAAAAAAT", "AAAAAAAAAA"),
+            ("ACACACACAC", "CACACACACA"),
+            ("ATATATGCGC", "ATATAGCGCG"),
+            ("ACGTACGTAC", "ACGTACGTA"),
+        ]
+
+        n_ungapped = 0
+        for tx_seq, alt_seq in pairs:
+            cigar_str = ul._ungapped_cigar(tx_seq, alt_seq)
+            n_mismatches = sum(a != b for a, b in zip(tx_seq, alt_seq))
+            self.assertEqual(cigar_str is not None, len(tx_seq) == len(alt_seq) and n_mismatches <= 2)
+            if cigar_str is not None:
+                _, cigar = needleman_wunsch_gotoh_align(tx_seq.encode("ascii"), alt_seq.encode("ascii"),
+                                                        extended_cigar=True)
+                self.assertEqual(cigar_str, cigar.to_string().decode("ascii"))
+                n_ungapped += 1
+        self.assertGreater(n_ungapped, 100)
+
+    def test__banded_cigar(self):
+        """
+        Banded alignments should produce the same CIGARs as needleman_wunsch_gotoh_align whenever they are
+        returned, and None when the band can't be shown to contain the optimal alignment.
+        """
+        rng = random.Random(2)
+        n_banded = 0
+        for _ in range(100):
+            n = rng.randint(200, 800)
+            tx_seq = "".join(rng.choice("ACGT") for _ in range(n))
+            alt_seq = list(tx_seq)
+            for pos in rng.sample(range(n), rng.randint(0, n // 20)):
+                alt_seq[pos] = rng.choice("ACGT".replace(alt_seq[pos], ""))
+            for _ in range(rng.randint(0, 3)):
+                pos, length = rng.randrange(len(alt_seq)), rng.randint(1, 6)
+                if rng.random() < 0.5:
+                    del alt_seq[pos:pos + length]
+                else:
+                    alt_seq[pos:pos] = rng.choices("ACGT", k=length)
+            alt_seq = "".join(alt_seq)
+            cigar_str = ul._banded_cigar(tx_seq, alt_seq, margin=rng.choice([4, 16]))
+            if cigar_str is not None:
+                _, cigar = needleman_wunsch_gotoh_align(tx_seq.encode("ascii"), alt_seq.encode("ascii"),
+                                                        extended_cigar=True)
+                self.assertEqual(cigar_str, cigar.to_string().decode("ascii"))
+                n_banded += 1
+        self.assertGreater(n_banded, 50)
+
+        # unrelated sequences can't be banded
+        tx_seq = "".join(rng.choice("ACGT") for _ in range(500))
+        alt_seq = "".join(rng.choice("ACGT") for _ in range(500))
+        self.assertIsNone(ul._banded_cigar(tx_seq, alt_seq, margin=16))
+        with patch("uta.loading._aln_band_min_len", 100):
+            self.assertEqual(ul._align_exon_seqs(tx_seq, alt_seq)[1], "nw")
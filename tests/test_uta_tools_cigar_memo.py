@@ -0,0 +1,44 @@
+import os
+import tempfile
+import unittest
+
+from uta.tools.cigar_memo import CigarMemo
+
+
+class TestCigarMemo(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, "memo.sqlite")
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_digest(self):
+        d = CigarMemo.digest("ACGT", "ACGA", 1)
+        self.assertEqual(d, CigarMemo.digest("ACGT", "ACGA", 1))
+        self.assertNotEqual(d, CigarMemo.digest("ACGT", "ACGA", -1))
+        self.assertNotEqual(d, CigarMemo.digest("ACG", "TACGA", 1))
+
+    def test_persistence(self):
+        memo = CigarMemo(self.path, "p1")
+        memo.update([("d1", "4="), ("d2", "3=1X")])
+        self.assertEqual(memo.get("d1"), "4=")
+        memo.close()
+
+        memo = CigarMemo(self.path, "p1")
+        ro_memo = CigarMemo(self.path, "p1", readonly=True)
+        self.assertEqual(len(memo), 2)
+        self.assertEqual(ro_memo.get("d2"), "3=1X")
+        self.assertIsNone(ro_memo.get("d3"))
+
+        # readers see committed updates from the writer
+        memo.update([("d3", "1I3=")])
+        self.assertEqual(ro_memo.get("d3"), "1I3=")
+
+    def test_params_changed(self):
+        memo = CigarMemo(self.path, "p1")
+        memo.update([("d1", "4=")])
+        memo.close()
+
+        memo = CigarMemo(self.path, "p2")
+        self.assertEqual(len(memo), 0)
@@ -0,0 +1,61 @@
+import gzip
+import os
+import tempfile
+import unittest
+
+from Bio import bgzf
+
+from uta.tools.file_utils import InputFile
+
+
+class TestInputFile(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.lines = ["col1\tcol2\n"] + ["row{i}\t{i}\n".format(i=i) for i in range(20000)]
+        self.text = "".join(self.lines)
+
+    def _path(self, name):
+        return os.path.join(self.tmpdir.name, name)
+
+    def test_plain_gzip_bgzip(self):
+        """
+        Plain, gzip, and bgzip files should yield the same lines, with compression detected from contents.
+        """
+        with open(self._path("plain.txt"), "w") as fh:
+            fh.write(self.text)
+        with gzip.open(self._path("gzip.txt"), "wt") as fh:
+            fh.write(self.text)
+        with bgzf.BgzfWriter(self._path("bgzip.gz"), "wb") as fh:
+            fh.write(self.text.encode("utf-8"))
+
+        for name, compression in [("plain.txt", None), ("gzip.txt", "gzip"), ("bgzip.gz", "bgzip")]:
+            with InputFile(self._path(name)) as fh:
+                self.assertEqual(fh.compression, compression)
+                self.assertEqual(fh.progress(), 0)
+                self.assertEqual(fh.readline(), self.lines[0])
+                self.assertEqual(list(fh), self.lines[1:])
+                self.assertEqual(fh.progress(), 1.0)
+
+    def test_progress(self):
+        """
+        Progress should increase with compressed bytes consumed while streaming.
+        """
+        with gzip.open(self._path("gzip.txt"), "wt") as fh:
+            fh.write(self.text)
+        progress = []
+        with InputFile(self._path("gzip.txt")) as fh:
+            for i, line in enumerate(fh):
+                if i % 1000 == 0:
+                    progress.append(fh.progress())
+        self.assertEqual(progress, sorted(progress))
+        self.assertLess(progress[0], 1.0)
+        self.assertGreater(progress[-1], progress[0])
+
+    def test_empty(self):
+        with open(self._path("empty.txt"), "w"):
+            pass
+        with InputFile(self._path("empty.txt")) as fh:
+            self.assertEqual(list(fh), [])
+            self.assertEqual(fh.progress(), 1.0)
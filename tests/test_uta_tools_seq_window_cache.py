@@ -0,0 +1,89 @@
+import unittest
+from unittest.mock import Mock
+
+from uta.tools.seq_window_cache import SeqWindowCache
+
+
+SEQS = {
+    "NC_1": "ACGTACGTAACCGGTTACGT",
+    "NM_1": "GGGCCCAAATTT",
+}
+
+
+class TestSeqWindowCache(unittest.TestCase):
+    def setUp(self):
+        self.sf = Mock(fetch=Mock(side_effect=lambda ac, start=None, end=None: SEQS[ac][start:end]))
+
+    def test_fetch_from_window(self):
+        cache = SeqWindowCache(self.sf, max_bytes=100)
+        cache.prefetch("NC_1", 2, 15)
+        self.assertEqual(cache.fetch("NC_1", 4, 8), SEQS["NC_1"][4:8])
+        self.assertEqual(cache.fetch("NC_1", 2, 15), SEQS["NC_1"][2:15])
+        self.assertEqual(self.sf.fetch.call_count, 1)
+        self.assertEqual(cache.stats["hits"], 2)
+        self.assertEqual(cache.stats["misses"], 1)      # the prefetch
+
+        # outside the window
+        self.assertEqual(cache.fetch("NC_1", 10, 20), SEQS["NC_1"][10:20])
+        self.assertEqual(cache.stats["misses"], 2)
+        self.assertEqual(self.sf.fetch.call_count, 2)
+
+        # a prefetch covered by a cached window is a hit
+        cache.prefetch("NC_1", 12, 18)
+        self.assertEqual((cache.stats["hits"], cache.stats["misses"]), (3, 2))
+        self.assertEqual(self.sf.fetch.call_count, 2)
+
+    def test_whole_sequence(self):
+        cache = SeqWindowCache(self.sf, max_bytes=100)
+        cache.prefetch("NM_1")
+        self.assertEqual(cache.fetch("NM_1", 3, 6), "CCC")
+        self.assertEqual(cache.fetch("NM_1"), SEQS["NM_1"])
+        self.assertEqual(self.sf.fetch.call_count, 1)
+
+    def test_eviction(self):
+        cache = SeqWindowCache(self.sf, max_bytes=25)
+        cache.prefetch("NC_1")           # 20
+        cache.prefetch("NM_1")           # 12; evicts NC_1
+        self.assertEqual(cache.stats["evictions"], 1)
+        cache.fetch("NM_1", 0, 3)
+        cache.fetch("NC_1", 0, 3)
+        self.assertEqual((cache.stats["hits"], cache.stats["misses"]), (1, 3))
+
+    def test_window_larger_than_budget(self):
+        cache = SeqWindowCache(self.sf, max_bytes=10)
+        self.assertEqual(cache.fetch("NC_1"), SEQS["NC_1"])
+        self.assertEqual(cache.fetch("NC_1", 0, 5), SEQS["NC_1"][0:5])
+        self.assertEqual(cache.stats["misses"], 2)
+
+    def test_overlapping_windows(self):
+        cache = SeqWindowCache(self.sf, max_bytes=100)
+        cache.prefetch("NC_1", 0, 20)
+        cache.prefetch("NC_1", 5, 8)            # covered by the first window
+        cache.fetch("NC_1", 6, 9)               # loads 6..9
+        self.assertEqual(cache.fetch("NC_1", 7, 12), SEQS["NC_1"][7:12])
+        self.assertEqual(cache.fetch("NC_1", 6, 8), SEQS["NC_1"][6:8])
+        self.assertEqual(self.sf.fetch.call_count, 1)
+
+    def test_eviction_of_one_of_several_windows(self):
+        cache = SeqWindowCache(self.sf, max_bytes=10)
+        cache.prefetch("NC_1", 0, 4)
+        cache.prefetch("NC_1", 4, 8)
+        cache.prefetch("NC_1", 8, 12)           # evicts 0..4
+        self.assertEqual(cache.stats["evictions"], 1)
+        self.assertEqual(cache.fetch("NC_1", 5, 7), SEQS["NC_1"][5:7])
+        self.assertEqual(cache.fetch("NC_1", 1, 3), SEQS["NC_1"][1:3])
+        self.assertEqual(self.sf.fetch.call_count, 4)
+
+    def test_reset_stats(self):
+        cache = SeqWindowCache(self.sf, max_bytes=100)
+        cache.prefetch("NM_1")
+        cache.fetch("NM_1", 0, 3)
+        self.assertEqual(cache.reset_stats(), {"hits": 1, "misses": 1, "windows": 1, "bytes": 12})
+        self.assertEqual(cache.stats, {})
+        cache.fetch("NM_1", 3, 6)
+        self.assertEqual(cache.reset_stats(), {"hits": 1})
+
+    def test_missing_accession(self):
+        cache = SeqWindowCache(self.sf, max_bytes=100)
+        with self.assertRaises(KeyError):
+            cache.prefetch("NM_MISSING")